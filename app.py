@@ -1,21 +1,40 @@
-from flask import Flask, request
-import os
-from linebot import LineBotApi, WebhookHandler
-from linebot.exceptions import LineBotApiError
-from linebot.models import (
-    MessageEvent, TextMessage, TextSendMessage,
-    TemplateSendMessage, ButtonsTemplate, PostbackAction,
-    PostbackEvent, QuickReply, QuickReplyButton, MessageAction
-)
-import schedule
 import time
+
+# 起動にかかった時間（/stats の startup）。import の前から測る
+STARTED_AT = time.perf_counter()
+
+from flask import Flask, Response, abort, jsonify, request
+import os
 from datetime import datetime, timedelta
-import requests
-from bs4 import BeautifulSoup
 from dotenv import load_dotenv
-import threading
+from functools import lru_cache, partial, wraps
+import atexit
+import copy
 import re
-from difflib import get_close_matches
+import threading
+
+import approach_parser
+from clock import SYSTEM_CLOCK
+from delivery import DeliveryQueue
+from event_queue import InvalidSignatureError, QueuedWebhookHandler, QueueFullError, WebhookChannel
+from fetcher import FetchError, HttpFetcher
+from lazy import LazyModule, LazyObject
+from leader import LeaderLock
+from logs import get_logger
+import metrics
+from monitor import AdaptiveCadence, MonitorEngine
+from scheduler import DAILY, ONCE, REPEAT_LABELS, JobScheduler, next_departure
+from shard import ShardMember, ShardPublisher, ShardRegistry
+from snapshots import ApproachRecord, format_record, lead
+from state_store import open_store
+from stop_catalog import load_catalog
+from stop_index import StopIndex
+from timetable import TimetableCache
+from travel_times import EtaTable, ObservationLog, aggregate, minute_of_day
+from upstream import ADMIT, CircuitBreaker, UpstreamGate
+
+# 起動の内訳（ミリ秒）: import / モジュールの初期化 / start_worker（状態の読み込みと監視の復元）
+STARTUP = {"import_ms": round((time.perf_counter() - STARTED_AT) * 1e3, 1)}
 
 # ================================================================
 #  環境変数 & 初期設定
@@ -25,12 +44,84 @@ load_dotenv()
 
 app = Flask(__name__)
 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
 LINE_CHANNEL_SECRET = os.getenv('LINE_CHANNEL_SECRET')
 LINE_CHANNEL_ACCESS_TOKEN = os.getenv('LINE_CHANNEL_ACCESS_TOKEN')
-BUSVISION_BASE_URL = "https://bus-vision.jp/sanco/view/"
+BUSVISION_BASE_URL = os.getenv("BUSVISION_BASE_URL", "https://bus-vision.jp/sanco/view/")
+
+LINE_API_ENDPOINT = os.getenv("LINE_API_ENDPOINT", "https://api.line.me")
+
+# LINE SDK（linebot / requests で 80ms ほど）は最初のメッセージを作る・送るときに読み込む
+models = LazyModule("linebot.models")
+
+log = get_logger("app")
+
+# ピーク時にどこで時間を使っているかを見るためのヒストグラム（/metrics）
+FETCH_SECONDS = metrics.histogram("busvision_fetch_seconds", "Bus-Vision approach.html の取得時間（リトライ込み）")
+FETCH_ERRORS = metrics.counter("busvision_fetch_errors_total", "リトライしても取得できなかった回数")
+PARSE_SECONDS = metrics.histogram("approach_parse_seconds", "approach.html の解析時間")
+LINE_SECONDS = metrics.histogram("line_api_seconds", "LINE Messaging API の呼び出し時間", labelnames=("method",))
+WEBHOOK_SECONDS = metrics.histogram("webhook_ack_seconds", "/callback の応答時間（署名検証とキュー投入）")
+
+
+def _line_bot_api(token, endpoint):
+    from linebot import LineBotApi
+    return LineBotApi(token, endpoint=endpoint)
+
+
+class TimedLineBotApi:
+    """reply / push / multicast の所要時間を line_api_seconds に記録する
+
+    LineBotApi は最初に呼ばれたときに作る（それまで linebot を読み込まない）
+    """
 
-line_bot_api = LineBotApi(LINE_CHANNEL_ACCESS_TOKEN)
-handler = WebhookHandler(LINE_CHANNEL_SECRET)
+    def __init__(self, channel_access_token, endpoint=LINE_API_ENDPOINT):
+        self.api = LazyObject(partial(_line_bot_api, channel_access_token, endpoint))
+
+    def __copy__(self):
+        # DeliveryQueue はワーカーごとに copy してヘッダを分ける
+        other = TimedLineBotApi.__new__(TimedLineBotApi)
+        other.api = copy.copy(self.api.get())
+        return other
+
+    @property
+    def headers(self):
+        return self.api.headers
+
+    @headers.setter
+    def headers(self, value):
+        self.api.headers = value
+
+    def reply_message(self, *args, **kwargs):
+        with LINE_SECONDS.labels("reply").time():
+            return self.api.reply_message(*args, **kwargs)
+
+    def push_message(self, *args, **kwargs):
+        with LINE_SECONDS.labels("push").time():
+            return self.api.push_message(*args, **kwargs)
+
+    def multicast(self, *args, **kwargs):
+        with LINE_SECONDS.labels("multicast").time():
+            return self.api.multicast(*args, **kwargs)
+
+
+line_bot_api = TimedLineBotApi(LINE_CHANNEL_ACCESS_TOKEN, endpoint=LINE_API_ENDPOINT)
+# Webhook は署名検証してキューに積んだら即 200 を返す（処理は利用者ごとに順序を保つワーカーで行う）
+handler = QueuedWebhookHandler(
+    LINE_CHANNEL_SECRET,
+    workers=int(os.getenv("EVENT_WORKERS", "8")),
+    max_queue=int(os.getenv("EVENT_QUEUE_SIZE", "1000")),
+)
+
+# single: 1 プロセスで全部行う / cluster: gunicorn の複数ワーカー（gunicorn.conf.py）
+# monitor: 路線を分担してポーリングするだけの監視ワーカー（gunicorn.conf.py が MONITOR_PROCESSES 個起動する）
+APP_ROLE = os.getenv("APP_ROLE", "single")
+# cluster のときにワーカー間で共有するファイル（Webhook のチャネル・担当ロック・路線の分担）の置き場所
+CLUSTER_DIR = os.getenv("CLUSTER_DIR", BASE_DIR)
+# 1 以上なら cluster の担当ワーカーは監視対象を書くだけで、ポーリングは監視ワーカーが行う
+MONITOR_PROCESSES = int(os.getenv("MONITOR_PROCESSES", "0"))
+SHARDED = APP_ROLE == "monitor" or (APP_ROLE == "cluster" and MONITOR_PROCESSES > 0)
 
 # ================================================================
 #  定数
@@ -39,50 +130,35 @@ handler = WebhookHandler(LINE_CHANNEL_SECRET)
 # よく使う発車時刻を固定で持つ（ユーザー要望）
 PRESET_TIMES = ["08:17", "18:03"]
 
-# 停留所データを大幅に拡充
-STOP_CODES = {
-    # 既存の停留所
-    "乙部朝日": "4403",
-    "藤枝東": "4372",
-    "イオンモール津南": "4356",
-    "三重会館前": "4008",
-    "堀川町": "4402",
-    "津駅前": "4001",
-    
-    # 新規追加の停留所
-    "御殿場口": "4010",
-    "京口立町": "4012",
-    "津新町駅前": "4005",
-    "津市役所前": "4009",
-    "観音寺": "4015",
-    "片田": "4018",
-    "高茶屋": "4025",
-    "久居駅前": "4030",
-    "榊原温泉口": "4035",
-    "一身田": "4040",
-    "白塚駅前": "4045",
-    "河芸駅前": "4050",
-    "安濃津": "4055",
-    "雲出": "4060",
-    "香良洲": "4065",
-    "嬉野": "4070",
-    "中川": "4075",
-    "一志": "4080",
-    "松阪駅前": "4085",
-    "伊勢中川": "4090",
-    "明和町": "4095",
-    "斎宮": "4100",
-    "小俣": "4105",
-    "伊勢市駅前": "4110",
-    "外宮前": "4115",
-    "内宮前": "4120"
-}
-
-# 人気の停留所（使用頻度が高いと想定）
-POPULAR_STOPS = [
-    "津駅前", "乙部朝日", "藤枝東", "イオンモール津南", 
-    "三重会館前", "御殿場口", "京口立町", "津新町駅前"
-]
+# 監視するのは乗車時刻の 7 分前から 5 分後まで
+MONITOR_LEAD = timedelta(minutes=7)
+MONITOR_TAIL = timedelta(minutes=5)
+
+# 停留所マスタ（name, code, reading, lat, lon, popular）。初回起動時にコンパイルして mmap する
+STOP_MASTER_PATH = os.getenv("STOP_MASTER_PATH", os.path.join(BASE_DIR, "data", "stops.csv"))
+STOP_CATALOG = load_catalog(STOP_MASTER_PATH, os.getenv("STOP_CATALOG_CACHE_DIR"))
+
+# 人気の停留所（マスタの popular 列の順）
+POPULAR_STOPS = STOP_CATALOG.popular()
+
+# 時刻表のキャッシュ（SQLite ファイルのパス、または "memory"）。毎日 TIMETABLE_REFRESH_AT に取り直す。
+# 乗車時刻の前後 TIMETABLE_MATCH_MINUTES 分以内の便に監視時間を合わせ、便が無ければ監視しない
+TIMETABLE_STORE_PATH = os.getenv("TIMETABLE_STORE", os.path.join(BASE_DIR, "timetables.db"))
+TIMETABLE_REFRESH_AT = datetime.strptime(os.getenv("TIMETABLE_REFRESH_AT", "03:30"), "%H:%M").time()
+TIMETABLE_MATCH = timedelta(minutes=float(os.getenv("TIMETABLE_MATCH_MINUTES", "10")))
+TIMETABLE_FETCH_PAUSE = float(os.getenv("TIMETABLE_FETCH_PAUSE", "1"))
+TIMETABLE_PRIORITY = float("inf")   # 乗車時刻に関係しないので監視より後（足りなければ待たずに見送る）
+TIMETABLE_HOLIDAYS = [datetime.strptime(d, "%Y-%m-%d").date()
+                      for d in os.getenv("TIMETABLE_HOLIDAYS", "").split(",") if d.strip()]
+
+# バスの通過記録の置き場所（"off" なら記録しない）。毎日 ETA_AGGREGATE_AT に過去 ETA_WINDOW_DAYS 日分を
+# 集計して、到着までの目安（EtaTable）を通知に添える
+OBSERVATION_DIR = os.getenv("OBSERVATION_LOG", os.path.join(BASE_DIR, "observations"))
+ETA_AGGREGATE_AT = datetime.strptime(os.getenv("ETA_AGGREGATE_AT", "03:45"), "%H:%M").time()
+ETA_WINDOW_DAYS = int(os.getenv("ETA_WINDOW_DAYS", "28"))
+
+# 利用者の状態の保存先（SQLite ファイルのパス、または "memory"）
+STATE_STORE_PATH = os.getenv("STATE_STORE", os.path.join(BASE_DIR, "state.db"))
 
 # ================================================================
 #  BusVision ラッパークラス
@@ -91,9 +167,10 @@ POPULAR_STOPS = [
 class BusVisionSession:
     """Bus-Vision のスクレイピングを行うセッション管理クラス"""
 
-    def __init__(self):
-        self.session = requests.Session()
-        # 利用者ごとの最新接近情報キャッシュ
+    def __init__(self, fetcher=None):
+        self.fetcher = fetcher or HttpFetcher.from_env(os.environ)
+        self._stop_index = None
+        # 利用者ごとに最後に通知した ApproachRecord
         self.user_last_approach_info = {}
 
     # ------------------------------------------------------------
@@ -102,24 +179,18 @@ class BusVisionSession:
 
     @staticmethod
     def get_stop_code(stop_name):
-        return STOP_CODES.get(stop_name)
-
-    def search_similar_stops(self, input_text: str, max_results: int = 5):
-        """入力に近い停留所候補を返す（完全一致→部分一致→類似度）"""
-        if not input_text:
-            return []
-
-        # 完全一致優先
-        if input_text in STOP_CODES:
-            return [input_text]
+        return STOP_CATALOG.code_for(stop_name)
 
-        # 部分一致
-        partial = [s for s in STOP_CODES if input_text in s or s in input_text]
-        if partial:
-            return partial[:max_results]
+    @property
+    def stop_index(self):
+        """検索インデックスは最初の検索時に作る（起動を軽くするため）"""
+        if self._stop_index is None:
+            self._stop_index = StopIndex((s.name, (s.reading,)) for s in STOP_CATALOG.stops())
+        return self._stop_index
 
-        # 類似度
-        return get_close_matches(input_text, STOP_CODES.keys(), n=max_results, cutoff=0.6)
+    def search_similar_stops(self, input_text: str, max_results: int = 5):
+        """入力に近い停留所候補を返す（完全一致→部分一致→類似度。表記ゆれは正規化して比較）"""
+        return self.stop_index.search(input_text, max_results)
 
     # ------------------------------------------------------------
     #  Bus-Vision へのリクエスト
@@ -129,9 +200,12 @@ class BusVisionSession:
         """Bus-Vision の approach.html へアクセスし HTML を返す"""
         from_code, to_code = map(self.get_stop_code, (from_stop, to_stop))
         if not (from_code and to_code):
-            print("[DEBUG]search_bus: 停留所コードが見つかりません。")
+            log.debug("search_bus.unknown_stop", from_stop=from_stop, to_stop=to_stop)
             return None
+        return self.fetch_approach(from_code, to_code)
 
+    def fetch_approach(self, from_code: str, to_code: str):
+        """停留所コードの組 (stopCdFrom, stopCdTo) で approach.html を取得する"""
         params = {
             "stopCdFrom": from_code,
             "stopCdTo": to_code,
@@ -145,12 +219,25 @@ class BusVisionSession:
         }
 
         try:
-            r = self.session.get(f"{BUSVISION_BASE_URL}approach.html", params=params)
-            r.raise_for_status()
-            print(f"[DEBUG]search_bus: リクエスト成功 URL={r.url}")
+            with FETCH_SECONDS.time():
+                r = self.fetcher.get(f"{BUSVISION_BASE_URL}approach.html", params=params)
+            log.debug("fetch_approach.ok", url=r.url)
             return r.text
-        except Exception as e:
-            print(f"[DEBUG]search_bus: エラー {e}")
+        except FetchError as e:
+            FETCH_ERRORS.inc()
+            log.warning("fetch_approach.error", route=f"{from_code}-{to_code}", error=e)
+            return None
+
+    def fetch_timetable(self, from_code: str, to_code: str):
+        """停留所コードの組で timetable.html を取得する（1 日 1 回。失敗は None）"""
+        try:
+            r = self.fetcher.get(f"{BUSVISION_BASE_URL}timetable.html",
+                                 params={"stopCdFrom": from_code, "stopCdTo": to_code, "lang": "0"})
+            log.debug("fetch_timetable.ok", url=r.url)
+            return r.text
+        except FetchError as e:
+            FETCH_ERRORS.inc()
+            log.warning("fetch_timetable.error", route=f"{from_code}-{to_code}", error=e)
             return None
 
     # ------------------------------------------------------------
@@ -158,33 +245,34 @@ class BusVisionSession:
     # ------------------------------------------------------------
 
     def extract_bus_info(self, html_content: str, user_id: str):
-        """HTML から接近中のバス（number=1）の情報をパースする"""
+        """HTML から接近中のバス（number=1）の情報をパースし、変化があれば表示用文字列を返す"""
+        record = self.update_user_info(user_id, lead(self.parse_snapshot(html_content)))
+        return format_record(record) if record else None
+
+    @staticmethod
+    def parse_snapshot(html_content: str):
+        """HTML から全バスの ApproachRecord タプルを作る（利用者に依存しない）"""
         if not html_content:
-            print("[DEBUG]extract_bus_info: HTML が空")
+            log.debug("parse_snapshot.empty")
             return None
 
-        soup = BeautifulSoup(html_content, "html.parser")
-        if soup.find("div", id="errorMsg", class_="errorMsg"):
-            print("[DEBUG]extract_bus_info: 接近情報なし")
-            return None
+        with PARSE_SECONDS.time():
+            snapshot = approach_parser.parse_approach(html_content)
+        if not snapshot:
+            log.debug("parse_snapshot.no_approach")
+        return snapshot
 
-        for a in soup.find_all("div", class_="approachData"):
-            number = a.find("span", id="number")
-            if number and number.get_text(strip=True) == "1":
-                approach = a.find("div", id="approachInfo")
-                passed = a.find("span", id="passInfo")
-                if approach and passed:
-                    time_part, _, remainder = approach.get_text(strip=True).partition("に")
-                    stop_name = remainder.replace("を通過", "")
-                    pass_cnt = passed.get_text(strip=True).replace("を通過", "")
-                    result = f"🚎 {time_part}\n{stop_name}を通過\n（{pass_cnt}）"
-
-                    if self.user_last_approach_info.get(user_id) != result:
-                        self.user_last_approach_info[user_id] = result
-                        print(f"[DEBUG]extract_bus_info: user={user_id} update -> {result}")
-                        return result
-                    else:
-                        print("[DEBUG]extract_bus_info: 変化なし")
+    def update_user_info(self, user_id: str, record):
+        """利用者ごとに最後に通知したレコードと比べ、変化があったときだけ record を返す"""
+        if not record:
+            return None
+        last = self.user_last_approach_info.get(user_id)
+        if last is not record and last != record:
+            # 路線で共有しているスナップショット内のレコードを参照するだけ
+            self.user_last_approach_info[user_id] = record
+            log.debug("update_user_info.changed", user=user_id, record=record)
+            return record
+        log.debug("update_user_info.unchanged", user=user_id)
         return None
 
     # ------------------------------------------------------------
@@ -193,16 +281,75 @@ class BusVisionSession:
 
     def clear_user_info(self, user_id):
         self.user_last_approach_info.pop(user_id, None)
-        print(f"[DEBUG]clear_user_info: user={user_id} cache cleared")
+        log.debug("clear_user_info", user=user_id)
 
 # ================================================================
 #  グローバル状態
 # ================================================================
 
 bus_session = BusVisionSession()
+
+
+def fetch_timetable(from_code, to_code):
+    """時刻表の取得も監視と同じ upstream_gate を通す（予算が余っているときだけ。通らなければ FetchError）"""
+    if upstream_gate.admit(TIMETABLE_PRIORITY) != ADMIT:
+        raise FetchError(f"timetable {from_code}-{to_code}: upstream busy")
+    started = time.monotonic()
+    html = bus_session.fetch_timetable(from_code, to_code)
+    upstream_gate.record(html is not None, time.monotonic() - started)
+    return html
+
+
+timetable_cache = TimetableCache(TIMETABLE_STORE_PATH, fetch_timetable,
+                                 holidays=TIMETABLE_HOLIDAYS, match=TIMETABLE_MATCH,
+                                 on_failure=lambda route: schedule_timetable_retry())
+atexit.register(timetable_cache.close)
+
+observation_log = None
+eta_table = EtaTable(holidays=TIMETABLE_HOLIDAYS)
+if OBSERVATION_DIR != "off":
+    observation_log = ObservationLog(OBSERVATION_DIR)
+    atexit.register(observation_log.close)
+    eta_table = EtaTable.load(os.path.join(OBSERVATION_DIR, "eta.json"), TIMETABLE_HOLIDAYS)
 user_settings = {}   # user_id -> {boarding, alighting, time}
 user_status   = {}   # user_id -> state machine
-user_active_jobs = {}  # user_id -> {job, departure_time, monitoring_thread}
+user_active_jobs = {}  # user_id -> {job, departure_time, route, repeat[, active_departure]}
+
+state_store = open_store(STATE_STORE_PATH, lock_stripes=int(os.getenv("STATE_LOCK_STRIPES", "256")))
+atexit.register(state_store.close)
+
+
+def user_lock(user_id):
+    """利用者 1 人分の設定・対話状態・監視予定をまとめて読み書きする間のロック
+
+    Webhook の処理（利用者ごとに順番）と、スケジューラ・監視エンジンのスレッドから呼ばれる
+    開始・終了処理が同じ利用者の状態を同時に書き換えないようにする。別の利用者どうしは待たない。
+    ストライプはほかの利用者と共有なので、持っている間に LINE への返信や Bus-Vision の取得をしない。
+    """
+    return state_store.lock(user_id)
+
+
+def load_state():
+    """保存されていた状態を読み戻す（以降は StateStore に書き戻される dict。書き込みはまとめて非同期に反映）"""
+    global user_settings, user_status, user_active_jobs
+    bus_session.user_last_approach_info = state_store.table("last_approach", decode=lambda v: ApproachRecord(*v))
+    user_settings = state_store.table("settings")
+    user_status = state_store.table("status")
+    # job は再起動のたびに作り直すので保存しない
+    user_active_jobs = state_store.table(
+        "jobs",
+        # active_departure: 繰り返し設定でいま監視している回（departure_time はもう次回を指している）
+        encode=lambda v: {"departure_time": v["departure_time"], "route": v["route"], "repeat": v["repeat"],
+                          **({"active_departure": v["active_departure"]} if v.get("active_departure") else {})},
+        decode=lambda v: {**v, "route": tuple(v["route"]), "job": None},
+    )
+
+# LINE への push はキュー経由（監視ループを送信で止めない / 同じ内容は multicast にまとめる）
+delivery = DeliveryQueue(
+    line_bot_api,
+    workers=int(os.getenv("DELIVERY_WORKERS", "4")),
+    rate=float(os.getenv("LINE_PUSH_RATE", "100")),
+)
 
 # ================================================================
 #  Flask Routes
@@ -212,41 +359,97 @@ user_active_jobs = {}  # user_id -> {job, departure_time, monitoring_thread}
 def callback():
     signature = request.headers["X-Line-Signature"]
     body = request.get_data(as_text=True)
-    handler.handle(body, signature)
+    try:
+        with WEBHOOK_SECONDS.time():
+            handler.handle(body, signature)
+    except InvalidSignatureError:
+        abort(400)
+    except QueueFullError:
+        # 処理が追いついていない: 受け付けずに LINE に再送させる（200 を返すと失われる）
+        abort(503)
     return "OK"
 
+
+LOOPBACK = {"127.0.0.1", "::1"}
+
+
+def local_only(view):
+    """同じホストからの直接のリクエストだけに返す（外からは 404。リバースプロキシ経由も外とみなす）"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.remote_addr not in LOOPBACK or "X-Forwarded-For" in request.headers:
+            abort(404)
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@app.route("/stats", methods=["GET"])
+@local_only
+def stats():
+    return jsonify({
+        "events": handler.dispatcher.stats(),
+        "delivery": {"queue_depth": delivery.depth(), **delivery.stats},
+        "active_watches": len(monitor_engine.watches),
+        "upstream": upstream_gate.stats(),
+        "state_store": {"pending": state_store.pending(), **state_store.stats},
+        "travel_times": {"eta_entries": len(eta_table), "built_at": eta_table.built_at,
+                         **(observation_log.stats if observation_log else {})},
+        "role": app_role(),
+        "startup": STARTUP,
+    })
+
+
+@app.route("/metrics", methods=["GET"])
+@local_only
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 # ================================================================
 #  Quick Reply Builders
 # ================================================================
 
-def create_stop_quick_reply(stop_type: str = "boarding") -> QuickReply:
+# ボタンの中身は固定なので、作るのは種類ごとに 1 回だけ（warm_up で起動直後に作っておく）
+@lru_cache(maxsize=None)
+def create_stop_quick_reply(stop_type: str = "boarding") -> "models.QuickReply":
     """停留所選択用（人気 + その他検索）"""
     items = [
-        QuickReplyButton(
-            action=MessageAction(label=s, text=f"{stop_type}:{s}")
+        models.QuickReplyButton(
+            action=models.MessageAction(label=s, text=f"{stop_type}:{s}")
         ) for s in POPULAR_STOPS[:8]
     ]
     items.append(
-        QuickReplyButton(
-            action=MessageAction(label="🔍 その他を検索", text=f"{stop_type}:search")
+        models.QuickReplyButton(
+            action=models.MessageAction(label="🔍 その他を検索", text=f"{stop_type}:search")
         )
     )
-    return QuickReply(items=items)
+    return models.QuickReply(items=items)
 
 
-def create_time_quick_reply() -> QuickReply:
+@lru_cache(maxsize=None)
+def create_time_quick_reply() -> "models.QuickReply":
     """ユーザーが頻繁に使う時刻 + 手動入力のみ"""
     items = [
-        QuickReplyButton(
-            action=MessageAction(label=t, text=f"time:{t}")
+        models.QuickReplyButton(
+            action=models.MessageAction(label=t, text=f"time:{t}")
         ) for t in PRESET_TIMES
     ]
     items.append(
-        QuickReplyButton(
-            action=MessageAction(label="⌨️ 手動入力", text="time:manual")
+        models.QuickReplyButton(
+            action=models.MessageAction(label="⌨️ 手動入力", text="time:manual")
         )
     )
-    return QuickReply(items=items)
+    return models.QuickReply(items=items)
+
+
+@lru_cache(maxsize=None)
+def create_repeat_quick_reply() -> "models.QuickReply":
+    """通勤の繰り返し設定"""
+    items = [
+        models.QuickReplyButton(
+            action=models.MessageAction(label=f"🔁 {REPEAT_LABELS[r]}", text=f"repeat:{r}")
+        ) for r in ("daily", "weekday", "weekend")
+    ]
+    return models.QuickReply(items=items)
 
 # ================================================================
 #  Message Helpers
@@ -255,7 +458,7 @@ def create_time_quick_reply() -> QuickReply:
 def show_boarding_options(reply_token):
     line_bot_api.reply_message(
         reply_token,
-        TextSendMessage(
+        models.TextSendMessage(
             text="🚌 乗車停留所を選択してください\n\n人気の停留所から選ぶか、\"その他を検索\"で検索できます。",
             quick_reply=create_stop_quick_reply("boarding"),
         ),
@@ -265,7 +468,7 @@ def show_boarding_options(reply_token):
 def show_alighting_options(reply_token):
     line_bot_api.reply_message(
         reply_token,
-        TextSendMessage(
+        models.TextSendMessage(
             text="🏁 降車停留所を選択してください\n\n人気の停留所から選ぶか、\"その他を検索\"で検索できます。",
             quick_reply=create_stop_quick_reply("alighting"),
         ),
@@ -275,7 +478,7 @@ def show_alighting_options(reply_token):
 def show_time_options(reply_token):
     line_bot_api.reply_message(
         reply_token,
-        TextSendMessage(
+        models.TextSendMessage(
             text="⏰ 乗車時刻を選択してください\n\nよく使う時刻をタップするか、手動入力を選択してください。",
             quick_reply=create_time_quick_reply(),
         ),
@@ -291,7 +494,7 @@ def handle_stop_search(reply_token, user_input: str, stop_type: str):
     if not matches:
         line_bot_api.reply_message(
             reply_token,
-            TextSendMessage(text=f"「{user_input}」に該当する停留所が見つかりませんでした。\n\n別の名前で検索してみてください。"),
+            models.TextSendMessage(text=f"「{user_input}」に該当する停留所が見つかりませんでした。\n\n別の名前で検索してみてください。"),
         )
         return False
 
@@ -299,21 +502,43 @@ def handle_stop_search(reply_token, user_input: str, stop_type: str):
         return matches[0]
 
     qr_items = [
-        QuickReplyButton(action=MessageAction(label=m, text=f"{stop_type}:{m}"))
+        models.QuickReplyButton(action=models.MessageAction(label=m, text=f"{stop_type}:{m}"))
         for m in matches
     ]
     line_bot_api.reply_message(
         reply_token,
-        TextSendMessage(
+        models.TextSendMessage(
             text="候補の停留所が見つかりました。選択してください：",
-            quick_reply=QuickReply(items=qr_items),
+            quick_reply=models.QuickReply(items=qr_items),
         ),
     )
     return False
 
 
-def confirm_settings(reply_token, user_id):
-    s = user_settings[user_id]
+def timetable_note(s):
+    """設定した時刻の前後に便が無い / 別の時刻の便に合わせるときの一言（時刻表が無ければ None）
+
+    返信を待たせないよう、ここでは取得しない（持っていなければ別スレッドで取りに行き、今回は一言なし）。
+    """
+    route = (bus_session.get_stop_code(s["boarding"]), bus_session.get_stop_code(s["alighting"]))
+    if not all(route):
+        return None
+    if route not in timetable_cache:
+        timetable_cache.prefetch(route, clock.now().date())
+        return None
+    dep, known = timetable_cache.nearest(route, s["time"], after=clock.now() - MONITOR_TAIL)
+    if not known or dep == s["time"]:
+        return None
+    if dep:
+        return f"🕒 時刻表の {dep.strftime('%H:%M')} 発の便に合わせて監視します。"
+    near = "、".join(d.strftime("%H:%M") for d in timetable_cache.around(route, s["time"]))
+    minutes = int(TIMETABLE_MATCH.total_seconds() // 60)
+    return (f"⚠️ 時刻表では {s['time'].strftime('%H:%M')} の前後{minutes}分に便がありません。"
+            + (f"\n近い便: {near}" if near else "\nこの日は運行がありません。")
+            + "\nこのままでは監視しません。時刻を選び直してください。")
+
+
+def confirm_settings(reply_token, s):
     txt = (
         "✅ 設定が完了しました\n\n"
         f"🚌 乗車停留所: {s['boarding']}\n"
@@ -321,20 +546,41 @@ def confirm_settings(reply_token, user_id):
         f"⏰ 乗車時刻: {s['time'].strftime('%H:%M')}\n\n"
         "📱 乗車時刻の7分前からバスの位置情報の監視を開始します。\n"
         "❌ 監視をキャンセルしたい場合は『キャンセル』と入力してください。\n\n"
-        "🔔 バスが接近したらリアルタイムでお知らせします！"
+        "🔔 バスが接近したらリアルタイムでお知らせします！\n\n"
+        "🔁 毎回の設定を省きたい場合は、下のボタンで繰り返しを選べます。"
     )
-    line_bot_api.reply_message(reply_token, TextSendMessage(text=txt))
+    note = timetable_note(s)
+    if note:
+        txt = f"{note}\n\n{txt}"
+    line_bot_api.reply_message(reply_token, models.TextSendMessage(text=txt, quick_reply=create_repeat_quick_reply()))
+
+def set_departure(reply_token, user_id, t):
+    """乗車時刻を設定して監視を登録する（停留所が揃っていなければ設定からやり直してもらう）"""
+    user_status[user_id] = {"state": None}
+    s = user_settings.get(user_id) or {}
+    if not {"boarding", "alighting"} <= s.keys():
+        line_bot_api.reply_message(
+            reply_token, models.TextSendMessage(text="『設定開始』で乗車・降車する停留所を設定してから時刻を選んでください。"),
+        )
+        return
+    dep_dt = next_departure(t, clock.now())
+    s = user_settings[user_id] = {**s, "time": dep_dt}
+    schedule_bus_check(user_id, dep_dt, settings=s)
+    confirm_settings(reply_token, s)
 
 # ================================================================
 #  LINE Message Handlers
 # ================================================================
 
-@handler.add(MessageEvent, message=TextMessage)
+@handler.add("MessageEvent", message="TextMessage")
 def handle_message(event):
+    # 同じ利用者のイベントは EventDispatcher が順に渡す。監視スレッドと共有する状態の読み書きは
+    # cancel_user_monitoring / schedule_bus_check / user_settings.modify の中だけでロックする
+    # （返信や時刻表の取得の間はロックを持たない）
     user_id = event.source.user_id
     text = event.message.text.strip()
     status = user_status.get(user_id, {"state": None})
-    print(f"[DEBUG]handle_message: uid={user_id}, text='{text}', state={status}")
+    log.debug("handle_message", user=user_id, text=text, state=status.get("state"))
 
     # ------------------------------------------------------------
     #  コマンド系
@@ -350,7 +596,7 @@ def handle_message(event):
             msg = "❌ 監視をキャンセルしました。"
         else:
             msg = "現在監視中の予定はありません。"
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=msg))
+        line_bot_api.reply_message(event.reply_token, models.TextSendMessage(text=msg))
         return
 
     if text in {"ヘルプ", "help"}:
@@ -366,9 +612,12 @@ def handle_message(event):
             "⏰ **時刻設定**\n"
             "• ボタンで『08:17』『18:03』を選択\n"
             "• その他は『⌨️ 手動入力』→ HH:MM 形式で入力\n\n"
+            "🔁 **繰り返し**\n"
+            "• 設定完了後のボタンで『毎日』『平日』『土日』を選ぶと、毎回設定しなくても監視します\n"
+            "• やめるときは『キャンセル』\n\n"
             "📱 監視は乗車時刻の7分前から開始し、5分後まで継続します。"
         )
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=help_text))
+        line_bot_api.reply_message(event.reply_token, models.TextSendMessage(text=help_text))
         return
 
     # ------------------------------------------------------------
@@ -379,10 +628,10 @@ def handle_message(event):
         if prefix == "boarding":
             if value == "search":
                 line_bot_api.reply_message(
-                    event.reply_token, TextSendMessage(text="🔍 乗車する停留所名を入力してください"),
+                    event.reply_token, models.TextSendMessage(text="🔍 乗車する停留所名を入力してください"),
                 )
                 user_status[user_id] = {"state": "searching_boarding"}
-            elif value in STOP_CODES:
+            elif value in STOP_CATALOG:
                 user_settings[user_id] = {"boarding": value}
                 show_alighting_options(event.reply_token)
                 user_status[user_id] = {"state": "awaiting_alighting"}
@@ -391,11 +640,11 @@ def handle_message(event):
         if prefix == "alighting":
             if value == "search":
                 line_bot_api.reply_message(
-                    event.reply_token, TextSendMessage(text="🔍 降車する停留所名を入力してください"),
+                    event.reply_token, models.TextSendMessage(text="🔍 降車する停留所名を入力してください"),
                 )
                 user_status[user_id] = {"state": "searching_alighting"}
-            elif value in STOP_CODES:
-                user_settings[user_id]["alighting"] = value
+            elif value in STOP_CATALOG:
+                user_settings.modify(user_id, lambda s: {**(s or {}), "alighting": value})
                 show_time_options(event.reply_token)
                 user_status[user_id] = {"state": "awaiting_time"}
             return
@@ -403,24 +652,33 @@ def handle_message(event):
         if prefix == "time":
             if value == "manual":
                 line_bot_api.reply_message(
-                    event.reply_token, TextSendMessage(text="⌨️ 乗車時刻を『HH:MM』形式で入力してください（例：08:30）"),
+                    event.reply_token, models.TextSendMessage(text="⌨️ 乗車時刻を『HH:MM』形式で入力してください（例：08:30）"),
                 )
                 user_status[user_id] = {"state": "manual_time_input"}
             else:
                 try:
                     t = datetime.strptime(value, "%H:%M").time()
-                    now = datetime.now()
-                    dep_dt = datetime.combine(now.date(), t)
-                    if dep_dt <= now:
-                        dep_dt += timedelta(days=1)
-                    user_settings[user_id]["time"] = dep_dt
-                    confirm_settings(event.reply_token, user_id)
-                    user_status[user_id] = {"state": None}
-                    schedule_bus_check(user_id, dep_dt)
                 except ValueError:
                     line_bot_api.reply_message(
-                        event.reply_token, TextSendMessage(text="⚠️ 正しい時刻形式で入力してください（例：08:30）"),
+                        event.reply_token, models.TextSendMessage(text="⚠️ 正しい時刻形式で入力してください（例：08:30）"),
                     )
+                else:
+                    set_departure(event.reply_token, user_id, t)
+            return
+
+        if prefix == "repeat":
+            s = user_settings.get(user_id, {})
+            if value not in REPEAT_LABELS or not {"boarding", "alighting", "time"} <= s.keys():
+                line_bot_api.reply_message(
+                    event.reply_token, models.TextSendMessage(text="『設定開始』で停留所と時刻を設定してから選択してください。"),
+                )
+            else:
+                schedule_bus_check(user_id, s["time"], value, settings=s)
+                line_bot_api.reply_message(
+                    event.reply_token,
+                    models.TextSendMessage(text=f"🔁 {REPEAT_LABELS[value]} {s['time'].strftime('%H:%M')} の便を監視します。\n"
+                                         "やめるときは『キャンセル』と入力してください。"),
+                )
             return
 
     # ------------------------------------------------------------
@@ -437,7 +695,7 @@ def handle_message(event):
     if status["state"] == "searching_alighting":
         res = handle_stop_search(event.reply_token, text, "alighting")
         if res:
-            user_settings[user_id]["alighting"] = res
+            user_settings.modify(user_id, lambda s: {**(s or {}), "alighting": res})
             show_time_options(event.reply_token)
             user_status[user_id] = {"state": "awaiting_time"}
         return
@@ -445,31 +703,25 @@ def handle_message(event):
     if status["state"] == "manual_time_input":
         try:
             t = datetime.strptime(text, "%H:%M").time()
-            now = datetime.now()
-            dep_dt = datetime.combine(now.date(), t)
-            if dep_dt <= now:
-                dep_dt += timedelta(days=1)
-            user_settings[user_id]["time"] = dep_dt
-            confirm_settings(event.reply_token, user_id)
-            user_status[user_id] = {"state": None}
-            schedule_bus_check(user_id, dep_dt)
         except ValueError:
             line_bot_api.reply_message(
-                event.reply_token, TextSendMessage(text="⚠️ 正しい時刻形式で入力してください（例：08:30）"),
+                event.reply_token, models.TextSendMessage(text="⚠️ 正しい時刻形式で入力してください（例：08:30）"),
             )
+        else:
+            set_departure(event.reply_token, user_id, t)
         return
 
     # デフォルト応答
     line_bot_api.reply_message(
         event.reply_token,
-        TextSendMessage(text="『設定開始』と入力してバス監視を開始してください。\n『ヘルプ』で使い方を確認できます。"),
+        models.TextSendMessage(text="『設定開始』と入力してバス監視を開始してください。\n『ヘルプ』で使い方を確認できます。"),
     )
 
 # ================================================================
 #  Postback Handler (reserved)
 # ================================================================
 
-@handler.add(PostbackEvent)
+@handler.add("PostbackEvent")
 def handle_postback(event):
     pass  # 現状未使用
 
@@ -477,79 +729,454 @@ def handle_postback(event):
 #  監視ロジック
 # ================================================================
 
-def check_bus_location(user_id):
-    settings = user_settings.get(user_id)
-    if not settings:
-        print(f"[DEBUG]check_bus_location: settings missing user={user_id}")
-        return
+def bus_update_text(user_id, record):
+    """通知の本文。これまでの記録から到着までの目安が分かれば添える"""
+    text = f"🚌 バス位置情報更新:\n{format_record(record)}"
+    w = monitor_engine.watches.get(user_id)
+    minute = minute_of_day(record.time)
+    if w is None or minute > 24 * 60:
+        return text
+    now = clock.now()
+    passed = datetime.combine(now.date(), datetime.min.time()) + timedelta(minutes=minute)
+    if passed > now:
+        passed -= timedelta(days=1)
+    seconds = eta_table.lookup(w.route, record.stop, passed)
+    if seconds is None:
+        return text
+    left = (passed + timedelta(seconds=seconds) - now).total_seconds()
+    if left < 60:
+        return f"{text}\n⏱ まもなく到着（これまでの記録から）"
+    return f"{text}\n⏱ 到着まで約{round(left / 60)}分（これまでの記録から）"
+
+
+def notify_bus_info(user_id, snapshot):
+    """路線単位で解析済みのスナップショットから、利用者ごとに先頭のバスが変わっていれば送る"""
+    record = bus_session.update_user_info(user_id, lead(snapshot))
+    if record:
+        delivery.push(user_id, models.TextSendMessage(text=bus_update_text(user_id, record)))
+
+
+def notify_unavailable(user_id):
+    """Bus-Vision に繋がらなくなったことを監視中の利用者に 1 回だけ知らせる"""
+    delivery.push(user_id, models.TextSendMessage(
+        text="⚠️ 現在バスの位置情報を取得できません。復旧しだい監視を再開します。"))
+
+
+def log_route_events(route, snapshot, events):
+    for ev in events:
+        log.debug("route_event", route=route, kind=type(ev).__name__, detail=ev)
+    if observation_log:
+        observation_log.record(route, events, clock.now())
+
+
+def finish_bus_check(user_id):
+    """監視時間（乗車時刻 + 5 分）が終わった利用者の後片付け（繰り返し設定は次回分を残す）"""
+    with user_lock(user_id):
+        info = user_active_jobs.get(user_id)
+        # 終了を待つ間に設定し直された監視（まだ始まっていない）は消さない
+        if info and info["repeat"] == ONCE and info.get("watching"):
+            user_active_jobs.pop(user_id, None)
+        elif info and info.pop("active_departure", None):
+            user_active_jobs.save(user_id)
+        bus_session.clear_user_info(user_id)
+    delivery.push(user_id, models.TextSendMessage(text="✅ バス監視を終了しました。お疲れさまでした！"))
 
-    html = bus_session.search_bus(settings["boarding"], settings["alighting"])
-    info = bus_session.extract_bus_info(html, user_id)
-    if info:
-        try:
-            line_bot_api.push_message(user_id, TextSendMessage(text=f"🚌 バス位置情報更新:\n{info}"))
-        except LineBotApiError as e:
-            print(f"[DEBUG]push_message error: {e}")
 
+def notify_shard_bus_info(user_id, snapshot):
+    """監視ワーカー用: 通知した内容を共有ストアにも書く（路線を引き継いだワーカーが送り直さないように）"""
+    record = bus_session.update_user_info(user_id, lead(snapshot))
+    if record:
+        shard_registry.save_notified(user_id, record)
+        delivery.push(user_id, models.TextSendMessage(text=bus_update_text(user_id, record)))
 
-def schedule_bus_check(user_id, departure_time):
-    now = datetime.now()
-    check_time = departure_time - timedelta(minutes=7)
-    cancel_user_monitoring(user_id)
 
-    if check_time < now:
-        line_bot_api.push_message(user_id, TextSendMessage(text="⚠️ 指定時間が過ぎているため監視を開始できませんでした。"))
-        return
+def load_shard_user_info(user_ids):
+    for user_id, values in shard_registry.load_notified(user_ids).items():
+        bus_session.user_last_approach_info[user_id] = ApproachRecord(*values)
 
-    tag = f"user_{user_id}"
-    job = schedule.every().day.at(check_time.strftime("%H:%M")).do(
-        lambda: check_bus_location_loop(user_id, departure_time)
-    ).tag(tag)
 
-    user_active_jobs[user_id] = {"job": job, "departure_time": departure_time, "monitoring_thread": None}
-    print(f"[DEBUG]schedule_bus_check: user={user_id}, start={check_time}")
+def drop_shard_user_info(user_ids):
+    for user_id in user_ids:
+        bus_session.user_last_approach_info.pop(user_id, None)
 
 
-def cancel_user_monitoring(user_id):
-    if user_id not in user_active_jobs:
+shard_registry = ShardRegistry(os.path.join(CLUSTER_DIR, "shards.db")) if SHARDED else None
+
+# Bus-Vision へのリクエストは全路線で rate 回/秒まで（監視ワーカーが複数なら等分する）。
+# 足りないときは乗車時刻が近い監視から通し、連続して失敗・遅延したらしばらく送らない
+upstream_gate = UpstreamGate(
+    rate=float(os.getenv("BUSVISION_RATE", "10")) / (max(1, MONITOR_PROCESSES) if APP_ROLE == "monitor" else 1),
+    max_wait=float(os.getenv("BUSVISION_MAX_WAIT", "2")),
+    shed_after=float(os.getenv("BUSVISION_SHED_AFTER", "300")),
+    breaker=CircuitBreaker(
+        failures=int(os.getenv("BUSVISION_BREAKER_FAILURES", "5")),
+        slow=float(os.getenv("BUSVISION_BREAKER_SLOW", "8")),
+        reset_timeout=float(os.getenv("BUSVISION_BREAKER_RESET", "30")),
+    ),
+)
+
+# 「現在時刻」はここから読む（simulation.py が仮想時計に差し替えて 1 日分を早回しする）
+clock = SYSTEM_CLOCK
+
+job_scheduler = JobScheduler(clock)
+monitor_engine = MonitorEngine(
+    fetch=bus_session.fetch_approach,
+    parse=bus_session.parse_snapshot,
+    # 監視ワーカーでは終了の通知と後片付けは担当ワーカー（ShardPublisher）が行う
+    deliver=notify_shard_bus_info if APP_ROLE == "monitor" else notify_bus_info,
+    on_change=log_route_events,
+    on_finish=bus_session.clear_user_info if APP_ROLE == "monitor" else finish_bus_check,
+    interval=15,
+    workers=int(os.getenv("MONITOR_WORKERS", "4")),
+    # バスが遠い / 来ていないときはゆっくり、1〜2 停留所前まで来たら短い間隔でポーリングする
+    cadence=AdaptiveCadence(
+        min_interval=float(os.getenv("MONITOR_MIN_INTERVAL", "8")),
+        max_interval=float(os.getenv("MONITOR_MAX_INTERVAL", "60")),
+        budget_per_min=float(os.getenv("BUSVISION_BUDGET_PER_MIN", "0")) or None,
+    ),
+    gate=upstream_gate,
+    on_unavailable=notify_unavailable,
+    clock=clock,
+)
+if APP_ROLE == "cluster" and SHARDED:
+    # ポーリングは監視ワーカーが路線ごとに分担する（ここでは監視対象を共有ストアに書くだけ）
+    monitor_engine = ShardPublisher(shard_registry, job_scheduler, on_finish=finish_bus_check)
+
+
+def schedule_bus_check(user_id, departure_time, repeat=ONCE, settings=None):
+    """監視予定を登録する（settings を省くと保存済みの設定の停留所を使う）。登録したら True"""
+    settings = settings or user_settings.get(user_id) or {}
+    if not {"boarding", "alighting"} <= settings.keys():
+        log.warning("schedule_bus_check.incomplete", user=user_id)
         return False
+    route = (bus_session.get_stop_code(settings["boarding"]), bus_session.get_stop_code(settings["alighting"]))
+    with user_lock(user_id):
+        now = clock.now()
+        cancel_user_monitoring(user_id)
+
+        if repeat != ONCE:
+            # set_departure と同じく now より後の回（grace は再起動時の復元で監視中の回を残すためだけ）
+            departure_time = next_departure(departure_time.time(), now, repeat)
+        if departure_time + MONITOR_TAIL <= now:
+            delivery.push(user_id, models.TextSendMessage(text="⚠️ 指定時間が過ぎているため監視を開始できませんでした。"))
+            return False
+
+        user_active_jobs[user_id] = {"job": None, "departure_time": departure_time, "route": route, "repeat": repeat}
+        _schedule_start(user_id, departure_time)
+        return True
+
+
+def monitor_departure(route, departure_time):
+    """監視の基準にする発車時刻: 時刻表の前後の便に合わせる（時刻表が無ければそのまま、便が無ければ None）
+
+    監視時間（発車 + MONITOR_TAIL）がもう終わった便には合わせない。
+    """
+    dep, known = timetable_cache.nearest(route, departure_time, after=clock.now() - MONITOR_TAIL)
+    return dep if known else departure_time
+
+
+def monitor_start(route, departure_time, now):
+    """監視開始ジョブの時刻: 合わせる便の MONITOR_LEAD 前
+
+    時刻表をまだ持っていない（取得中など）ときは、あとで前の便に合わせても間に合うよう
+    TIMETABLE_MATCH だけ早める（早すぎれば check_bus_location_loop が開始を遅らせる）。
+    """
+    dep, known = timetable_cache.nearest(route, departure_time, after=now - MONITOR_TAIL)
+    start = (dep or departure_time) - MONITOR_LEAD if known else departure_time - TIMETABLE_MATCH - MONITOR_LEAD
+    return max(start, now)
+
+
+def _schedule_start(user_id, departure_time):
+    """監視開始ジョブを登録する。開始時刻を過ぎていても乗車時刻 + 5 分前ならすぐに始める"""
+    info = user_active_jobs[user_id]
+    check_time = monitor_start(info["route"], departure_time, clock.now())
+    info["departure_time"] = departure_time
+    info["job"] = job_scheduler.add(check_time, lambda: check_bus_location_loop(user_id, departure_time))
+    user_active_jobs.save(user_id)
+    log.debug("schedule_bus_check", user=user_id, start=check_time, repeat=info["repeat"])
+
 
-    info = user_active_jobs.pop(user_id)
-    schedule.cancel_job(info["job"])
-    bus_session.clear_user_info(user_id)
-    print(f"[DEBUG]cancel_user_monitoring: user={user_id}")
+def cancel_user_monitoring(user_id):
+    with user_lock(user_id):
+        info = user_active_jobs.pop(user_id, None)
+        if info is None:
+            return False
+        job_scheduler.cancel(info["job"])
+        monitor_engine.unwatch(user_id)
+        bus_session.clear_user_info(user_id)
+    log.debug("cancel_user_monitoring", user=user_id)
     return True
 
 
 def check_bus_location_loop(user_id, departure_time):
-    end_time = departure_time + timedelta(minutes=5)
+    """監視開始: 監視エンジンに登録する（同じ路線の利用者とまとめてポーリングされる）"""
+    with user_lock(user_id):
+        info = user_active_jobs.get(user_id)
+        # 実行を待つ間にキャンセル・設定し直しされたジョブは何もしない
+        if not info or info["departure_time"] != departure_time:
+            return
+        aligned = monitor_departure(info["route"], departure_time)
+        if aligned is None:
+            # 時刻表で前後に便が無い（運行の無い曜日など）: ポーリングしても来ないので今回は見送る
+            log.info("monitor.skipped_no_service", user=user_id, route=info["route"], departure=departure_time)
+            delivery.push(user_id, models.TextSendMessage(
+                text=f"🚫 時刻表では {departure_time.strftime('%H:%M')} 前後に便がないため、今回は監視しません。"))
+            if info["repeat"] == ONCE:
+                user_active_jobs.pop(user_id, None)
+        elif aligned - MONITOR_LEAD > clock.now():
+            # 時刻表が無いうちに早めに登録したジョブ: 合わせた便の MONITOR_LEAD 前まで待つ
+            info["job"] = job_scheduler.add(aligned - MONITOR_LEAD,
+                                            lambda: check_bus_location_loop(user_id, departure_time))
+            return
+        else:
+            monitor_engine.watch(user_id, info["route"], aligned, aligned + MONITOR_TAIL)
+            info["watching"] = True   # finish_bus_check が消してよい監視（保存はしない）
+            if info["repeat"] != ONCE:
+                info["active_departure"] = departure_time   # 再起動しても今回の監視を続けられるように
 
-    def loop():
-        while datetime.now() < end_time and user_id in user_active_jobs:
-            check_bus_location(user_id)
-            time.sleep(15)
+        # 繰り返し設定なら次回分を登録しておく（ここで保存する）
+        if info["repeat"] != ONCE:
+            _schedule_start(user_id, next_departure(departure_time.time(), departure_time, info["repeat"]))
 
-        user_active_jobs.pop(user_id, None)
-        bus_session.clear_user_info(user_id)
+
+def resume_bus_check(user_id, departure_time):
+    """起動時: 繰り返し設定で監視中だった回を、監視時間が残っていれば続ける（次回分のジョブはそのまま）"""
+    with user_lock(user_id):
+        info = user_active_jobs.get(user_id)
+        if not info or info.get("active_departure") != departure_time:
+            return
+        aligned = monitor_departure(info["route"], departure_time)
+        if aligned is None or aligned + MONITOR_TAIL <= clock.now():
+            info.pop("active_departure")
+            user_active_jobs.save(user_id)
+            return
+        monitor_engine.watch(user_id, info["route"], aligned, aligned + MONITOR_TAIL)
+        info["watching"] = True
+
+
+def restore_monitoring(now=None):
+    """起動時: 保存されていた監視予定のジョブをまとめて作り直す（監視時間内のものはすぐに再開する）
+
+    繰り返し設定で監視中だった回（active_departure）は、次回分のジョブとは別にすぐ再開する。
+    """
+    now = now or clock.now()
+    starts, expired, resumes = [], [], []
+    for user_id, info in user_active_jobs.items():
+        if info.get("active_departure"):
+            resumes.append((user_id, info["active_departure"]))
+        dep = info["departure_time"]
+        if dep + MONITOR_TAIL <= now:
+            if info["repeat"] == ONCE:
+                expired.append(user_id)
+                continue
+            dep = next_departure(dep.time(), now, info["repeat"], grace=MONITOR_TAIL)
+            info["departure_time"] = dep
+            user_active_jobs.save(user_id)
+        starts.append((user_id, dep))
+
+    for user_id in expired:
+        user_active_jobs.pop(user_id)
+        bus_session.user_last_approach_info.pop(user_id, None)
+
+    job_ids = job_scheduler.add_many(
+        (monitor_start(user_active_jobs[user_id]["route"], dep, now), partial(check_bus_location_loop, user_id, dep))
+        for user_id, dep in starts
+    )
+    for (user_id, _), job_id in zip(starts, job_ids):
+        user_active_jobs[user_id]["job"] = job_id
+    job_scheduler.add_many((now, partial(resume_bus_check, user_id, dep)) for user_id, dep in resumes)
+    log.info("restore_monitoring", restored=len(starts), resumed=len(resumes), expired=len(expired))
+    return len(starts)
+
+
+def refresh_timetables():
+    """毎日 TIMETABLE_REFRESH_AT: 監視予定のある停留所の組の時刻表をまとめて取り直す（別スレッドで少しずつ）"""
+    routes = [info["route"] for info in list(user_active_jobs.values())]
+    threading.Thread(
+        target=timetable_cache.refresh, args=(routes, clock.now().date()), kwargs={"pause": TIMETABLE_FETCH_PAUSE},
+        name="timetable-refresh", daemon=True,
+    ).start()
+    job_scheduler.add(next_departure(TIMETABLE_REFRESH_AT, clock.now(), DAILY), refresh_timetables)
+
+
+timetable_retry_lock = threading.Lock()
+timetable_retry_job = None
+
+
+def schedule_timetable_retry():
+    """時刻表の取得に失敗したら: 待ち時間が過ぎたころに取り直すジョブを登録する（登録済みなら何もしない）"""
+    global timetable_retry_job
+    wait = timetable_cache.retry_after()
+    if wait is None:
+        return
+    with timetable_retry_lock:
+        if timetable_retry_job is None:
+            timetable_retry_job = job_scheduler.add(clock.now() + timedelta(seconds=wait), retry_timetables)
+
+
+def retry_timetables():
+    """取得に失敗した組のうち、まだ監視予定のある組を取り直す（別スレッド。失敗が残ればまた登録する）"""
+    global timetable_retry_job
+    with timetable_retry_lock:
+        timetable_retry_job = None
+    active = {info["route"] for info in list(user_active_jobs.values())}
+    routes = []
+    for route in timetable_cache.failed():
+        if route in active:
+            routes.append(route)
+        else:
+            timetable_cache.forget(route)
+
+    def run():
+        timetable_cache.refresh(routes, clock.now().date(), pause=TIMETABLE_FETCH_PAUSE)
+        schedule_timetable_retry()
+
+    threading.Thread(target=run, name="timetable-retry", daemon=True).start()
+
+
+def refresh_eta_table():
+    """毎日 ETA_AGGREGATE_AT: 通過記録を集計し直す（監視ワーカーは 30 分後に担当ワーカーが書いた表を読み直す）"""
+    path = os.path.join(OBSERVATION_DIR, "eta.json")
+
+    def build():
+        global eta_table
         try:
-            line_bot_api.push_message(user_id, TextSendMessage(text="✅ バス監視を終了しました。お疲れさまでした！"))
-        except LineBotApiError as e:
-            print(f"[DEBUG]push_message error: {e}")
+            if APP_ROLE == "monitor":
+                eta_table = EtaTable.load(path, TIMETABLE_HOLIDAYS)
+                return
+            observation_log.flush()
+            table = aggregate(OBSERVATION_DIR, clock.now().date(), ETA_WINDOW_DAYS, TIMETABLE_HOLIDAYS)
+            table.save(path)
+            eta_table = table
+        except Exception as e:
+            log.error("refresh_eta_table.error", error=e)
+
+    threading.Thread(target=build, name="eta-aggregate", daemon=True).start()
+    schedule_eta_refresh()
 
-    t = threading.Thread(target=loop, daemon=True)
-    t.start()
-    if user_id in user_active_jobs:
-        user_active_jobs[user_id]["monitoring_thread"] = t
+
+def schedule_eta_refresh():
+    if observation_log is None:
+        return
+    run_at = next_departure(ETA_AGGREGATE_AT, clock.now(), DAILY)
+    if APP_ROLE == "monitor":
+        run_at += timedelta(minutes=30)
+    job_scheduler.add(run_at, refresh_eta_table)
 
 # ================================================================
-#  schedule runner & app start
+#  app start
 # ================================================================
 
-def run_schedule_loop():
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
+def register_gauges():
+    """値を持たないメトリクス（件数・キューの長さ）は /metrics を読んだときに数える"""
+    metrics.gauge("active_watches", "監視中の利用者数", lambda: len(monitor_engine.watches))
+    metrics.gauge("scheduled_jobs", "登録済みの監視開始ジョブ数", lambda: len(job_scheduler))
+    metrics.gauge("threads", "プロセス内のスレッド数", threading.active_count)
+    metrics.gauge("queue_depth", "キューに溜まっている件数", lambda: {
+        ("events",): handler.dispatcher.depth(),
+        ("delivery",): delivery.depth(),
+        ("state_store",): state_store.pending(),
+        ("upstream_waiting",): upstream_gate.stats()["waiting"],
+        ("observations",): observation_log.pending() if observation_log else 0,
+    }, labelnames=("queue",))
+    metrics.gauge("upstream_requests_total", "Bus-Vision へのリクエストの扱い（admitted / throttled / shed / rejected_open）",
+                  lambda: {(k,): v for k, v in upstream_gate.stats().items()
+                           if k in ("admitted", "throttled", "shed", "rejected_open")},
+                  labelnames=("outcome",), kind="counter")
+    metrics.gauge("upstream_breaker_open", "Bus-Vision のサーキットブレーカーが開いていれば 1",
+                  lambda: int(upstream_gate.breaker.state != "closed"))
+
+
+register_gauges()
+if os.getenv("METRICS_PORT"):
+    # Flask を持たない監視ワーカー（APP_ROLE=monitor）でも 127.0.0.1 で /metrics を読めるように
+    try:
+        metrics.serve(int(os.getenv("METRICS_PORT")))
+    except OSError as e:
+        # gunicorn のワーカーや監視ワーカーが同じポートを指定されたときは先に取ったプロセスだけが出す
+        log.warning("metrics.serve_failed", port=os.getenv("METRICS_PORT"), error=e)
+
+
+def start_worker():
+    """イベント処理と監視を受け持つプロセスの起動処理"""
+    started = time.perf_counter()
+    load_state()
+    if SHARDED:
+        # 前の担当が書いた監視対象は、保存済みの状態から作り直す
+        shard_registry.clear_watches()
+    restore_monitoring()
+    job_scheduler.add(next_departure(TIMETABLE_REFRESH_AT, clock.now(), DAILY), refresh_timetables)
+    schedule_eta_refresh()
+    STARTUP["worker_ms"] = round((time.perf_counter() - started) * 1e3, 1)
+    log.info("app.worker_started", **STARTUP)
+
+
+def warm_up():
+    """最初の Webhook より先に、遅らせていた import と Quick Reply を用意しておく"""
+    started = time.perf_counter()
+    try:
+        models.load()
+        approach_parser.bs4.load()
+        line_bot_api.api.get()
+        create_stop_quick_reply("boarding")
+        create_stop_quick_reply("alighting")
+        create_time_quick_reply()
+        create_repeat_quick_reply()
+    except Exception as e:
+        log.warning("app.warm_up_failed", error=e)
+        return
+    STARTUP["warm_up_ms"] = round((time.perf_counter() - started) * 1e3, 1)
+
+
+def app_role():
+    if APP_ROLE not in ("cluster", "monitor"):
+        return "single"
+    if APP_ROLE == "monitor":
+        return "monitor"
+    return "leader" if leader_lock.is_leader else "web"
+
+
+STARTUP["init_ms"] = round((time.perf_counter() - STARTED_AT) * 1e3 - STARTUP["import_ms"], 1)
+
+if APP_ROLE == "monitor":
+    # Webhook は受けず、担当になった路線だけをポーリングして通知する
+    shard_member = ShardMember(
+        shard_registry, monitor_engine,
+        interval=float(os.getenv("SHARD_INTERVAL", "1")),
+        ttl=float(os.getenv("SHARD_TTL", "5")),
+        on_acquire=load_shard_user_info,
+        on_release=drop_shard_user_info,
+    )
+    shard_member.start()
+    atexit.register(shard_member.stop)
+    schedule_eta_refresh()
+elif APP_ROLE == "cluster":
+    # どのワーカーも Webhook を検証してチャネルに書くだけ。ロックを取った 1 ワーカーだけが
+    # チャネルから順に取り出して処理し、監視も行う（落ちたら別のワーカーが引き継ぐ）
+    webhook_channel = WebhookChannel(os.path.join(CLUSTER_DIR, "webhooks.db"))
+    handler.forward_to(webhook_channel)
+    leader_lock = LeaderLock(os.path.join(CLUSTER_DIR, "leader.lock"))
+
+    def on_elected():
+        start_worker()
+        handler.consume(webhook_channel)
+
+    leader_lock.run(on_elected)
+else:
+    start_worker()
+
+# 起動してから WARMUP_DELAY 秒後に裏で読み込む（負の値なら読み込まず、最初に使うときに読む）
+WARMUP_DELAY = float(os.getenv("WARMUP_DELAY", "1"))
+if WARMUP_DELAY >= 0:
+    _warm_up_timer = threading.Timer(WARMUP_DELAY, warm_up)
+    _warm_up_timer.daemon = True
+    _warm_up_timer.start()
 
 if __name__ == "__main__":
-    threading.Thread(target=run_schedule_loop, daemon=True).start()
-    app.run(host="0.0.0.0", port=5000)
+    if APP_ROLE == "monitor":
+        try:
+            shard_member.join()
+        except KeyboardInterrupt:
+            pass
+    else:
+        app.run(host="0.0.0.0", port=5000)
@@ -0,0 +1,206 @@
+"""approach.html の解析（高速スキャナ + BeautifulSoup フォールバック）"""
+
+import html as htmllib
+import os
+import re
+
+from lazy import LazyModule
+from logs import get_logger
+from snapshots import ApproachRecord
+
+log = get_logger("approach_parser")
+# BeautifulSoup はフォールバックのときだけ使うので、最初に使うまで読み込まない
+bs4 = LazyModule("bs4")
+
+
+class LayoutMismatch(Exception):
+    """高速スキャナが想定しているページ構造と違う"""
+
+
+# ================================================================
+#  共通: 抽出した文字列 -> ApproachRecord
+# ================================================================
+
+def make_record(number_text: str, approach_text: str, pass_text: str):
+    """番号が数字でなければ None（従来どおり number=1 以外は先頭扱いしない）"""
+    if not (number_text.isdigit() and number_text.isascii()):
+        return None
+    time_part, _, remainder = approach_text.partition("に")
+    return ApproachRecord(
+        rank=int(number_text),
+        time=time_part,
+        stop=remainder.replace("を通過", ""),
+        pass_info=pass_text.replace("を通過", ""),
+    )
+
+# ================================================================
+#  BeautifulSoup 版（従来の実装。フォールバック / 照合用）
+# ================================================================
+
+def parse_soup(html_content: str):
+    soup = bs4.BeautifulSoup(html_content, "html.parser")
+    if soup.find("div", id="errorMsg", class_="errorMsg"):
+        return ()
+
+    records = []
+    for a in soup.find_all("div", class_="approachData"):
+        number = a.find("span", id="number")
+        approach = a.find("div", id="approachInfo")
+        passed = a.find("span", id="passInfo")
+        if number and approach and passed:
+            r = make_record(number.get_text(strip=True), approach.get_text(strip=True), passed.get_text(strip=True))
+            if r:
+                records.append(r)
+    return tuple(records)
+
+# ================================================================
+#  高速スキャナ版
+# ================================================================
+
+# script / style の中身とコメントはタグとして数えない（get_text にも出てこない）
+_SKIP_RE = re.compile(r"<!--.*?-->|<script\b.*?</script\s*>|<style\b.*?</style\s*>", re.S | re.I)
+_DIV_RE = re.compile(r"<(/?)div\b([^>]*)>", re.I)
+_ATTR_RE = re.compile(r"""([^\s=/>]+)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))""")
+_TAG_NAME_RE = re.compile(r"<([a-zA-Z][^\s/>]*)")
+_ANY_TAG_RE = re.compile(r"<[^>]*>")
+_SPAN_CLOSE_RE = re.compile(r"</span\b", re.I)
+_SPAN_BREAK_RE = re.compile(r"<(?:span|div|/div)\b", re.I)
+
+
+def _attrs(raw: str):
+    out = {}
+    for m in _ATTR_RE.finditer(raw):
+        out.setdefault(m.group(1).lower(), htmllib.unescape(next(g for g in m.groups()[1:] if g is not None)))
+    return out
+
+
+def _text(fragment: str) -> str:
+    """BeautifulSoup の get_text(strip=True) と同じ結果を返す"""
+    pieces = (htmllib.unescape(p).strip() for p in _ANY_TAG_RE.split(fragment))
+    return "".join(p for p in pieces if p)
+
+
+def _tags_with(doc: str, keyword: str, tag: str, attr: str):
+    """属性 attr が keyword の開始タグを探し (start, content_start, self_closing, attrs) を返す
+
+    全タグを走査せず、キーワードの出現位置から前後の < > を探すだけにしている。
+    """
+    out = []
+    i = doc.find(keyword)
+    while i != -1:
+        lt = doc.rfind("<", 0, i)
+        gt = doc.find(">", i)
+        if lt != -1 and gt != -1 and doc.find(">", lt, i) == -1:
+            raw = doc[lt:gt]
+            name = _TAG_NAME_RE.match(raw)
+            if name and name.group(1).lower() == tag:
+                attrs = _attrs(raw[name.end():])
+                value = attrs.get(attr, "")
+                if keyword in value.split() if attr == "class" else value == keyword:
+                    out.append((lt, gt + 1, raw.rstrip().endswith("/"), attrs))
+            i = doc.find(keyword, gt)
+        else:
+            i = doc.find(keyword, i + len(keyword))
+    return out
+
+
+def _div_end(doc: str, content_start: int) -> int:
+    """div の内容の終端（html.parser + BeautifulSoup と同じく、対応する </div> か文書末尾）"""
+    depth = 1
+    for m in _DIV_RE.finditer(doc, content_start):
+        if m.group(1):
+            depth -= 1
+            if depth == 0:
+                return m.start()
+        elif not m.group(2).rstrip().endswith("/"):
+            depth += 1
+    return len(doc)
+
+
+def _span_end(doc: str, content_start: int) -> int:
+    """中身が文字列だけの span の終端。入れ子になっていれば LayoutMismatch"""
+    m = _SPAN_CLOSE_RE.search(doc, content_start)
+    if not m:
+        raise LayoutMismatch("span が閉じていない")
+    end = m.start()
+    if _SPAN_BREAK_RE.search(doc, content_start, end):
+        raise LayoutMismatch("span の中に要素がある")
+    return end
+
+
+def _first(found, start, end):
+    for f in found:
+        if start <= f[0] < end:
+            return f
+        if f[0] >= end:
+            break
+    return None
+
+
+def _element_text(doc, found, end_of):
+    _, content_start, self_closing, _ = found
+    if self_closing:
+        return ""
+    return _text(doc[content_start:end_of(doc, content_start)])
+
+
+def parse_fast(html_content: str):
+    doc = _SKIP_RE.sub("", html_content)
+
+    for *_, attrs in _tags_with(doc, "errorMsg", "div", "id"):
+        if "errorMsg" in attrs.get("class", "").split():
+            return ()
+
+    blocks = _tags_with(doc, "approachData", "div", "class")
+    if not blocks:
+        if "approachData" in doc:
+            raise LayoutMismatch("approachData の div が見つからない")
+        return ()
+
+    numbers = _tags_with(doc, "number", "span", "id")
+    approaches = _tags_with(doc, "approachInfo", "div", "id")
+    passes = _tags_with(doc, "passInfo", "span", "id")
+
+    records = []
+    for _, content_start, self_closing, _ in blocks:
+        end = content_start if self_closing else _div_end(doc, content_start)
+        number = _first(numbers, content_start, end)
+        approach = _first(approaches, content_start, end)
+        passed = _first(passes, content_start, end)
+        if number and approach and passed:
+            r = make_record(
+                _element_text(doc, number, _span_end),
+                _element_text(doc, approach, _div_end),
+                _element_text(doc, passed, _span_end),
+            )
+            if r:
+                records.append(r)
+    return tuple(records)
+
+# ================================================================
+#  入口
+# ================================================================
+
+PARSER_BACKEND = os.getenv("APPROACH_PARSER", "fast")     # fast / soup
+VERIFY_PARITY = os.getenv("APPROACH_PARSER_VERIFY") == "1"
+
+
+def parse_approach(html_content: str, backend: str = None):
+    """approachData を全件 ApproachRecord のタプルで返す（接近情報なしは空タプル、HTML が空なら None）"""
+    if not html_content:
+        return None
+    if (backend or PARSER_BACKEND) == "soup":
+        return parse_soup(html_content)
+
+    try:
+        result = parse_fast(html_content)
+    except LayoutMismatch as e:
+        log.warning("parse_approach.fallback", reason=e)
+        return parse_soup(html_content)
+
+    if VERIFY_PARITY:
+        expected = parse_soup(html_content)
+        if expected != result:
+            log.warning("parse_approach.mismatch", fast=repr(result), soup=repr(expected))
+            return expected
+    return result
@@ -0,0 +1,29 @@
+"""ベンチマーク（python -m bench.<name> で 1 つ、python -m bench でまとめて実行）"""
+
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# app を import するシナリオの共通設定（LINE には繋がず、リポジトリの状態ファイルにも書かない）
+APP_ENV = {
+    "LINE_CHANNEL_SECRET": "bench",
+    "LINE_CHANNEL_ACCESS_TOKEN": "bench",
+    "STATE_STORE": "memory",
+    "TIMETABLE_STORE": "memory",
+    "OBSERVATION_LOG": "off",
+}
+
+
+def app_env(**overrides) -> dict:
+    """APP_ENV に overrides（シナリオごとの追加・上書き）を重ねた環境変数"""
+    return {**APP_ENV, **{k: str(v) for k, v in overrides.items()}}
+
+
+def use_app_env(**overrides):
+    """このプロセスで import app する前に呼ぶ"""
+    os.environ.update(app_env(**overrides))
+
+
+def child_env(**overrides) -> dict:
+    """app を import する子プロセス（gunicorn など）に渡す環境変数"""
+    return {**os.environ, "PYTHONPATH": ROOT, **app_env(**overrides)}
@@ -0,0 +1,148 @@
+"""ベンチマークをまとめて実行し、結果を 1 つの JSON にする（前回の結果と比べられる）
+
+各シナリオは別プロセスで、乱数の種を固定して実行する（app を import するシナリオの環境変数が
+混ざらないように）。
+
+    python -m bench                          # 既定のシナリオ
+    python -m bench --all                    # gunicorn や複数プロセスを使う重いものも含める
+    python -m bench parse e2e                # 指定したものだけ
+    python -m bench --out results.json --compare previous.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# シナリオ名 -> run() の引数（実行時間が数十秒に収まる大きさ）
+SCENARIOS = {
+    "parse": {"repeat": 2000},
+    "stop_search": {"n": 2000, "repeat": 20},
+    "webhook": {"users": 200},
+    "e2e": {"users": 1000, "routes": 50, "rounds": 3},
+    "delivery": {"users": 1000, "routes": 20},
+    "scheduler": {"n": 100000},
+    "stop_catalog": {"n": 30000},
+    "upstream": {"routes": 200},
+    "simulate": {"users": 10000, "routes": 300},
+    "timetable": {"routes": 200, "users": 3000},
+    "travel_times": {"routes": 100, "days": 30},
+    "startup": {"repeat": 5},
+    "user_state": {"threads": 16, "users": 2000},
+}
+HEAVY = {
+    "restart": {"n": 100000},
+    "shard": {"routes": 400, "workers": 4},
+    "cluster": {"users": 300, "workers": 4},
+}
+
+CHILD = """
+import json, os, random, sys
+random.seed(0)
+import importlib
+result = importlib.import_module("bench." + sys.argv[1]).run(**json.loads(sys.argv[2]))
+print("BENCH_RESULT " + json.dumps(result, ensure_ascii=False), flush=True)
+os._exit(0)
+"""
+
+
+def run_scenario(name, kwargs, timeout=600):
+    env = {**os.environ, "PYTHONPATH": ROOT, "PYTHONHASHSEED": "0", "LOG_LEVEL": "WARNING"}
+    started = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-c", CHILD, name, json.dumps(kwargs)], cwd=ROOT, env=env,
+                          capture_output=True, text=True, timeout=timeout)
+    wall = round(time.perf_counter() - started, 3)
+    for line in reversed(proc.stdout.splitlines()):
+        if line.startswith("BENCH_RESULT "):
+            return {"ok": True, "wall_s": wall, "params": kwargs, "result": json.loads(line[len("BENCH_RESULT "):])}
+    return {"ok": False, "wall_s": wall, "params": kwargs, "error": (proc.stderr or proc.stdout)[-2000:]}
+
+
+def _git_rev():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _numbers(value, prefix=""):
+    """入れ子の dict / list から (パス, 数値) を取り出す"""
+    if isinstance(value, bool):
+        return
+    if isinstance(value, (int, float)):
+        yield prefix, value
+    elif isinstance(value, dict):
+        for k, v in value.items():
+            yield from _numbers(v, f"{prefix}.{k}" if prefix else k)
+    elif isinstance(value, list):
+        for i, v in enumerate(value):
+            yield from _numbers(v, f"{prefix}[{i}]")
+
+
+def compare(base, current, threshold=0.1):
+    """同じパスの数値を比べ、threshold（割合）以上変わったものを返す"""
+    out = []
+    for name, run in current["scenarios"].items():
+        before = base.get("scenarios", {}).get(name)
+        if not (run.get("ok") and before and before.get("ok")):
+            continue
+        old = dict(_numbers(before["result"]))
+        for path, new in _numbers(run["result"]):
+            prev = old.get(path)
+            if prev is None or prev == new:
+                continue
+            change = (new - prev) / abs(prev) if prev else float("inf")
+            if abs(change) >= threshold:
+                out.append({"scenario": name, "metric": path, "before": prev, "after": new,
+                            "change": round(change, 3) if prev else None})
+    return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench")
+    parser.add_argument("names", nargs="*", help="実行するシナリオ（省略時は既定のすべて）")
+    parser.add_argument("--all", action="store_true", help="重いシナリオ（restart / shard / cluster）も含める")
+    parser.add_argument("--out", help="結果の JSON を書き出すファイル")
+    parser.add_argument("--compare", help="比較する前回の結果の JSON")
+    parser.add_argument("--threshold", type=float, default=0.1, help="比較で表示する変化の割合（既定 0.1）")
+    args = parser.parse_args(argv)
+
+    known = {**SCENARIOS, **HEAVY}
+    names = args.names or list(SCENARIOS) + (list(HEAVY) if args.all else [])
+    unknown = [n for n in names if n not in known]
+    if unknown:
+        parser.error(f"不明なシナリオ: {', '.join(unknown)}（{', '.join(known)}）")
+
+    report = {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_rev": _git_rev(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "scenarios": {},
+    }
+    for name in names:
+        print(f"[bench] {name} ...", file=sys.stderr, flush=True)
+        report["scenarios"][name] = run_scenario(name, known[name])
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            report["compared_to"] = args.compare
+            report["changes"] = compare(json.load(f), report, args.threshold)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+    return 0 if all(r["ok"] for r in report["scenarios"].values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+"""ローカルで動く Bus-Vision の代役（approach.html を路線ごとの状態から組み立てて返す）
+
+    BUSVISION_BASE_URL=http://127.0.0.1:<port>/ を指定すると app.py の取得先になる。
+
+ページは bench/pages/ のコーパスと同じマークアップ。路線 (stopCdFrom, stopCdTo) ごとに
+set_buses() で接近中のバス（(時刻, 通過した停留所, 残り停留所数) のリスト）を設定する。
+設定の無い路線は「接近中のバスはありません」（errorMsg）を返す。
+
+timetable.html は bench/pages/timetable/ のマークアップで、set_timetable() で設定した
+{曜日の種類: [発車時刻（0 時からの分）, ...]} から組み立てる（設定の無い路線は時刻表の無いページ）。
+"""
+
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pages")
+
+
+def load_page(name: str) -> str:
+    with open(os.path.join(PAGES_DIR, name), encoding="utf-8") as f:
+        return f.read()
+
+
+def corpus(subdir: str = ""):
+    """name -> HTML（bench/pages/*.html。時刻表は subdir="timetable"）"""
+    d = os.path.join(PAGES_DIR, subdir)
+    return {n[:-5]: load_page(os.path.join(subdir, n)) for n in sorted(os.listdir(d)) if n.endswith(".html")}
+
+
+_ONE = load_page("approach_one.html")
+_NONE = load_page("approach_none.html")
+_BLOCK_START = _ONE.index('  <div class="approachData">')
+_BLOCK_END = _ONE.index('</div>\n<div class="notice">')
+HEAD, BLOCK, FOOT = _ONE[:_BLOCK_START], _ONE[_BLOCK_START:_BLOCK_END], _ONE[_BLOCK_END:]
+
+
+def render(buses) -> str:
+    """buses: [(時刻, 通過した停留所, 残り停留所数), ...]（先頭が number=1）"""
+    if not buses:
+        return _NONE
+    blocks = []
+    for i, (t, stop, away) in enumerate(buses, 1):
+        blocks.append(BLOCK.replace('id="number">1', f'id="number">{i}')
+                      .replace("08:07", t).replace("津新町駅", stop).replace(">2つ前", f">{away}つ前"))
+    return HEAD + "".join(blocks) + FOOT
+
+
+_TT = load_page(os.path.join("timetable", "timetable_weekday.html"))
+_TT_START = _TT.index('<div class="timetableBlock"')
+_TT_END = _TT.index('<div class="notice">')
+TT_HEAD, TT_FOOT = _TT[:_TT_START], _TT[_TT_END:]
+TT_LABELS = {"weekday": "平日", "saturday": "土曜", "holiday": "日曜・祝日"}
+
+
+def render_timetable(table) -> str:
+    """table: {"weekday" / "saturday" / "holiday": [発車時刻（0 時からの分）, ...]}（空なら時刻表の無いページ）"""
+    blocks = []
+    for kind, label in TT_LABELS.items():
+        if kind not in table:
+            continue
+        hours = {}
+        for m in sorted(table[kind]):
+            hours.setdefault(m // 60, []).append(f'<span class="minute">{m % 60:02d}</span>')
+        rows = "".join(f'    <tr><th class="hour">{h}</th><td>{"".join(cells)}</td></tr>\n'
+                       for h, cells in hours.items())
+        blocks.append(f'<div class="timetableBlock" id="{kind}">\n  <h2>{label}</h2>\n'
+                      f'  <table class="timetable">\n{rows}  </table>\n</div>\n')
+    return TT_HEAD + "".join(blocks) + TT_FOOT
+
+
+class BusVisionStandin:
+    """latency 秒待ってから応答する。fail=True の間は 503 を返す"""
+
+    def __init__(self, latency: float = 0.0, host: str = "127.0.0.1", port: int = 0):
+        self.latency = latency
+        self.fail = False
+        self.lock = threading.Lock()
+        self.pages = {}      # (from, to) -> HTML
+        self.timetables = {}  # (from, to) -> HTML
+        self.requests = []   # ((from, to), 受信時刻)
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                q = parse_qs(url.query)
+                route = (q.get("stopCdFrom", [""])[0], q.get("stopCdTo", [""])[0])
+                with standin.lock:
+                    standin.requests.append((route, time.monotonic()))
+                    if url.path.endswith("/timetable.html"):
+                        page = standin.timetables.get(route, TT_HEAD + TT_FOOT)
+                    else:
+                        page = standin.pages.get(route, _NONE)
+                if standin.latency:
+                    time.sleep(standin.latency)
+                if not url.path.endswith(("/approach.html", "/timetable.html")):
+                    self._reply(404, b"not found")
+                elif standin.fail:
+                    self._reply(503, b"Service Unavailable")
+                else:
+                    self._reply(200, page.encode("utf-8"))
+
+            def _reply(self, status, data):
+                self.send_response(status)
+                self.send_header("Content-Type", "text/html; charset=UTF-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def set_buses(self, route, buses):
+        page = render(buses)
+        with self.lock:
+            self.pages[tuple(route)] = page
+
+    def set_timetable(self, route, table):
+        page = table if isinstance(table, str) else render_timetable(table)
+        with self.lock:
+            self.timetables[tuple(route)] = page
+
+    def count(self, route=None):
+        with self.lock:
+            return sum(1 for r, _ in self.requests if route is None or r == tuple(route))
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    import sys
+
+    with BusVisionStandin(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8090) as s:
+        s.set_buses(("00101", "00422"), [("08:07", "津新町駅", 2), ("07:58", "久居駅東口", 9)])
+        print(f"Bus-Vision stand-in: {s.base_url}")
+        threading.Event().wait()
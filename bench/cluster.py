@@ -0,0 +1,117 @@
+"""gunicorn の複数ワーカー構成: Webhook の受け付け数/秒と、処理が 1 プロセスにまとまっていること
+
+ワーカー数を変えて gunicorn を起動し、利用者ごとに 設定開始 → 乗車 → 降車 の順で並列に送る。
+reply の件数がイベント数と一致すれば重複も欠落もなく、最後の応答が全員「乗車時刻を選択」なら
+順序が守られている。
+
+    python -m bench.cluster [利用者数] [ワーカー数]
+"""
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from bench import ROOT, child_env
+from bench.line_standin import LineStandin
+from bench.webhook import SECRET, STEPS, _body, _sign
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_ready(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"{url}/stats", timeout=1).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError("gunicorn が起動しませんでした")
+
+
+def _send_user(url, user, n0):
+    session = requests.Session()
+    acks = []
+    for k, step in enumerate(STEPS):
+        body = _body(user, step, n0 + k)
+        started = time.perf_counter()
+        r = session.post(f"{url}/callback", data=body.encode(),
+                         headers={"X-Line-Signature": _sign(body), "Content-Type": "application/json"})
+        acks.append(time.perf_counter() - started)
+        assert r.status_code == 200, r.status_code
+    return acks
+
+
+def run_workers(workers: int, users: int, standin):
+    with tempfile.TemporaryDirectory() as d:
+        port = _free_port()
+        url = f"http://127.0.0.1:{port}"
+        env = child_env(PORT=port, WEB_CONCURRENCY=workers, LINE_CHANNEL_SECRET=SECRET,
+                        LINE_API_ENDPOINT=standin.endpoint, BUSVISION_BASE_URL="http://127.0.0.1:9/",
+                        STATE_STORE=os.path.join(d, "state.db"),
+                        TIMETABLE_STORE=os.path.join(d, "timetables.db"),
+                        OBSERVATION_LOG=os.path.join(d, "observations"), CLUSTER_DIR=d)
+        proc = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"],
+                                cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            _wait_ready(url)
+            before = standin.count("/reply")
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=16) as pool:
+                acks = [a for f in [pool.submit(_send_user, url, f"W{workers}U{i:05d}", i * len(STEPS))
+                                    for i in range(users)] for a in f.result()]
+            ack_s = time.perf_counter() - started
+
+            events = users * len(STEPS)
+            deadline = time.monotonic() + 60
+            while standin.count("/reply") - before < events and time.monotonic() < deadline:
+                time.sleep(0.05)
+            total_s = time.perf_counter() - started
+            time.sleep(0.5)   # 重複があれば遅れて届く分も数える
+
+            with standin.lock:
+                replies = [b for p, b, _ in standin.requests[before:] if p.endswith("/reply")]
+            acks.sort()
+            return {
+                "workers": workers,
+                "acks_per_s": round(events / ack_s, 1),
+                "ack_ms_p50": round(acks[len(acks) // 2] * 1e3, 2),
+                "ack_ms_p95": round(acks[int(len(acks) * 0.95)] * 1e3, 2),
+                "processed_s": round(total_s, 3),
+                "replies": len(replies),
+                "exactly_once": len(replies) == events,
+                "ordered": sum("乗車時刻を選択" in (b["messages"][0].get("text") or "") for b in replies) == users,
+            }
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+def run(users: int = 300, workers: int = 4):
+    with LineStandin(latency=0.02) as standin:
+        return {
+            "bench": "cluster",
+            "users": users,
+            "events": users * len(STEPS),
+            "runs": [run_workers(w, users, standin) for w in sorted({1, workers})],
+        }
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    print(json.dumps(run(*args), ensure_ascii=False))
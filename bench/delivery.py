@@ -0,0 +1,85 @@
+"""LINE 送信: 1 人ずつ push する場合と DeliveryQueue（multicast まとめ）の比較（ローカルの代役 API 相手）
+
+throttled: 1 人だけ 429（Retry-After）を 2 回返されるとき、ほかの利用者への通知が積んでから
+届くまでの時間（その人のリトライ待ちに巻き込まれないこと）と、その人宛ての 2 通の順序。
+
+    python -m bench.delivery [利用者数] [路線数]
+"""
+
+import json
+import sys
+import time
+
+from linebot import LineBotApi
+from linebot.models import TextSendMessage
+
+from bench.line_standin import LineStandin
+from delivery import DeliveryQueue
+
+
+def _updates(users: int, routes: int):
+    return [(f"U{i:05d}", f"🚌 バス位置情報更新:\n路線{i % routes}") for i in range(users)]
+
+
+def _throttled(users, retry_after=2, waves=5, gap=0.3):
+    with LineStandin(throttle={"Uslow": 2}, retry_after=retry_after) as standin:
+        queue = DeliveryQueue(LineBotApi("dummy", endpoint=standin.endpoint), rate=1000)
+        pushed = {}
+        queue.push("Uslow", TextSendMessage(text="1通目"))
+        queue.push("Uslow", TextSendMessage(text="2通目"))
+        for w in range(waves):
+            for i in range(users // waves):
+                uid = f"U{w}-{i:04d}"
+                pushed[uid] = time.monotonic()
+                queue.push(uid, TextSendMessage(text=f"🚌 路線{i % 20}"))
+            time.sleep(gap)
+        queue.flush()
+        with standin.lock:
+            received = {}
+            for _, body, at in standin.requests:
+                to = body.get("to")
+                for uid in (to if isinstance(to, list) else [to]):
+                    received.setdefault(uid, at)
+        lag = sorted(received[uid] - at for uid, at in pushed.items())
+        slow = [t for uid, t in standin.recipients() if uid == "Uslow"]
+    out = {
+        "retry_after_s": retry_after,
+        "others_lag_ms_p50": round(lag[len(lag) // 2] * 1e3, 1),
+        "others_lag_ms_max": round(lag[-1] * 1e3, 1),
+        "slow_user_messages": slow,
+    }
+    assert slow == ["1通目", "2通目"] and lag[-1] < retry_after, out
+    return out
+
+
+def run(users: int = 1000, routes: int = 20, latency: float = 0.01):
+    updates = _updates(users, routes)
+    result = {"bench": "delivery", "users": users, "routes": routes, "api_latency_ms": latency * 1e3}
+
+    with LineStandin(latency=latency) as standin:
+        api = LineBotApi("dummy", endpoint=standin.endpoint)
+        started = time.perf_counter()
+        for uid, text in updates:
+            api.push_message(uid, TextSendMessage(text=text))
+        result["sequential_s"] = round(time.perf_counter() - started, 3)
+        result["sequential_requests"] = standin.count()
+
+    with LineStandin(latency=latency, fail_every=7) as standin:
+        queue = DeliveryQueue(LineBotApi("dummy", endpoint=standin.endpoint), rate=1000)
+        started = time.perf_counter()
+        for uid, text in updates:
+            queue.push(uid, TextSendMessage(text=text))
+        result["enqueue_us_per_push"] = round((time.perf_counter() - started) / users * 1e6, 2)
+        queue.flush()
+        result["queued_s"] = round(time.perf_counter() - started, 3)
+        result["queued_requests"] = standin.count()
+        result["delivered_users"] = len({uid for uid, _ in standin.recipients()})
+        result["queue_stats"] = dict(queue.stats)
+
+    result["throttled"] = _throttled(users)
+    return result
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    print(json.dumps(run(*args), ensure_ascii=False))
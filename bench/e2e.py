@@ -0,0 +1,104 @@
+"""端から端まで: Bus-Vision 上でバスが動いてから、LINE に push（multicast）が届くまでの時間
+
+Bus-Vision と LINE をローカルの代役に向けて app を import し、users 人を routes 路線に
+振り分けて監視エンジンに登録する。rounds 回、全路線のバスを 1 停留所進め、各利用者宛ての
+更新が LINE の代役に届くまでの時間を測る（ポーリング間隔の待ちを含む）。
+
+    python -m bench.e2e [利用者数] [路線数] [回数]
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from bench import use_app_env
+from bench.busvision_standin import BusVisionStandin
+from bench.line_standin import LineStandin
+
+
+def _route(i):
+    return (f"{1000 + i:05d}", f"{9000 + i:05d}")
+
+
+def _wait_for(standin, since_index, stop_name, users, timeout):
+    """since_index 以降に stop_name を含む通知を受け取った利用者 -> 受信時刻"""
+    got = {}
+    deadline = time.monotonic() + timeout
+    while len(got) < users and time.monotonic() < deadline:
+        with standin.lock:
+            recent = standin.requests[since_index:]
+        for path, body, at in recent:
+            to = body.get("to")
+            if to is None or not any(stop_name in (m.get("text") or "") for m in body.get("messages", [])):
+                continue
+            for uid in (to if isinstance(to, list) else [to]):
+                got.setdefault(uid, at)
+        time.sleep(0.01)
+    return got
+
+
+def run(users: int = 1000, routes: int = 50, rounds: int = 3, interval: float = 1.0):
+    with BusVisionStandin() as busvision, LineStandin(latency=0.01) as line:
+        use_app_env(
+            LINE_API_ENDPOINT=line.endpoint,
+            BUSVISION_BASE_URL=busvision.base_url,
+            OBSERVATION_LOG=tempfile.mkdtemp(prefix="bench-observations-"),
+            MONITOR_MIN_INTERVAL=interval,
+            MONITOR_MAX_INTERVAL=interval,
+            BUSVISION_RATE=1000,
+        )
+        import app
+
+        for r in range(routes):
+            busvision.set_buses(_route(r), [("08:00", "停留所0", 5)])
+        now = datetime.now()
+        dep = now + timedelta(minutes=3)
+        for i in range(users):
+            app.monitor_engine.watch(f"U{i:06d}", _route(i % routes), dep, dep + timedelta(minutes=30), now=now)
+        first = _wait_for(line, 0, "停留所0", users, timeout=30)
+
+        latencies = []
+        missing = 0
+        polls_before = busvision.count()
+        started = time.monotonic()
+        for k in range(1, rounds + 1):
+            since = len(line.requests)
+            moved_at = time.monotonic()
+            for r in range(routes):
+                busvision.set_buses(_route(r), [(f"08:{k:02d}", f"停留所{k}", max(1, 5 - k))])
+            got = _wait_for(line, since, f"停留所{k}", users, timeout=interval * 5 + 10)
+            latencies.extend(at - moved_at for at in got.values())
+            missing += users - len(got)
+        elapsed = time.monotonic() - started
+        polls = busvision.count() - polls_before
+
+        latencies.sort()
+
+        def pct(p):
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1e3, 1) if latencies else None
+
+        return {
+            "bench": "e2e",
+            "users": users,
+            "routes": routes,
+            "rounds": rounds,
+            "poll_interval_s": interval,
+            "initial_notified": len(first),
+            "latency_ms_p50": pct(0.5),
+            "latency_ms_p95": pct(0.95),
+            "latency_ms_max": round(latencies[-1] * 1e3, 1) if latencies else None,
+            "missing": missing,
+            "busvision_requests_per_s": round(polls / elapsed, 1),
+            "line_requests": len(line.requests),
+            "line_requests_per_update": round(len(line.requests) / max(1, users * (rounds + 1)), 3),
+        }
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:4]]
+    print(json.dumps(run(*args), ensure_ascii=False), flush=True)
+    # 監視エンジンのスレッドが終了処理中のプールに投げてエラーを出さないように
+    os._exit(0)
@@ -0,0 +1,119 @@
+"""ローカルで動く LINE Messaging API の代役（push / multicast / reply を受けて記録するだけ）
+
+    LINE_API_ENDPOINT=http://127.0.0.1:<port> を指定すると app.py の送信先になる。
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class LineStandin:
+    """latency 秒待ってから応答する。fail_every > 0 なら n 回に 1 回 429 を返す
+
+    throttle = {user_id: 回数} なら、その利用者への push は最初の回数分だけ
+    429（Retry-After: retry_after 秒）を返す（記録はしない）。
+    """
+
+    def __init__(self, latency: float = 0.0, fail_every: int = 0, host: str = "127.0.0.1", port: int = 0,
+                 throttle=None, retry_after: int = 0):
+        self.latency = latency
+        self.fail_every = fail_every
+        self.throttle = dict(throttle or {})
+        self.retry_after = retry_after
+        self.requests = []   # (path, body, 受信時刻)
+        self.lock = threading.Lock()
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                to = json.loads(body or b"{}").get("to")
+                with standin.lock:
+                    if isinstance(to, str) and standin.throttle.get(to):
+                        standin.throttle[to] -= 1
+                        throttled = True
+                    else:
+                        throttled = False
+                if throttled:
+                    self._reply(429, {"message": "The API rate limit has been exceeded."},
+                                {"Retry-After": str(standin.retry_after)})
+                    return
+                with standin.lock:
+                    standin.requests.append((self.path, json.loads(body or b"{}"), time.monotonic()))
+                    n = len(standin.requests)
+                if standin.latency:
+                    time.sleep(standin.latency)
+                if standin.fail_every and n % standin.fail_every == 0:
+                    self._reply(429, {"message": "The API rate limit has been exceeded."}, {"Retry-After": "0"})
+                else:
+                    self._reply(200, {})
+
+            def _reply(self, status, payload, headers=None):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def endpoint(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # ------------------------------------------------------------
+    #  集計
+    # ------------------------------------------------------------
+
+    def count(self, path_suffix: str = ""):
+        with self.lock:
+            return sum(1 for p, _, _ in self.requests if p.endswith(path_suffix))
+
+    def recipients(self):
+        """push / multicast で届いた (user_id, text) の一覧"""
+        out = []
+        with self.lock:
+            for path, body, _ in self.requests:
+                to = body.get("to")
+                if to is None:
+                    continue
+                texts = [m.get("text") for m in body.get("messages", [])]
+                for uid in (to if isinstance(to, list) else [to]):
+                    out.extend((uid, t) for t in texts)
+        return out
+
+
+if __name__ == "__main__":
+    import sys
+
+    with LineStandin(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8089) as s:
+        print(f"LINE stand-in: {s.endpoint}")
+        threading.Event().wait()
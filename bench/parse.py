@@ -0,0 +1,97 @@
+"""approach.html の解析: コーパス（bench/pages）のページごとの extract_bus_info のスループット
+
+高速スキャナ（fast）と BeautifulSoup（soup）の両方で、同じページを繰り返し解析する。
+利用者は毎回変えるので、毎回「変化あり」として表示用の文字列まで作る。
+
+測る前に check_parity() で、コーパスの全ページと、それを書き換えたレイアウト違い（VARIANTS）について
+parse_fast と parse_soup が同じ結果になるか（想定外の構造なら LayoutMismatch を出し、parse_approach が
+soup と同じ結果に戻るか）を確かめる。1 つでも食い違えば AssertionError で止まる。
+
+    python -m bench.parse [繰り返し回数]
+"""
+
+import json
+import sys
+import time
+
+from bench import use_app_env
+from bench.busvision_standin import corpus
+
+# ページ中の 1 件目の approachData（script の中のコメントではなく本物の div）
+BLOCK = '<div class="approachData">\n'
+
+# (名前, 元のページ, 置き換え前, 置き換え後, 高速スキャナが LayoutMismatch を出すべきか)
+VARIANTS = [
+    # 高速スキャナのままで soup と同じ結果になるべきもの
+    ("single_quotes", "approach_one", BLOCK, "<div class='approachData'>\n", False),
+    ("extra_classes", "approach_one", BLOCK, '<div class="approachData is-first">\n', False),
+    ("upper_case_tags", "approach_one", '<span id="number">1</span>', '<SPAN id="number">1</SPAN>', False),
+    ("entities", "approach_one", "2つ前を通過", "2つ前&#x3092;通過", False),
+    ("commented_out", "approach_multi", '<div id="approachList">', '<div id="approachList"><!-- <div class="approachData"><span id="number">9</span></div> -->', False),
+    ("missing_pass", "approach_one", '<span id="passInfo">2つ前を通過</span>', "", False),
+    ("inline_markup", "approach_one", '<span id="number">1</span>', '<span id="number"><em>1</em></span>', False),
+    # 想定していない構造: 高速スキャナは LayoutMismatch を出し、soup にフォールバックするべきもの
+    ("nested_number", "approach_one", '<span id="number">1</span>', '<span id="number"><span>1</span></span>', True),
+    ("unclosed_pass", "approach_one", '<span id="passInfo">2つ前を通過</span>', '<span id="passInfo">2つ前を通過', True),
+    ("not_a_div", "approach_one", BLOCK, '<section class="approachData">\n', True),
+]
+
+
+def _variants(pages):
+    for name, base, old, new, mismatch in VARIANTS:
+        html = pages[base]
+        assert old in html, f"{name}: {base} に置き換える箇所が無い"
+        yield name, html.replace(old, new, 1), mismatch
+
+
+def check_parity():
+    """コーパスとレイアウト違いで parse_fast == parse_soup を確かめる。ページ名 -> "fast" / "fallback" """
+    from approach_parser import LayoutMismatch, parse_approach, parse_fast, parse_soup
+
+    pages = corpus()
+    cases = [(name, html, False) for name, html in pages.items()] + list(_variants(pages))
+    out = {}
+    for name, html, mismatch in cases:
+        expected = parse_soup(html)
+        try:
+            got = parse_fast(html)
+        except LayoutMismatch:
+            assert mismatch, f"{name}: 想定外の LayoutMismatch"
+            assert parse_approach(html, "fast") == expected, f"{name}: フォールバックの結果が soup と違う"
+            out[name] = "fallback"
+            continue
+        assert not mismatch, f"{name}: LayoutMismatch になるはずが {got!r}"
+        assert got == expected, f"{name}: fast={got!r} soup={expected!r}"
+        out[name] = "fast"
+    return out
+
+
+def run(repeat: int = 2000):
+    use_app_env()
+    import app
+    import approach_parser
+
+    session = app.BusVisionSession(fetcher=object())
+    result = {"bench": "parse", "repeat": repeat, "parity": check_parity(), "pages": {}}
+    default = approach_parser.PARSER_BACKEND
+    try:
+        for name, html in corpus().items():
+            row = {"bytes": len(html.encode("utf-8"))}
+            for backend in ("fast", "soup"):
+                approach_parser.PARSER_BACKEND = backend
+                n = repeat if backend == "fast" else max(1, repeat // 10)
+                started = time.perf_counter()
+                for i in range(n):
+                    session.extract_bus_info(html, f"U{i}")
+                elapsed = time.perf_counter() - started
+                row[f"{backend}_pages_per_s"] = round(n / elapsed, 1)
+                row[f"{backend}_us"] = round(elapsed / n * 1e6, 1)
+            row["speedup"] = round(row["soup_us"] / row["fast_us"], 1)
+            result["pages"][name] = row
+    finally:
+        approach_parser.PARSER_BACKEND = default
+    return result
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(int(sys.argv[1]) if len(sys.argv) > 1 else 2000), ensure_ascii=False))
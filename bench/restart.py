@@ -0,0 +1,92 @@
+"""再起動から復旧までの時間: 保存済みの利用者 n 人分を読み戻し、ジョブを作り直して監視を再開する
+
+SQLite に n 人分（設定・対話状態・監視予定・最後の通知）を書いてから、別プロセスで app を import する。
+監視時間内の利用者（in_window の割合。半分は 1 回だけ、半分は繰り返し設定で次回分の予定を
+持ったまま今回を監視中）は起動直後に監視エンジンへ戻る。Bus-Vision は接続できない
+アドレスに向ける。
+
+    python -m bench.restart [利用者数] [監視時間内の割合]
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from bench import child_env
+from state_store import SQLiteStore, dumps
+
+CHILD = """
+import json, os, sys, time
+started = time.perf_counter()
+import app
+ready = time.perf_counter() - started
+expected = int(sys.argv[1])
+while len(app.monitor_engine.watches) < expected and time.perf_counter() - started < 60:
+    time.sleep(0.01)
+resumed = time.perf_counter() - started
+print(json.dumps({"import_app_s": round(ready, 3), "resumed_s": round(resumed, 3),
+                  "jobs": len(app.job_scheduler), "watches": len(app.monitor_engine.watches)}), flush=True)
+# 監視ワーカーが取得のリトライを終えるのを待たずに終わる
+os._exit(0)
+"""
+
+
+def seed(path: str, n: int, in_window: float):
+    store = SQLiteStore(path, batch_size=n * 4 + 1)
+    now = datetime.now()
+    windowed = int(n * in_window)
+    for i in range(n):
+        uid = f"U{i:07d}"
+        active = None
+        if i < windowed and i % 2 == 0:
+            dep, repeat = now + timedelta(minutes=2), "once"
+        elif i < windowed:
+            active, dep, repeat = now + timedelta(minutes=2), now + timedelta(days=1, minutes=2), "daily"
+        else:
+            dep, repeat = now + timedelta(hours=2, seconds=i % 3600), ("daily", "weekday")[i % 2]
+        route = [str(1000 + i % 32), str(2000 + i % 31)]
+        store.write("settings", uid, dumps({"boarding": "津駅前", "alighting": "乙部朝日", "time": dep}))
+        store.write("status", uid, dumps({"state": None}))
+        job = {"departure_time": dep, "route": route, "repeat": repeat}
+        store.write("jobs", uid, dumps({**job, "active_departure": active} if active else job))
+        store.write("last_approach", uid, dumps([1, "08:12", "津駅前", "2つ前"]))
+    store.close()
+    return windowed
+
+
+def run(n: int = 100000, in_window: float = 0.1):
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "state.db")
+        started = time.perf_counter()
+        windowed = seed(path, n, in_window)
+        seed_s = time.perf_counter() - started
+
+        store = SQLiteStore(path)
+        started = time.perf_counter()
+        for name in ("settings", "status", "jobs", "last_approach"):
+            store.table(name)
+        load_s = time.perf_counter() - started
+        store.close()
+
+        env = child_env(STATE_STORE=path, BUSVISION_BASE_URL="http://127.0.0.1:9/")
+        out = subprocess.run([sys.executable, "-c", CHILD, str(windowed)], env=env,
+                             capture_output=True, text=True, check=True).stdout
+        return {
+            "bench": "restart",
+            "users": n,
+            "in_window": windowed,
+            "in_window_repeat": windowed // 2,
+            "db_bytes": os.path.getsize(path),
+            "seed_s": round(seed_s, 3),
+            "load_tables_s": round(load_s, 3),
+            **json.loads(out.strip().splitlines()[-1]),
+        }
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:3]
+    print(json.dumps(run(int(args[0]) if args else 100000, *(float(a) for a in args[1:])), ensure_ascii=False))
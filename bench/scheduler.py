@@ -0,0 +1,51 @@
+"""ジョブスケジューラ: 10 万件の登録 / 取り消し / 取り出しと、待機中の CPU 時間
+
+    python -m bench.scheduler [件数]
+"""
+
+import json
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from scheduler import JobScheduler
+
+
+def run(n: int = 100000):
+    sched = JobScheduler()
+    base = datetime.now() + timedelta(hours=1)
+    times = [base + timedelta(seconds=random.randrange(86400)) for _ in range(n)]
+
+    started = time.perf_counter()
+    ids = [sched.add(t, lambda: None) for t in times]
+    add_us = (time.perf_counter() - started) / n * 1e6
+
+    cancelled = random.sample(ids, n // 2)
+    started = time.perf_counter()
+    for job_id in cancelled:
+        sched.cancel(job_id)
+    cancel_us = (time.perf_counter() - started) / len(cancelled) * 1e6
+
+    # 登録済みのジョブを抱えたまま 1 秒待機したときのプロセス CPU 時間
+    cpu = time.process_time()
+    time.sleep(1.0)
+    idle_cpu_ms = (time.process_time() - cpu) * 1e3
+
+    started = time.perf_counter()
+    due = sched.pop_due(base + timedelta(days=1))
+    pop_us = (time.perf_counter() - started) / max(1, len(due)) * 1e6
+
+    return {
+        "bench": "scheduler",
+        "jobs": n,
+        "add_us": round(add_us, 2),
+        "cancel_us": round(cancel_us, 2),
+        "pop_due_us": round(pop_us, 2),
+        "popped": len(due),
+        "idle_cpu_ms_per_s": round(idle_cpu_ms, 2),
+    }
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000), ensure_ascii=False))
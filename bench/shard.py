@@ -0,0 +1,178 @@
+"""路線の分担（shard.py）: 監視ワーカー数ごとのポーリング数/秒と、ワーカーが落ちたときの引き継ぎ
+
+監視ワーカーを別プロセスで起動し、ShardRegistry に routes 路線 × 3 人分の監視対象を書く。
+Bus-Vision の代わりに、路線ごとに period 秒ごとに先頭のバスが 1 停留所進むページを返す
+（解析は本物の approach_parser）。
+
+- scaling: ワーカー数ごとの合計ポーリング数/秒（各路線は interval 秒ごとにポーリングされる上限付き）
+- handover: ワーカーを 1 つ kill -9 し、全路線を生きているワーカーが持ち直すまでの秒数と、
+  同じ利用者に同じ内容が 2 回以上届いていないか（duplicates）
+
+    python -m bench.shard [路線数] [ワーカー数] [秒数] [ポーリング間隔(秒)]
+"""
+
+import json
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+
+import approach_parser
+from monitor import MonitorEngine
+from shard import ShardMember, ShardRegistry
+from snapshots import ApproachRecord, lead
+
+PAGE = """<html><body><div id="approach">
+<div class="approachData"><span id="number">1</span>
+<div id="approachInfo">{time}に{stop}を通過</div><span id="passInfo">{away}つ前を通過</span></div>
+<div class="approachData"><span id="number">2</span>
+<div id="approachInfo">08:01に三重会館を通過</div><span id="passInfo">9つ前を通過</span></div>
+</div>{padding}</body></html>"""
+
+
+def _page(route, period):
+    step = int(time.time() / period) + zlib.crc32("-".join(route).encode()) % 7
+    return PAGE.format(time=f"08:{step % 60:02d}", stop=f"停留所{step % 10}", away=1 + step % 5,
+                       padding="<p>時刻表</p>" * 200)
+
+
+def _member(path, worker_id, interval, period, polls):
+    sys.stdout = open(os.devnull, "w")   # [DEBUG] の出力で結果の JSON を埋もれさせない
+    registry = ShardRegistry(path)
+    last = {}
+    db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+    lock = threading.Lock()
+
+    def deliver(uid, snapshot):
+        record = lead(snapshot)
+        if record and last.get(uid) != record:
+            last[uid] = record
+            registry.save_notified(uid, record)
+            with lock, db:
+                db.execute("INSERT INTO delivered (user_id, record, worker) VALUES (?, ?, ?)",
+                           (uid, json.dumps(list(record), ensure_ascii=False), worker_id))
+
+    def fetch(from_code, to_code):
+        with polls.get_lock():
+            polls.value += 1
+        return _page((from_code, to_code), period)
+
+    engine = MonitorEngine(fetch=fetch, parse=approach_parser.parse_approach, deliver=deliver,
+                           on_finish=lambda uid: last.pop(uid, None), interval=interval, workers=2)
+    member = ShardMember(
+        registry, engine, worker_id=worker_id, interval=0.2, ttl=1.0,
+        on_acquire=lambda uids: last.update((u, ApproachRecord(*v)) for u, v in registry.load_notified(uids).items()),
+        on_release=lambda uids: [last.pop(u, None) for u in uids],
+    )
+    member.start()
+    member.join()
+
+
+def _setup(path, routes):
+    registry = ShardRegistry(path)
+    with sqlite3.connect(path) as db:
+        db.execute("CREATE TABLE IF NOT EXISTS delivered (user_id TEXT, record TEXT, worker TEXT)")
+    now = datetime.now()
+    for r in range(routes):
+        for u in range(3):
+            registry.publish(f"R{r:04d}U{u}", (str(1000 + r), str(9000 + r)), now, now + timedelta(hours=1))
+    return registry
+
+
+def _start(path, workers, interval, period):
+    ctx = multiprocessing.get_context("spawn")
+    procs = []
+    for i in range(workers):
+        polls = ctx.Value("l", 0)
+        p = ctx.Process(target=_member, args=(path, f"w{i}", interval, period, polls), daemon=True)
+        p.start()
+        procs.append((p, polls))
+    return procs
+
+
+def _wait_owned(registry, routes, alive, timeout=30):
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        owners = registry.lease_owners()
+        if len(owners) == routes and set(owners.values()) <= alive:
+            return time.perf_counter() - started
+        time.sleep(0.02)
+    return None
+
+
+def _stop(procs):
+    for p, _ in procs:
+        p.kill()
+        p.join()
+
+
+def run_scaling(workers, routes, seconds, interval):
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "shards.db")
+        registry = _setup(path, routes)
+        procs = _start(path, workers, interval, period=1.0)
+        try:
+            ready = _wait_owned(registry, routes, {f"w{i}" for i in range(workers)})
+            time.sleep(1.0)   # ring が落ち着くまで
+            before = [p.value for _, p in procs]
+            time.sleep(seconds)
+            done = [p.value - b for (_, p), b in zip(procs, before)]
+        finally:
+            _stop(procs)
+        return {
+            "workers": workers,
+            "assign_s": round(ready, 3) if ready is not None else None,
+            "polls_per_s": round(sum(done) / seconds, 1),
+            "per_worker": [round(n / seconds, 1) for n in done],
+            "ceiling_per_s": round(routes / interval, 1),
+        }
+
+
+def run_handover(workers, routes, seconds, interval, period=0.5):
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "shards.db")
+        registry = _setup(path, routes)
+        procs = _start(path, workers, interval, period)
+        try:
+            _wait_owned(registry, routes, {f"w{i}" for i in range(workers)})
+            time.sleep(seconds / 2)
+            victim, _ = procs[0]
+            moved = sum(1 for w in registry.lease_owners().values() if w == "w0")
+            victim.kill()
+            takeover = _wait_owned(registry, routes, {f"w{i}" for i in range(1, workers)})
+            time.sleep(seconds / 2)
+        finally:
+            _stop(procs)
+        with sqlite3.connect(path) as db:
+            delivered = db.execute("SELECT COUNT(*) FROM delivered").fetchone()[0]
+            duplicates = db.execute(
+                "SELECT COALESCE(SUM(n - 1), 0) FROM (SELECT COUNT(*) AS n FROM delivered"
+                " GROUP BY user_id, record HAVING n > 1)").fetchone()[0]
+        return {
+            "workers": workers,
+            "routes_moved": moved,
+            "takeover_s": round(takeover, 3) if takeover is not None else None,
+            "delivered": delivered,
+            "duplicates": duplicates,
+        }
+
+
+def run(routes: int = 400, workers: int = 4, seconds: float = 5.0, interval: float = 0.5):
+    return {
+        "bench": "shard",
+        "routes": routes,
+        "users": routes * 3,
+        "cpus": os.cpu_count(),
+        "scaling": [run_scaling(w, routes, seconds, interval) for w in sorted({1, 2, workers})],
+        "handover": run_handover(max(2, workers), routes, seconds, interval),
+    }
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:5]
+    print(json.dumps(run(*(int(a) for a in args[:2]), *(float(a) for a in args[2:])), ensure_ascii=False))
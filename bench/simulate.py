@@ -0,0 +1,137 @@
+"""仮想時計で 1 日分: users 人が通勤時間帯に監視したときのリクエスト数・通知の遅れ・スケジューラの負荷
+
+simulation.Simulation で app の監視部分を仮想時計に差し替え、Bus-Vision の代わりに Replay を使う。
+各路線には headway 分おきにバスが走り、到着の 12 分前から 2 分ごとに 1 停留所ずつ近づく
+（bench/pages のマークアップで組み立てる）。利用者は停留所カタログから乗降車の組を選び、
+朝（8 時前後）か夕方（18 時前後）の乗車時刻で schedule_bus_check する。
+
+- latency: ページが変わってから（監視開始前に変わったものは監視開始から）通知するまでの仮想時間
+- scheduler_seconds / engine_seconds: ジョブの実行 / ポーリング（解析と配信を含む）にかかった実時間
+
+    python -m bench.simulate [利用者数] [路線数]
+"""
+
+import json
+import os
+import random
+import sys
+import time
+import zlib
+from datetime import datetime, timedelta
+
+from bench import use_app_env
+from bench.busvision_standin import render
+
+DAY = datetime(2024, 4, 1)
+APPROACH_STOPS = 6       # 到着の何停留所前から接近情報に出るか
+STOP_MINUTES = 2         # 1 停留所あたりの所要分
+
+
+def _buses(names, offset, headway, minute):
+    """その分に接近情報に出ているバス（近い順）"""
+    buses = []
+    # minute 以降に到着するバスのうち、APPROACH_STOPS 停留所以内まで来ているもの
+    first = minute + ((offset - minute) % headway)
+    for arrive in range(first, minute + APPROACH_STOPS * STOP_MINUTES + 1, headway):
+        away = -(-(arrive - minute) // STOP_MINUTES)
+        if 1 <= away <= APPROACH_STOPS:
+            passed = arrive - away * STOP_MINUTES
+            buses.append((f"{passed // 60:02d}:{passed % 60:02d}", names[(offset + away) % len(names)], away))
+    return tuple(buses)
+
+
+def build_replay(routes, names, headway=10, first=5 * 60, last=24 * 60):
+    from simulation import Replay
+
+    replay = Replay(render=render, empty=render([]))
+    for route in routes:
+        offset = zlib.crc32("-".join(route).encode()) % headway
+        prev = None
+        for minute in range(first, last):
+            buses = _buses(names, offset, headway, minute)
+            if buses != prev:
+                replay.add(route, DAY + timedelta(minutes=minute), buses)
+                prev = buses
+        replay.add(route, DAY + timedelta(minutes=last), ())
+    return replay
+
+
+def scheduled(route, headway=10, first=5 * 60, last=24 * 60):
+    """build_replay と同じ路線の、乗車停留所の発車時刻（0 時からの分）"""
+    offset = zlib.crc32("-".join(route).encode()) % headway
+    return [m for m in range(first, last) if (m - offset) % headway == 0]
+
+
+def _departure(rng):
+    center, spread = (8 * 60, 40) if rng.random() < 0.7 else (18 * 60, 60)
+    minute = int(min(23 * 60, max(6 * 60, rng.gauss(center, spread))))
+    return DAY + timedelta(minutes=minute)
+
+
+def run(users: int = 10000, routes: int = 300, headway: int = 10):
+    use_app_env()
+    import app
+    from simulation import Simulation
+
+    rng = random.Random(0)
+    stops = [s for s in app.STOP_CATALOG.stops()]
+    pairs = [(a, b) for a in stops for b in stops if a.code != b.code]
+    rng.shuffle(pairs)
+    pairs = pairs[:routes]
+    names = [s.name for s in stops]
+    replay = build_replay([(a.code, b.code) for a, b in pairs], names, headway)
+
+    sim = Simulation(app, replay, start=DAY + timedelta(hours=5))
+    route_of, departure_of = {}, {}
+    started = time.perf_counter()
+    with sim:
+        for i in range(users):
+            uid = f"U{i:06d}"
+            a, b = pairs[i % len(pairs)]
+            dep = _departure(rng)
+            app.user_settings[uid] = {"boarding": a.name, "alighting": b.name, "time": dep}
+            app.schedule_bus_check(uid, dep)
+            route_of[uid], departure_of[uid] = (a.code, b.code), dep
+        sim.run_until(DAY + timedelta(hours=24))
+    wall = time.perf_counter() - started
+
+    latencies = []
+    finished = 0
+    for at, uid, text in sim.delivery.sent:
+        if text.startswith("✅"):
+            finished += 1
+        elif text.startswith("🚌"):
+            since = max(replay.changed_at(route_of[uid], at), departure_of[uid] - app.MONITOR_LEAD)
+            latencies.append((at - since).total_seconds())
+    latencies.sort()
+
+    def pct(p):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 1) if latencies else None
+
+    stats = sim.stats()
+    return {
+        "bench": "simulate",
+        "users": users,
+        "routes": len(pairs),
+        "headway_min": headway,
+        "simulated_hours": 19,
+        "wall_s": round(wall, 3),
+        "speedup": round(19 * 3600 / wall),
+        "upstream_requests": stats["upstream_requests"],
+        "upstream_requests_per_user": round(stats["upstream_requests"] / users, 2),
+        "notifications": len(latencies),
+        "finished": finished,
+        "latency_s_p50": pct(0.5),
+        "latency_s_p95": pct(0.95),
+        "latency_s_max": latencies[-1] if latencies else None,
+        "steps": stats["steps"],
+        "scheduler_seconds": stats["scheduler_seconds"],
+        "engine_seconds": stats["engine_seconds"],
+        "engine_us_per_poll": round(stats["engine_seconds"] / max(1, stats["polls"]) * 1e6, 1),
+    }
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    print(json.dumps(run(*args), ensure_ascii=False), flush=True)
+    os._exit(0)
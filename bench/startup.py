@@ -0,0 +1,127 @@
+"""起動の速さ: app の import にかかる時間と、プロセスを起動してから最初の Webhook に応えるまでの時間
+
+どれも新しいプロセスで測る（import 済みのモジュールが混ざらないように）。
+
+- import: python -c "import app" の中で測った import の時間（repeat 回の中央値）と STARTUP の内訳
+- deferred: 起動時に読まなくなったモジュール（linebot / bs4 / requests）だけを import する時間
+- first_callback: プロセスを起動してから、署名付きの /callback が 200 を返すまで（ready はポートを
+  開くまで）と、その返信が LINE の代役に届くまで。warm_up あり（WARMUP_DELAY=0）/ なし（-1）
+
+    python -m bench.startup [回数]
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+from bench import ROOT, child_env
+from bench.line_standin import LineStandin
+
+SECRET = "bench-secret"
+
+IMPORT = """
+import json, time
+started = time.perf_counter()
+import app
+print(json.dumps({"import_ms": (time.perf_counter() - started) * 1e3, "startup": app.STARTUP}), flush=True)
+"""
+
+DEFERRED = """
+import json, time
+started = time.perf_counter()
+import linebot.models, linebot.exceptions, bs4, requests
+print(json.dumps({"import_ms": (time.perf_counter() - started) * 1e3}), flush=True)
+"""
+
+SERVE = """
+from werkzeug.serving import make_server
+import app
+server = make_server("127.0.0.1", 0, app.app, threaded=True)
+print(server.server_port, flush=True)
+server.serve_forever()
+"""
+
+
+def _env(**extra):
+    return child_env(LOG_LEVEL="WARNING", APP_ROLE="single", LINE_CHANNEL_SECRET=SECRET, **extra)
+
+
+def _child(code, env):
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True,
+                         text=True, timeout=120, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def _signed(body):
+    digest = hmac.new(SECRET.encode(), body.encode(), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode()
+
+
+def _first_callback(standin, warmup):
+    body = json.dumps({"destination": "Ubench", "events": [{
+        "type": "message", "mode": "active", "timestamp": 0, "replyToken": "r0",
+        "source": {"type": "user", "userId": "Ustartup"},
+        "message": {"type": "text", "id": "1", "text": "ヘルプ"},
+    }]})
+    before = standin.count("/reply")
+    started = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-c", SERVE], cwd=ROOT, stdout=subprocess.PIPE, text=True,
+                            env=_env(LINE_API_ENDPOINT=standin.endpoint, WARMUP_DELAY=warmup))
+    try:
+        port = int(proc.stdout.readline())
+        ready = time.perf_counter() - started
+        req = urllib.request.Request(f"http://127.0.0.1:{port}/callback", data=body.encode(), headers={
+            "Content-Type": "application/json", "X-Line-Signature": _signed(body)})
+        with urllib.request.urlopen(req, timeout=30) as res:
+            assert res.status == 200
+        acked = time.perf_counter() - started
+        while standin.count("/reply") == before:
+            if time.perf_counter() - started > 30:
+                raise TimeoutError("返信が届かない")
+            time.sleep(0.001)
+        replied = time.perf_counter() - started
+    finally:
+        proc.kill()
+        proc.wait()
+    return ready, acked, replied
+
+
+def _median_ms(values):
+    return round(statistics.median(values) * 1e3, 1)
+
+
+def run(repeat: int = 5):
+    imports = [_child(IMPORT, _env()) for _ in range(repeat)]
+    deferred = [_child(DEFERRED, _env())["import_ms"] for _ in range(repeat)]
+    result = {
+        "bench": "startup",
+        "repeat": repeat,
+        "import": {
+            "import_ms": round(statistics.median(r["import_ms"] for r in imports), 1),
+            **{k: round(statistics.median(r["startup"].get(k, 0) for r in imports), 1)
+               for k in imports[0]["startup"]},
+        },
+        "deferred_import_ms": round(statistics.median(deferred), 1),
+    }
+    with LineStandin() as standin:
+        # 子プロセスを止めると keep-alive の接続が切れる（代役のエラー表示は出さない）
+        standin.server.handle_error = lambda request, address: None
+        for label, warmup in (("lazy", "-1"), ("warm_up", "0")):
+            runs = [_first_callback(standin, warmup) for _ in range(repeat)]
+            result[label] = {
+                "ready_ms": _median_ms(r[0] for r in runs),
+                "first_ack_ms": _median_ms(r[1] for r in runs),
+                "first_reply_ms": _median_ms(r[2] for r in runs),
+            }
+    return result
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:2]]
+    print(json.dumps(run(*args), ensure_ascii=False), flush=True)
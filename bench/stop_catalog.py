@@ -0,0 +1,55 @@
+"""停留所カタログの起動コスト: CSV からのコンパイル / コンパイル済みファイルの読み込み / 検索
+
+    python -m bench.stop_catalog [停留所数]
+"""
+
+import csv
+import json
+import os
+import sys
+import tempfile
+import time
+
+from stop_catalog import load_catalog
+
+
+def write_master(path: str, n: int):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["name", "code", "reading", "lat", "lon", "popular"])
+        for i in range(n):
+            w.writerow([f"停留所{i:05d}前", str(100000 + i), f"ていりゅうじょ{i}まえ",
+                        34.7 + i * 1e-5, 136.5 + i * 1e-5, i + 1 if i < 8 else ""])
+
+
+def run(n: int = 30000):
+    with tempfile.TemporaryDirectory() as d:
+        master = os.path.join(d, "stops.csv")
+        write_master(master, n)
+
+        started = time.perf_counter()
+        load_catalog(master)
+        compile_ms = (time.perf_counter() - started) * 1e3
+
+        started = time.perf_counter()
+        catalog = load_catalog(master)
+        load_ms = (time.perf_counter() - started) * 1e3
+
+        names = [f"停留所{i:05d}前" for i in range(0, n, max(1, n // 1000))]
+        started = time.perf_counter()
+        for name in names:
+            catalog.code_for(name)
+        lookup_us = (time.perf_counter() - started) / len(names) * 1e6
+
+        return {
+            "bench": "stop_catalog",
+            "stops": n,
+            "compiled_bytes": os.path.getsize(os.path.join(d, ".cache", "stops.csv.bin")),
+            "compile_ms": round(compile_ms, 1),
+            "warm_load_ms": round(load_ms, 3),
+            "code_for_us": round(lookup_us, 2),
+        }
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(int(sys.argv[1]) if len(sys.argv) > 1 else 30000), ensure_ascii=False))
@@ -0,0 +1,103 @@
+"""停留所検索のマイクロベンチマーク: 旧実装（線形走査 + difflib）と StopIndex の比較
+
+recall: 旧実装で部分一致した候補を StopIndex が落とさないか（合成した停留所一覧と data/stops.csv、
+1〜2 文字の入力を含む）。部分一致が max_results 件以下なら全部、多ければ max_results 件とも
+部分一致であること。落とした入力があれば失敗にする。
+
+    python -m bench.stop_search [停留所数]
+"""
+
+import csv
+import json
+import os
+import random
+import sys
+import time
+from difflib import get_close_matches
+
+from bench import ROOT
+from stop_index import StopIndex
+
+_HEADS = ["津", "久居", "松阪", "伊勢", "一身田", "白塚", "河芸", "高茶屋", "榊原", "香良洲",
+          "嬉野", "一志", "明和", "小俣", "乙部", "藤枝", "御殿場", "京口", "観音寺", "片田"]
+_MIDS = ["", "新町", "東", "西", "南", "北", "中央", "本町", "朝日", "緑が丘", "桜", "栄町"]
+_TAILS = ["", "駅前", "口", "団地", "小学校前", "病院前", "市役所前", "公民館", "車庫", "温泉口"]
+QUERIES = ["津駅", "ツエキ", "乙部", "いせし", "ｲｵﾝ", "松阪駅前", "京口立町", "藤枝東小学校",
+           "高茶屋小学校前バス停", "存在しない停留所"]
+SHORT_QUERIES = ["津", "宮", "中", "前", "東", "口", "駅前", "伊勢", "いせ", "中川", "団地", "病院"]
+
+
+def make_catalogue(n: int):
+    names = {f"{h}{m}{t}" for h in _HEADS for m in _MIDS for t in _TAILS}
+    names = sorted(names)
+    random.Random(0).shuffle(names)
+    return names[:n]
+
+
+def legacy_search(stops, input_text, max_results=5):
+    """変更前の BusVisionSession.search_similar_stops"""
+    if not input_text:
+        return []
+    if input_text in stops:
+        return [input_text]
+    partial = [s for s in stops if input_text in s or s in input_text]
+    if partial:
+        return partial[:max_results]
+    return get_close_matches(input_text, stops.keys(), n=max_results, cutoff=0.6)
+
+
+def check_recall(names, queries, max_results=8):
+    """旧実装の部分一致の候補を StopIndex が返すか。落とした入力 -> {missing, got}"""
+    index = StopIndex.from_names(names)
+    failures = {}
+    for q in queries:
+        partial = [q] if q in names else [s for s in names if q in s or s in q]
+        got = index.search(q, max_results)
+        if len(partial) <= max_results:
+            missing = [s for s in partial if s not in got]
+        else:
+            missing = [s for s in got if s not in partial] or ([] if len(got) == max_results else ["(件数)"])
+        if missing:
+            failures[q] = {"missing": missing, "got": got}
+    return {"queries": len(queries), "failures": failures}
+
+
+def _per_call_us(fn, queries, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for q in queries:
+            fn(q)
+    return (time.perf_counter() - started) / (repeat * len(queries)) * 1e6
+
+
+def run(n: int = 2000, repeat: int = 20):
+    names = make_catalogue(n)
+    stops = {name: str(i) for i, name in enumerate(names)}
+
+    started = time.perf_counter()
+    index = StopIndex.from_names(names)
+    build_ms = (time.perf_counter() - started) * 1e3
+
+    with open(os.path.join(ROOT, "data", "stops.csv"), encoding="utf-8") as f:
+        master = [row["name"] for row in csv.DictReader(f)]
+    queries = QUERIES + SHORT_QUERIES
+    recall = {
+        "catalogue": check_recall(names, queries),
+        "stops_csv": check_recall(master, queries + sorted({c for n in master for c in n})),
+    }
+    assert not any(r["failures"] for r in recall.values()), recall
+
+    return {
+        "bench": "stop_search",
+        "recall": recall,
+        "stops": len(names),
+        "index_build_ms": round(build_ms, 2),
+        "legacy_us_per_query": round(_per_call_us(lambda q: legacy_search(stops, q, 8), QUERIES, repeat), 1),
+        "index_us_per_query": round(_per_call_us(lambda q: index.search(q, 8), QUERIES, repeat), 1),
+        "legacy_us_per_short_query": round(_per_call_us(lambda q: legacy_search(stops, q, 8), SHORT_QUERIES, repeat), 1),
+        "index_us_per_short_query": round(_per_call_us(lambda q: index.search(q, 8), SHORT_QUERIES, repeat), 1),
+    }
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(int(sys.argv[1]) if len(sys.argv) > 1 else 2000), ensure_ascii=False))
@@ -0,0 +1,226 @@
+"""時刻表: 取得したページの解析、まとめて取得する時間、設定時の警告、ポーリングをどれだけ減らせるか
+
+- captured: bench/pages/timetable/ のページを解析した便の数と 1 ページあたりの時間
+- prefetch: Bus-Vision の代役が返す時刻表を routes 組まとめて取得・保存する時間、
+  同じ日の 2 回目（取得しない）、保存したファイルから読み戻す時間
+- setup: 取得したページ（timetable_weekday）に対し、設定時刻ごとに利用者へ返す一言。
+  まだ持っていない組では返信を待たせず（一言なし）、別スレッドで取得し終わるまでの時間
+- failures: 分の書き方が変わったページ（便が 1 つも読めない）は「便なし」として保存せず、
+  失敗するたびに待ち時間を倍にして取り直すこと
+- late_timetable: 時刻表がまだ無いうちに 08:17 で登録し、あとから 08:09 の便の時刻表が届いたとき、
+  08:09 の MONITOR_LEAD 前から監視できるか（開始ジョブは前の便にも間に合うよう早めに置く）
+- polling: 仮想時計（bench.simulate と同じ）で、headway 分おきに service 時台だけ走る路線を
+  users 人が 6〜23 時の一様な時刻で監視したときの、時刻表なし / ありのリクエスト数と通知できた人数
+  （arriving_users: バスが 1 つ前まで来たことを知らせられた人数）
+
+    python -m bench.timetable [組数] [利用者数]
+"""
+
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from bench import use_app_env
+from bench.busvision_standin import BusVisionStandin, corpus
+from bench.simulate import DAY, build_replay, scheduled
+
+
+def _captured(repeat=200):
+    from timetable import parse_timetable
+
+    out = {}
+    for name, html in corpus("timetable").items():
+        started = time.perf_counter()
+        for _ in range(repeat):
+            table = parse_timetable(html)
+        out[name] = {
+            "departures": {k: len(v) for k, v in table.items()},
+            "parse_us": round((time.perf_counter() - started) / repeat * 1e6, 1),
+        }
+    return out
+
+
+def _prefetch(app, busvision, routes, pages):
+    from timetable import TimetableCache
+
+    for i, route in enumerate(routes):
+        busvision.set_timetable(route, pages[i % len(pages)])
+    today = DAY.date()
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "timetables.db")
+        cache = TimetableCache(path, app.bus_session.fetch_timetable)
+        started = time.perf_counter()
+        fetched = cache.refresh(routes, today)
+        first = time.perf_counter() - started
+        started = time.perf_counter()
+        again = cache.refresh(routes, today)
+        second = time.perf_counter() - started
+        cache.close()
+        started = time.perf_counter()
+        loaded = len(TimetableCache(path, app.bus_session.fetch_timetable))
+        load = time.perf_counter() - started
+        size = sum(os.path.getsize(os.path.join(d, n)) for n in os.listdir(d))
+    return {
+        "routes": len(routes),
+        "fetched": fetched,
+        "refresh_s": round(first, 3),
+        "refresh_ms_per_route": round(first / max(1, fetched) * 1e3, 2),
+        "same_day_fetched": again,
+        "same_day_s": round(second, 4),
+        "reloaded": loaded,
+        "reload_ms": round(load * 1e3, 2),
+        "store_bytes": size,
+    }
+
+
+def _setup(app, busvision, page):
+    from clock import VirtualClock
+
+    a, b = list(app.STOP_CATALOG.stops())[:2]
+    busvision.set_timetable((a.code, b.code), page)
+
+    def note(hhmm):
+        return app.timetable_note({"boarding": a.name, "alighting": b.name,
+                                   "time": datetime.combine(DAY.date(), datetime.strptime(hhmm, "%H:%M").time())})
+
+    saved, app.clock = app.clock, VirtualClock(DAY + timedelta(hours=5))
+    try:
+        # 初めての組: 返信では取得しない（一言なし）。別スレッドの取得が終わるまでの時間も測る
+        started = time.perf_counter()
+        notes = {"uncached": note("08:00"), "uncached_reply_ms": round((time.perf_counter() - started) * 1e3, 2)}
+        while (a.code, b.code) not in app.timetable_cache:
+            if time.perf_counter() - started > 30:
+                raise TimeoutError("時刻表の取得が終わらない")
+            time.sleep(0.001)
+        notes["prefetched_ms"] = round((time.perf_counter() - started) * 1e3, 2)
+        for hhmm in ("08:06", "08:00", "10:40", "23:50"):
+            notes[hhmm] = note(hhmm)
+        # 08:12 に 08:14 を選んだ: 08:06 の便は監視時間が終わっているので 08:24 に合わせる
+        app.clock.set(DAY + timedelta(hours=8, minutes=12))
+        notes["08:14@08:12"] = note("08:14")
+    finally:
+        app.clock = saved
+    return notes
+
+
+def _failures(pages):
+    from timetable import TimetableCache, parse_timetable
+
+    broken = pages["timetable_weekday"].replace('class="minute"', 'class="min"')
+    now, served = [0.0], [broken]
+    cache = TimetableCache("memory", fetch=lambda *route: served[0], retry_base=60, clock=lambda: now[0])
+    route, today = ("01000", "09000"), DAY.date()
+    out = {"broken_parsed": parse_timetable(broken), "broken_stored": cache.fetch(route, today) is not None}
+    waits = [round(cache.retry_after())]
+    for _ in range(2):
+        now[0] += waits[-1]
+        cache.refresh([route], today)
+        waits.append(round(cache.retry_after()))
+    out["retry_waits_s"] = waits
+    out["refresh_while_waiting"] = cache.refresh([route], today)
+    served[0] = pages["timetable_weekday"]
+    now[0] += waits[-1]
+    out["recovered"] = cache.refresh([route], today) == 1 and route in cache and cache.retry_after() is None
+    assert out["broken_parsed"] is None and not out["broken_stored"], out
+    assert out["retry_waits_s"] == [60, 120, 240] and out["refresh_while_waiting"] == 0 and out["recovered"], out
+    return out
+
+
+def _late_timetable(app):
+    from simulation import Simulation
+    from timetable import TimetableCache
+
+    a, b = list(app.STOP_CATALOG.stops())[:2]
+    route, uid = (a.code, b.code), "Ulate"
+    saved, app.timetable_cache = app.timetable_cache, TimetableCache("memory", fetch=lambda *route: None)
+    try:
+        sim = Simulation(app, build_replay([route], [s.name for s in app.STOP_CATALOG.stops()]),
+                         start=DAY + timedelta(hours=7, minutes=30))
+        with sim:
+            dep = DAY + timedelta(hours=8, minutes=17)
+            app.user_settings[uid] = {"boarding": a.name, "alighting": b.name, "time": dep}
+            app.schedule_bus_check(uid, dep)
+            sim.run_until(DAY + timedelta(hours=7, minutes=40))
+            app.timetable_cache.put(route, {"weekday": [8 * 60 + 9]}, DAY.date())
+            started = None
+            while sim.clock.now() < DAY + timedelta(hours=8, minutes=9):
+                sim.run_until(sim.clock.now() + timedelta(minutes=1))
+                if started is None and uid in app.monitor_engine.watches:
+                    started = sim.clock.now()
+            w = app.monitor_engine.watches.get(uid)
+            out = {"watch_found_by": started.strftime("%H:%M") if started else None,
+                   "window": [w.departure_time.strftime("%H:%M"), w.end_time.strftime("%H:%M")] if w else None}
+            app.cancel_user_monitoring(uid)
+    finally:
+        app.timetable_cache = saved
+    assert out["window"] == ["08:09", "08:14"] and out["watch_found_by"] <= "08:03", out
+    return out
+
+
+def _polling(app, users, routes, headway=30, first=6 * 60, last=21 * 60):
+    from simulation import Simulation
+    from timetable import TimetableCache
+
+    rng = random.Random(0)
+    stops = list(app.STOP_CATALOG.stops())
+    pairs = [(a.code, b.code, a.name, b.name) for a in stops for b in stops if a.code != b.code][:routes]
+    names = [s.name for s in stops]
+    plan = [(f"U{i:06d}", pairs[i % len(pairs)], DAY + timedelta(minutes=rng.randrange(6 * 60, 23 * 60)))
+            for i in range(users)]
+
+    timetables = TimetableCache("memory", fetch=lambda *route: None)
+    for a, b, _, _ in pairs:
+        timetables.put((a, b), {"weekday": scheduled((a, b), headway, first, last)}, DAY.date())
+
+    out = {}
+    saved = app.timetable_cache
+    try:
+        for label, cache in (("without", TimetableCache("memory", fetch=lambda *route: None)), ("with", timetables)):
+            app.timetable_cache = cache
+            replay = build_replay([(a, b) for a, b, _, _ in pairs], names, headway, first, last)
+            sim = Simulation(app, replay, start=DAY + timedelta(hours=5))
+            with sim:
+                for uid, (a, b, name_a, name_b), dep in plan:
+                    app.user_settings[uid] = {"boarding": name_a, "alighting": name_b, "time": dep}
+                    app.schedule_bus_check(uid, dep)
+                sim.run_until(DAY + timedelta(hours=24))
+            sent = sim.delivery.sent
+            out[label] = {
+                "upstream_requests": replay.requests,
+                "notified_users": len({uid for _, uid, text in sent if text.startswith("🚌")}),
+                # 乗る便が 1 つ前まで来たことを知らせられた人数
+                "arriving_users": len({uid for _, uid, text in sent if text.startswith("🚌") and "（1つ前" in text}),
+                "skipped_users": sum(1 for _, _, text in sent if text.startswith("🚫")),
+            }
+    finally:
+        app.timetable_cache = saved
+    out["requests_saved"] = round(1 - out["with"]["upstream_requests"] / max(1, out["without"]["upstream_requests"]), 3)
+    return out
+
+
+def run(routes: int = 200, users: int = 3000):
+    with BusVisionStandin() as busvision:
+        use_app_env(BUSVISION_BASE_URL=busvision.base_url)
+        import app
+
+        pages = list(corpus("timetable").values())
+        route_list = [(f"{1000 + i:05d}", f"{9000 + i:05d}") for i in range(routes)]
+        return {
+            "bench": "timetable",
+            "captured": _captured(),
+            "prefetch": _prefetch(app, busvision, route_list, pages),
+            "setup": _setup(app, busvision, corpus("timetable")["timetable_weekday"]),
+            "failures": _failures(corpus("timetable")),
+            "late_timetable": _late_timetable(app),
+            "polling": _polling(app, users, min(routes, 100)),
+        }
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    print(json.dumps(run(*args), ensure_ascii=False, indent=1), flush=True)
+    os._exit(0)
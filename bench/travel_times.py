@@ -0,0 +1,111 @@
+"""通過記録: 1 か月分を書いたときのファイルの大きさ・書き込み時間と、集計（aggregate）にかかる時間
+
+routes 路線に 6〜23 時の間 headway 分おきにバスを走らせ、1 台ごとに 6 つ前の停留所で現れてから
+乗車停留所に着くまでのイベント（現れた / 通過 5 回 / 着いた）を ObservationLog.record に渡す。
+1 区間は通常 2 分、朝夕のピーク（7〜8 時台・17〜18 時台）は 3 分。着いたことは 10 秒後のポーリングで分かる。
+
+- write: record の呼び出しからファイルに書き終わるまでの時間と、1 路線 1 日あたりの大きさ
+- aggregate: days 日分を読んで EtaTable を作る時間、lookup 1 回の時間
+- error: 表の到着までの秒数と、上の前提から計算した正解との差
+
+    python -m bench.travel_times [路線数] [日数]
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from snapshots import ApproachRecord, BusAppeared, BusDeparted, BusPassedStop
+
+START = datetime(2024, 4, 1)
+STOPS = 6
+POLL_DELAY = 10
+
+
+def _segment(hour):
+    return 3 if hour in (7, 8, 17, 18) else 2
+
+
+def _hhmm(minute):
+    return f"{minute // 60 % 24:02d}:{minute % 60:02d}"
+
+
+def _bus_events(names, arrive):
+    """arrive（0 時からの分）に着くバスの (観測した分 + 秒, イベント) のリスト"""
+    seg = _segment((arrive - STOPS * 2) // 60)
+    passes = [(arrive - k * seg, k) for k in range(STOPS, 0, -1)]
+    recs = [ApproachRecord(1, _hhmm(t), names[k], f"{k}つ前") for t, k in passes]
+    out = [(passes[0][0], BusAppeared(recs[0]))]
+    out += [(t, BusPassedStop(recs[i], recs[i + 1])) for i, (t, _) in enumerate(passes[1:])]
+    out.append((arrive, BusDeparted(recs[-1])))
+    return out
+
+
+def run(routes: int = 100, days: int = 30, headway: int = 10):
+    from travel_times import EtaTable, ObservationLog, aggregate
+
+    route_names = [(f"{1000 + r:05d}", f"{9000 + r:05d}") for r in range(routes)]
+    names = [f"停留所{k}" for k in range(STOPS + 1)]
+    with tempfile.TemporaryDirectory() as d:
+        obs = ObservationLog(d)
+        records = 0
+        started = time.perf_counter()
+        for day in range(days):
+            midnight = START + timedelta(days=day)
+            for route in route_names:
+                for arrive in range(6 * 60 + headway, 23 * 60, headway):
+                    for minute, ev in _bus_events(names, arrive):
+                        obs.record(route, [ev], midnight + timedelta(minutes=minute, seconds=POLL_DELAY))
+                        records += 1
+        queued = time.perf_counter() - started
+        obs.close()
+        write = time.perf_counter() - started
+        size = sum(os.path.getsize(os.path.join(d, n)) for n in os.listdir(d))
+
+        started = time.perf_counter()
+        table = aggregate(d, (START + timedelta(days=days)).date(), days)
+        agg = time.perf_counter() - started
+        path = os.path.join(d, "eta.json")
+        table.save(path)
+        started = time.perf_counter()
+        EtaTable.load(path)
+        load = time.perf_counter() - started
+
+        key = route_names[0]
+        when = START + timedelta(hours=8, minutes=3)
+        n = 100000
+        started = time.perf_counter()
+        for _ in range(n):
+            table.lookup(key, names[3], when)
+        lookup = (time.perf_counter() - started) / n
+
+        errors = []
+        for (route, stop, kind, hour), seconds in table.eta.items():
+            k = names.index(stop)
+            errors.append(abs(seconds - (k * _segment(hour) * 60 + POLL_DELAY)))
+
+    return {
+        "bench": "travel_times",
+        "routes": routes,
+        "days": days,
+        "records": records,
+        "record_us": round(queued / records * 1e6, 2),
+        "write_s": round(write, 2),
+        "log_bytes": size,
+        "bytes_per_record": round(size / records, 1),
+        "bytes_per_route_day": round(size / routes / days),
+        "aggregate_s": round(agg, 2),
+        "eta_entries": len(table),
+        "eta_table_load_ms": round(load * 1e3, 1),
+        "lookup_ns": round(lookup * 1e9),
+        "error_s_mean": round(sum(errors) / len(errors), 1) if errors else None,
+        "error_s_max": max(errors) if errors else None,
+    }
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    print(json.dumps(run(*args), ensure_ascii=False), flush=True)
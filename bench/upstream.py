@@ -0,0 +1,125 @@
+"""Bus-Vision への予算とサーキットブレーカー: 混雑時に乗車時刻が近い監視が優先されるか、障害時に何回送るか
+
+MonitorEngine に UpstreamGate を付け、取得は Bus-Vision の代わりの関数（遅延 latency 秒）にする。
+
+- pressure: 路線数 × 1 / interval 回/秒のポーリングを、その半分の予算で回す。乗車時刻まで
+  2 分の路線と 20 分の路線が半々のとき、それぞれ何回取得できたか
+- outage: 途中で outage 秒だけ全リクエストを失敗させ、その間に送ったリクエスト数、
+  「取得できません」を受け取った利用者数（1 人 1 回ならば users と同じ）、復旧後に再開するまでの秒数
+
+    python -m bench.upstream [路線数] [秒数]
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from monitor import MonitorEngine
+from upstream import CircuitBreaker, UpstreamGate
+
+PAGE = ('<div class="approachData"><span id="number">1</span>'
+        '<div id="approachInfo">08:10に津駅前を通過</div><span id="passInfo">2つ前を通過</span></div>')
+
+
+class FakeBusVision:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.down = False
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.times = []   # (time, ok)
+
+    def fetch(self, from_code, to_code):
+        time.sleep(self.latency)
+        with self.lock:
+            self.calls[(from_code, to_code)] += 1
+            self.times.append((time.monotonic(), not self.down))
+        return None if self.down else PAGE
+
+
+def _engine(bv, gate, told):
+    return MonitorEngine(fetch=bv.fetch, parse=lambda html: () if html else None,
+                         deliver=lambda uid, snap: None, on_finish=lambda uid: None,
+                         interval=1, workers=8, gate=gate,
+                         on_unavailable=lambda uid: told.append(uid))
+
+
+def run_pressure(routes, seconds, interval=1.0, latency=0.005):
+    bv = FakeBusVision(latency)
+    gate = UpstreamGate(rate=routes / interval / 2, burst=1, max_wait=0.5, shed_after=300)
+    engine = _engine(bv, gate, [])
+    engine.interval = timedelta(seconds=interval)
+    now = datetime.now()
+    soon, later = set(), set()
+    for i in range(routes):
+        route = (str(1000 + i), str(9000 + i))
+        near = i % 2 == 0
+        (soon if near else later).add(route)
+        dep = now + timedelta(minutes=2 if near else 20)
+        engine.watch(f"U{i}", route, dep, dep + timedelta(minutes=5), now=now)
+    time.sleep(seconds)
+    stats = gate.stats()
+    return {
+        "demand_per_s": round(routes / interval, 1),
+        "budget_per_s": round(routes / interval / 2, 1),
+        "polls_near_per_s": round(sum(bv.calls[r] for r in soon) / seconds, 1),
+        "polls_far_per_s": round(sum(bv.calls[r] for r in later) / seconds, 1),
+        "throttled": stats["throttled"],
+        "shed": stats["shed"],
+    }
+
+
+def run_outage(routes, seconds, outage=None, latency=0.005):
+    outage = outage or seconds / 2
+    bv = FakeBusVision(latency)
+    told = []
+    gate = UpstreamGate(rate=1000, max_wait=0.5,
+                        breaker=CircuitBreaker(failures=5, slow=1.0, reset_timeout=1.0))
+    engine = _engine(bv, gate, told)
+    engine.interval = timedelta(seconds=0.5)
+    now = datetime.now()
+    for i in range(routes):
+        engine.watch(f"U{i}", (str(1000 + i), str(9000 + i)), now + timedelta(minutes=3),
+                     now + timedelta(minutes=8), now=now)
+
+    time.sleep(seconds / 4)
+    down_at = time.monotonic()
+    bv.down = True
+    time.sleep(outage)
+    up_at = time.monotonic()
+    bv.down = False
+    time.sleep(seconds / 4)
+
+    with bv.lock:
+        during = sum(1 for t, _ in bv.times if down_at <= t < up_at)
+        resumed = next((t - up_at for t, ok in bv.times if t >= up_at and ok), None)
+    return {
+        "outage_s": outage,
+        "requests_during_outage": during,
+        "without_breaker_estimate": int(routes * outage / 0.5),
+        "users": routes,
+        "told_unavailable": len(told),
+        "told_distinct": len(set(told)),
+        "resumed_after_s": round(resumed, 3) if resumed is not None else None,
+        "breaker_trips": gate.stats()["breaker_trips"],
+    }
+
+
+def run(routes: int = 200, seconds: float = 6.0):
+    return {
+        "bench": "upstream",
+        "routes": routes,
+        "pressure": run_pressure(routes, seconds),
+        "outage": run_outage(routes, seconds),
+    }
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:3]
+    print(json.dumps(run(*(int(a) for a in args[:1]), *(float(a) for a in args[1:])), ensure_ascii=False), flush=True)
+    # 監視エンジンのスレッドが終了処理中のプールに投げてエラーを出さないように
+    os._exit(0)
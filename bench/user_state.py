@@ -0,0 +1,188 @@
+"""利用者の状態の排他: 1 人に集中したとき・大勢を並行して書き換えたときに状態が壊れないか、どれだけ待つか
+
+- table: StateTable.modify で 1 キーに threads 本から ops 回ずつ足し込み、失われた更新が無いか
+  （ロックせずに読んで書いた場合の失われた数も出す）。大勢（users キー）では、ロックの中で
+  hold_ms 待つ（返信の送信などを模す）ときの処理数/秒を、ストライプ（既定）と 1 本のロックで比べる
+- app: Webhook の処理（設定開始 → 乗車 → 降車 → 時刻）と、スケジューラ・監視エンジンから呼ばれる
+  監視の開始・終了・キャンセルを、1 人に集中 / users 人に分散して threads 本で同時に呼ぶ。
+  例外の数と、終わったあとの状態の食い違い（監視予定の路線が欠けている など）を数える。
+  LINE の代役は reply_ms 遅れて返すので、監視側の呼び出しの時間でロックを返信の間持っていないかが分かる
+- repeat_confirm: 08:02 に 08:00 の時刻を選んで「毎日」を確定したとき、今日の（もう出た）便ではなく
+  翌日の便から監視すること（時刻を選んだときと同じ決め方）
+
+    python -m bench.user_state [スレッド数] [利用者数]
+"""
+
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+from bench import use_app_env
+from bench.busvision_standin import BusVisionStandin
+from bench.line_standin import LineStandin
+
+
+def _hammer(threads, fn, *args):
+    """threads 本で fn(i, *args) を同時に始めて、全部終わるまでの秒数"""
+    start = threading.Barrier(threads + 1)
+
+    def body(i):
+        start.wait()
+        fn(i, *args)
+
+    workers = [threading.Thread(target=body, args=(i,)) for i in range(threads)]
+    for w in workers:
+        w.start()
+    start.wait()
+    started = time.perf_counter()
+    for w in workers:
+        w.join()
+    return time.perf_counter() - started
+
+
+def _table(threads, users, ops=2000, hold_ms=1.0):
+    from state_store import MemoryStore
+
+    out = {}
+    switch = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)   # 読んでから書くまでの間にスレッドが切り替わりやすくする
+    try:
+        t = MemoryStore(flush_interval=60).table("bench")
+        _hammer(threads, lambda i: [t.modify("U0", lambda v: {"n": (v or {"n": 0})["n"] + 1})
+                                    for _ in range(ops)])
+        out["one_user_lost"] = threads * ops - t["U0"]["n"]
+
+        def unlocked(i):
+            for _ in range(ops):
+                n = dict.get(t, "U1", {"n": 0})["n"]
+                t["U1"] = {"n": n + 1}
+        _hammer(threads, unlocked)
+        out["one_user_lost_unlocked"] = threads * ops - t["U1"]["n"]
+    finally:
+        sys.setswitchinterval(switch)
+
+    rounds = max(1, users // threads)
+    for label, stripes in (("striped", 256), ("global", 1)):
+        t = MemoryStore(flush_interval=60, lock_stripes=stripes).table("bench")
+
+        def hold(v):
+            time.sleep(hold_ms / 1e3)
+            return {"n": (v or {"n": 0})["n"] + 1}
+
+        seconds = _hammer(threads, lambda i: [t.modify(f"U{i}-{k}", hold) for k in range(rounds)])
+        out[f"many_users_{label}_ops_per_s"] = round(threads * rounds / seconds)
+    out["hold_ms"] = hold_ms
+    return out
+
+
+def _sender(app):
+    n = [0]
+
+    def send(uid, text):
+        n[0] += 1
+        app.handle_message(app.handler.to_event({
+            "type": "message", "mode": "active", "timestamp": 0, "replyToken": f"r{n[0]}",
+            "source": {"type": "user", "userId": uid},
+            "message": {"type": "text", "id": str(n[0]), "text": text},
+        }))
+    return send
+
+
+def _repeat_confirm():
+    import app
+    from simulation import Replay, Simulation
+
+    send, uid = _sender(app), "Urepeat"
+    a, b = [s.name for s in app.STOP_CATALOG.stops()][:2]
+    now = datetime.combine(date.today(), datetime.strptime("08:02", "%H:%M").time())
+    with Simulation(app, Replay(empty=""), start=now):
+        for text in ("設定開始", f"boarding:{a}", f"alighting:{b}", "time:08:00", "repeat:daily"):
+            send(uid, text)
+        dep = app.user_active_jobs[uid]["departure_time"]
+        app.cancel_user_monitoring(uid)
+    out = {"now": now.strftime("%m-%d %H:%M"), "repeat_departure": dep.strftime("%m-%d %H:%M")}
+    assert dep == now.replace(minute=0) + timedelta(days=1), out
+    return out
+
+
+def _app(threads, users, rounds=30):
+    import app
+
+    stops = [s.name for s in app.STOP_CATALOG.stops()][:8]
+    errors = Counter()
+    waits = []   # 監視側の呼び出し 1 回の秒数（返信の間ロックを持っていると reply_ms だけ待つ）
+    send = _sender(app)
+
+    def webhook(uid, rng):
+        a, b = rng.sample(stops, 2)
+        for text in ("設定開始", f"boarding:{a}", f"alighting:{b}", f"time:{rng.choice(app.PRESET_TIMES)}"):
+            send(uid, text)
+        if rng.random() < 0.3:
+            send(uid, rng.choice(("キャンセル", "repeat:daily", f"alighting:{a}")))
+
+    def monitor(uid, rng):
+        # スケジューラ・監視エンジンのスレッドから来る呼び出し（どのジョブ・監視の分かは分からない）
+        info = app.user_active_jobs.get(uid)
+        kind = rng.random()
+        started = time.perf_counter()
+        if kind < 0.4 and info:
+            app.check_bus_location_loop(uid, info["departure_time"])
+        elif kind < 0.8:
+            app.finish_bus_check(uid)
+        else:
+            app.cancel_user_monitoring(uid)
+        waits.append(time.perf_counter() - started)
+
+    def worker(i, pick):
+        rng = random.Random(i)
+        for _ in range(rounds):
+            uid = pick(rng)
+            try:
+                (webhook if i % 2 == 0 else monitor)(uid, rng)
+            except Exception as e:
+                errors[type(e).__name__] += 1
+
+    def broken():
+        # 監視予定の路線・乗車時刻が欠けている / 監視エンジンに残っているのに監視予定が無い
+        bad = sum(1 for uid, info in list(app.user_active_jobs.items())
+                  if not all(info["route"]) or info["departure_time"] is None)
+        bad += sum(1 for uid in list(app.monitor_engine.watches) if uid not in app.user_active_jobs)
+        return bad
+
+    out = {}
+    for label, pick in (("one_user", lambda rng: "Uhot"),
+                        ("many_users", lambda rng: f"U{rng.randrange(users):05d}")):
+        errors.clear()
+        waits.clear()
+        seconds = _hammer(threads, worker, pick)
+        waits.sort()
+        out[label] = {"calls": threads * rounds, "seconds": round(seconds, 2),
+                      "errors": dict(errors), "inconsistent": broken(),
+                      "monitor_call_ms_p50": round(waits[len(waits) // 2] * 1e3, 2),
+                      "monitor_call_ms_max": round(waits[-1] * 1e3, 2)}
+    return out
+
+
+def run(threads: int = 16, users: int = 2000, reply_ms: float = 50.0):
+    with LineStandin(latency=reply_ms / 1e3) as standin, BusVisionStandin() as busvision:
+        use_app_env(LINE_API_ENDPOINT=standin.endpoint, BUSVISION_BASE_URL=busvision.base_url, WARMUP_DELAY=-1)
+        return {
+            "bench": "user_state",
+            "threads": threads,
+            "users": users,
+            "reply_ms": reply_ms,
+            "table": _table(threads, users),
+            "app": _app(threads, users),
+            "repeat_confirm": _repeat_confirm(),
+        }
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    print(json.dumps(run(*args), ensure_ascii=False), flush=True)
+    os._exit(0)
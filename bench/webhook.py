@@ -0,0 +1,174 @@
+"""Webhook の負荷試験: インライン処理（従来）とキュー処理の応答時間・処理時間の比較
+
+LINE の reply API はローカルの代役に向ける。各利用者は 設定開始 → 乗車 → 降車 の順に送り、
+最後に全員の user_status が awaiting_time になっていれば順序が守られている。
+event_types: EVENT_TYPES のすべての type を、linebot の WebhookParser と同じクラスに変換できるか
+（違えば失敗にする）。
+backpressure: 処理が止まってキュー（max_queue 件）が一杯のとき、/callback が待たずに 503 を返し
+（LINE が再送する）、受け付けた分だけが処理されること。
+
+    python -m bench.webhook [利用者数] [reply API の遅延(ms)]
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import sys
+import threading
+import time
+
+from bench import use_app_env
+from bench.line_standin import LineStandin
+
+SECRET = "bench-secret"
+STEPS = ["設定開始", "boarding:津駅前", "alighting:乙部朝日"]
+
+
+def _body(user_id, text, n):
+    return json.dumps({
+        "destination": "Ubench",
+        "events": [{
+            "type": "message", "mode": "active", "timestamp": 0,
+            "replyToken": f"r{n}", "source": {"type": "user", "userId": user_id},
+            "message": {"type": "text", "id": str(n), "text": text},
+        }],
+    }, ensure_ascii=False)
+
+
+def _sign(body):
+    return base64.b64encode(hmac.new(SECRET.encode(), body.encode(), hashlib.sha256).digest()).decode()
+
+
+def _post_all(client, users):
+    acks = []
+    n = 0
+    for step in STEPS:
+        for i in range(users):
+            n += 1
+            body = _body(f"U{i:05d}", step, n)
+            started = time.perf_counter()
+            r = client.post("/callback", data=body.encode(), headers={"X-Line-Signature": _sign(body)})
+            acks.append(time.perf_counter() - started)
+            assert r.status_code == 200, r.status_code
+    return acks
+
+
+# type ごとの最小限の中身（WebhookParser が読むフィールド）
+EVENT_FIELDS = {
+    "message": {"replyToken": "r", "message": {"type": "text", "id": "1", "text": "ヘルプ"}},
+    "follow": {"replyToken": "r"},
+    "join": {"replyToken": "r"},
+    "postback": {"replyToken": "r", "postback": {"data": "d"}},
+    "beacon": {"replyToken": "r", "beacon": {"hwid": "h", "type": "enter"}},
+    "accountLink": {"replyToken": "r", "link": {"result": "ok", "nonce": "n"}},
+    "memberJoined": {"replyToken": "r", "joined": {"members": [{"type": "user", "userId": "U1"}]}},
+    "memberLeft": {"left": {"members": [{"type": "user", "userId": "U1"}]}},
+    "things": {"replyToken": "r", "things": {"deviceId": "d", "type": "link"}},
+    "unsend": {"unsend": {"messageId": "1"}},
+    "videoPlayComplete": {"replyToken": "r", "videoPlayComplete": {"trackingId": "t"}},
+}
+
+
+def check_event_types(handler):
+    """type -> (QueuedWebhookHandler.to_event のクラス名, WebhookParser のクラス名)。食い違いがあれば失敗"""
+    from event_queue import EVENT_TYPES
+    from linebot import WebhookParser
+
+    events = [{"type": t, "mode": "active", "timestamp": 0, "source": {"type": "user", "userId": "U0"},
+               **EVENT_FIELDS.get(t, {})} for t in EVENT_TYPES]
+    body = json.dumps({"destination": "Ubench", "events": events})
+    expected = [type(e).__name__ for e in WebhookParser(SECRET).parse(body, _sign(body))]
+    got = {e["type"]: (type(handler.to_event(e)).__name__, want) for e, want in zip(events, expected)}
+    assert all(a == b for a, b in got.values()), got
+    return {t: a for t, (a, _) in got.items()}
+
+
+def check_backpressure(app, max_queue=5, posts=20):
+    from event_queue import QueuedWebhookHandler
+
+    gate = threading.Event()
+    handled = []
+    handler = QueuedWebhookHandler(SECRET, workers=1, max_queue=max_queue)
+    handler.default()(lambda event: (gate.wait(), handled.append(event)))
+    saved, app.handler = app.handler, handler
+    client = app.app.test_client()
+    try:
+        statuses, slowest = [], 0.0
+        for n in range(posts):
+            body = _body("Ufull", f"ヘルプ{n}", n)
+            started = time.perf_counter()
+            statuses.append(client.post("/callback", data=body, headers={"X-Line-Signature": _sign(body)}).status_code)
+            slowest = max(slowest, time.perf_counter() - started)
+            while n == 0 and handler.dispatcher.depth():
+                time.sleep(0.001)   # 最初の 1 件をワーカーが取り出して止まるまで
+        gate.set()
+        handler.dispatcher.join()
+    finally:
+        app.handler = saved
+    out = {
+        "accepted": statuses.count(200),
+        "rejected_503": statuses.count(503),
+        "ack_ms_max": round(slowest * 1e3, 2),
+        "handled": len(handled),
+        "dropped": handler.dispatcher.dropped,
+    }
+    # 1 件はワーカーが取り出して止まっているので、受け付けるのは max_queue + 1 件
+    assert out["accepted"] == out["handled"] == max_queue + 1 and out["rejected_503"] == posts - max_queue - 1, out
+    assert out["ack_ms_max"] < 500, out
+    return out
+
+
+def _summary(acks):
+    acks = sorted(acks)
+    return {
+        "ack_ms_p50": round(acks[len(acks) // 2] * 1e3, 2),
+        "ack_ms_p95": round(acks[int(len(acks) * 0.95)] * 1e3, 2),
+    }
+
+
+def run(users: int = 200, reply_latency_ms: float = 20.0):
+    with LineStandin(latency=reply_latency_ms / 1e3) as standin:
+        use_app_env(LINE_CHANNEL_SECRET=SECRET, LINE_API_ENDPOINT=standin.endpoint)
+        import app
+        client = app.app.test_client()
+        result = {"bench": "webhook", "users": users, "events": users * len(STEPS),
+                  "reply_latency_ms": reply_latency_ms, "event_types": check_event_types(app.handler)}
+
+        # 従来どおりリクエストの中で処理する
+        def inline(body, sig):
+            app.handler.validate(body, sig)
+            for event in json.loads(body)["events"]:
+                app.handler.dispatch(event)
+
+        app.handler.handle = inline
+        started = time.perf_counter()
+        acks = _post_all(client, users)
+        result["inline"] = {**_summary(acks), "total_s": round(time.perf_counter() - started, 3)}
+
+        app.user_status.clear()
+        app.user_settings.clear()
+        del app.handler.handle
+        started = time.perf_counter()
+        acks = _post_all(client, users)
+        ack_s = time.perf_counter() - started
+        app.handler.dispatcher.join()
+        result["queued"] = {
+            **_summary(acks),
+            "ack_total_s": round(ack_s, 3),
+            "total_s": round(time.perf_counter() - started, 3),
+            **app.handler.dispatcher.stats(),
+        }
+        result["ordered"] = all(
+            app.user_status.get(f"U{i:05d}", {}).get("state") == "awaiting_time" for i in range(users)
+        )
+        result["replies"] = standin.count("/reply")
+        result["backpressure"] = check_backpressure(app)
+    return result
+
+
+if __name__ == "__main__":
+    args = [float(a) for a in sys.argv[1:3]]
+    if args:
+        args[0] = int(args[0])
+    print(json.dumps(run(*args), ensure_ascii=False))
@@ -0,0 +1,36 @@
+"""時計（監視とスケジューラが参照する「現在時刻」を差し替えられるようにする）
+
+通常は SYSTEM_CLOCK（datetime.now）。シミュレーション（simulation.py）では VirtualClock を渡し、
+JobScheduler / MonitorEngine をスレッドなし（threaded=False）で動かして時刻を飛ばす。
+"""
+
+import threading
+from datetime import datetime, timedelta
+
+
+class SystemClock:
+    def now(self) -> datetime:
+        return datetime.now()
+
+
+class VirtualClock:
+    """set() / advance() したときだけ進む時計"""
+
+    def __init__(self, start: datetime):
+        self._now = start
+        self._lock = threading.Lock()
+
+    def now(self) -> datetime:
+        return self._now
+
+    def set(self, when: datetime):
+        with self._lock:
+            if when < self._now:
+                raise ValueError(f"時計は戻せません: {when} < {self._now}")
+            self._now = when
+
+    def advance(self, delta: timedelta):
+        self.set(self._now + delta)
+
+
+SYSTEM_CLOCK = SystemClock()
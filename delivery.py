@@ -0,0 +1,230 @@
+"""LINE への送信キュー（まとめて multicast・レート制限・リトライ）"""
+
+import copy
+import json
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from lazy import LazyModule
+from logs import get_logger
+from ratelimit import TokenBucket
+
+log = get_logger("delivery")
+line_exceptions = LazyModule("linebot.exceptions")
+
+
+def _message_key(messages):
+    return json.dumps([m.as_json_dict() for m in messages], sort_keys=True, ensure_ascii=False)
+
+
+class DeliveryQueue:
+    """push はキューに積むだけで戻る。送信は専用スレッドとワーカープールで行う
+
+    - window 秒の間に積まれた同じ内容のメッセージは multicast 1 回（最大 500 人）にまとめる
+    - リクエスト数はトークンバケットで rate 回/秒に抑える
+    - 429 / 5xx / 通信エラーは Retry-After かジッター付きバックオフでリトライ
+      （X-Line-Retry-Key を付けるので二重送信にならない）
+    - 同じ利用者宛てのメッセージは積まれた順に届く（1 つの window に 1 通まで。送信中の利用者の
+      次のメッセージは、その送信が終わるまで待たせる。ほかの利用者は待たない）
+    """
+
+    MULTICAST_MAX = 500
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+
+    def __init__(self, line_bot_api, workers: int = 4, window: float = 0.2, rate: float = 100.0,
+                 max_retries: int = 3, max_pending: int = 100000):
+        self.line_bot_api = line_bot_api
+        self.window = window
+        self.max_retries = max_retries
+        self.max_pending = max_pending
+        self.bucket = TokenBucket(rate)
+
+        self._pending = {}          # key -> (messages, [user_id, ...])  次に送る window
+        self._pending_users = set()
+        self._overflow = deque()    # 同じ window に入れられなかった (user_id, key, messages)
+        self._overflow_users = {}   # user_id -> overflow に残っている件数
+        self._busy = set()          # 送信中（リトライ待ちを含む）の利用者
+        self._size = 0
+        self._inflight = 0
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="delivery")
+        self._thread = None
+        self._stats_lock = threading.Lock()
+
+        self.stats = {
+            "enqueued": 0, "delivered": 0, "requests": 0, "multicast_requests": 0,
+            "retries": 0, "failed": 0, "dropped": 0,
+        }
+
+    # ------------------------------------------------------------
+    #  キュー
+    # ------------------------------------------------------------
+
+    def push(self, user_id, messages):
+        """送信を予約する（ブロックしない）。キューが溢れていれば False"""
+        if not isinstance(messages, (list, tuple)):
+            messages = [messages]
+        key = _message_key(messages)
+
+        with self._cond:
+            if self._size >= self.max_pending:
+                self._count("dropped")
+                log.warning("delivery.dropped", user=user_id)
+                return False
+            self._size += 1
+            self._count("enqueued")
+            if user_id in self._pending_users or user_id in self._overflow_users or user_id in self._busy:
+                self._overflow.append((user_id, key, messages))
+                self._overflow_users[user_id] = self._overflow_users.get(user_id, 0) + 1
+            else:
+                self._add(user_id, key, messages)
+            self._cond.notify()
+        self.start()
+        return True
+
+    def _add(self, user_id, key, messages):
+        self._pending.setdefault(key, (messages, []))[1].append(user_id)
+        self._pending_users.add(user_id)
+
+    def _take_window(self):
+        """今の window を取り出し（宛先は送信中にする）、溢れていた分を次の window に詰め直す"""
+        window = self._pending
+        self._busy |= self._pending_users
+        self._pending, self._pending_users = {}, set()
+        self._refill()
+        return window
+
+    def _refill(self):
+        """overflow から、次の window にも送信中にも入っていない利用者の分を（順に）移す"""
+        rest = deque()
+        while self._overflow:
+            user_id, key, messages = self._overflow.popleft()
+            if user_id in self._pending_users or user_id in self._busy:
+                rest.append((user_id, key, messages))
+                continue
+            self._add(user_id, key, messages)
+            left = self._overflow_users.pop(user_id) - 1
+            if left:
+                self._overflow_users[user_id] = left
+        self._overflow = rest
+
+    def depth(self):
+        return self._size
+
+    def _count(self, name, n=1):
+        with self._stats_lock:
+            self.stats[name] += n
+
+    def flush(self, timeout: float = None):
+        """キューが空になり送信中のものがなくなるまで待つ"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._size or self._inflight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    # ------------------------------------------------------------
+    #  送信
+    # ------------------------------------------------------------
+
+    def start(self):
+        with self._cond:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="delivery", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+            # 同じ内容のメッセージが揃うまで少しだけ待つ
+            time.sleep(self.window)
+
+            with self._cond:
+                window = self._take_window()
+                jobs = [
+                    (messages, users[i:i + self.MULTICAST_MAX])
+                    for messages, users in window.values()
+                    for i in range(0, len(users), self.MULTICAST_MAX)
+                ]
+                sent = sum(len(to) for _, to in jobs)
+                self._inflight += sent
+                self._size -= sent
+
+            # 送り終わるのは待たない（リトライ待ちの利用者がほかの利用者の通知を止めないように）
+            for messages, to in jobs:
+                self._pool.submit(self._deliver, messages, to)
+
+    def _deliver(self, messages, to):
+        try:
+            self._send(messages, to)
+        finally:
+            with self._cond:
+                self._inflight -= len(to)
+                self._busy.difference_update(to)
+                # 送信中で待たせていた次のメッセージを次の window に入れる
+                if any(u in self._overflow_users for u in to):
+                    self._refill()
+                self._cond.notify_all()
+
+    @property
+    def api(self):
+        """ワーカーごとの LineBotApi（X-Line-Retry-Key をヘッダに書き込むため共有しない）"""
+        api = getattr(self._local, "api", None)
+        if api is None:
+            api = copy.copy(self.line_bot_api)
+            api.headers = dict(self.line_bot_api.headers)
+            self._local.api = api
+        return api
+
+    def _send(self, messages, to):
+        api = self.api
+        retry_key = str(uuid.uuid4())
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            retry_after = None
+            try:
+                if len(to) == 1:
+                    api.push_message(to[0], messages, retry_key=retry_key)
+                else:
+                    api.multicast(to, messages, retry_key=retry_key)
+                    self._count("multicast_requests")
+                self._count("requests")
+                self._count("delivered", len(to))
+                return
+            except line_exceptions.LineBotApiError as e:
+                if e.status_code == 409:
+                    # 同じ Retry-Key のリクエストは受付済み
+                    self._count("delivered", len(to))
+                    return
+                if e.status_code not in self.RETRY_STATUS or attempt == self.max_retries:
+                    self._count("failed", len(to))
+                    log.error("delivery.failed", recipients=len(to), error=e)
+                    return
+                retry_after = (e.headers or {}).get("Retry-After")
+            except Exception as e:
+                if attempt == self.max_retries:
+                    self._count("failed", len(to))
+                    log.error("delivery.failed", recipients=len(to), error=e)
+                    return
+            finally:
+                api.headers.pop("X-Line-Retry-Key", None)
+
+            self._count("retries")
+            time.sleep(self._backoff(attempt, retry_after))
+
+    @staticmethod
+    def _backoff(attempt, retry_after=None):
+        if retry_after and str(retry_after).isdigit():
+            return min(float(retry_after), 30.0)
+        return random.uniform(0, min(10.0, 0.5 * (2 ** attempt)))
@@ -0,0 +1,328 @@
+"""Webhook イベントの非同期処理（署名検証だけして即 200 を返し、処理はワーカーで行う）"""
+
+import base64
+import hashlib
+import hmac
+import importlib
+import json
+import queue
+import sqlite3
+import threading
+import time
+import zlib
+from collections import deque
+
+import metrics
+from logs import get_logger
+
+log = get_logger("events")
+
+EVENT_SECONDS = metrics.histogram("webhook_event_seconds", "Webhook イベント 1 件の処理時間（ハンドラの実行）")
+EVENT_LATENCY = metrics.histogram("webhook_event_latency_seconds", "Webhook の受信から処理完了までの時間")
+
+
+class EventDispatcher:
+    """利用者ごとに同じワーカーへ振り分ける固定数のワーカープール
+
+    同じ利用者のイベントは必ず同じキューに入るので、受け取った順に 1 件ずつ処理される
+    （user_status の状態遷移が前後しない）。キューは上限付き。
+    submit_all は待たずに全部積むか 1 件も積まないか（Webhook の受付用。積めなければ LINE に再送させる）。
+    """
+
+    def __init__(self, handle, workers: int = 4, max_queue: int = 1000):
+        self.handle = handle            # (event) -> None
+        self._queues = [queue.Queue(maxsize=max_queue) for _ in range(workers)]
+        self._threads = []
+        self._lock = threading.Lock()
+        self._submit_lock = threading.Lock()
+        self._latencies = deque(maxlen=1024)  # 受信から処理完了までの秒数（直近分）
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+
+    @staticmethod
+    def key_of(event):
+        if isinstance(event, dict):
+            src = event.get("source") or {}
+            return src.get("userId") or src.get("groupId") or src.get("roomId") or ""
+        src = getattr(event, "source", None)
+        return (getattr(src, "user_id", None) or getattr(src, "group_id", None)
+                or getattr(src, "room_id", None) or "")
+
+    def _shard(self, key):
+        return self._queues[zlib.crc32(key.encode()) % len(self._queues)]
+
+    # ------------------------------------------------------------
+    #  受付
+    # ------------------------------------------------------------
+
+    def submit(self, event, timeout: float = None) -> bool:
+        """1 件積む（空くまで timeout 秒待つ。None なら空くまで待つ）"""
+        self.start()
+        try:
+            self._shard(self.key_of(event)).put((time.monotonic(), event), timeout=timeout)
+            return True
+        except queue.Full:
+            self._dropped([event])
+            return False
+
+    def submit_all(self, events) -> bool:
+        """待たずに全部積む。どれかのキューに空きが足りなければ 1 件も積まずに False"""
+        self.start()
+        shards = [(self._shard(self.key_of(e)), e) for e in events]
+        need = {}
+        for q, _ in shards:
+            need[q] = need.get(q, 0) + 1
+        # 積むのはこのロックの中だけ（ワーカーは取り出すだけなので、確かめた空きは減らない）
+        with self._submit_lock:
+            if any(q.maxsize - q.qsize() < n for q, n in need.items()):
+                self._dropped(events)
+                return False
+            received = time.monotonic()
+            for q, event in shards:
+                q.put_nowait((received, event))
+        return True
+
+    def _dropped(self, events):
+        with self._lock:
+            self.dropped += len(events)
+        for event in events:
+            log.warning("events.dropped", key=self.key_of(event),
+                        event_id=event.get("webhookEventId") if isinstance(event, dict) else None)
+
+    def depth(self):
+        return sum(q.qsize() for q in self._queues)
+
+    def join(self):
+        """キューに積まれたイベントを処理し終えるまで待つ"""
+        for q in self._queues:
+            q.join()
+
+    # ------------------------------------------------------------
+    #  処理
+    # ------------------------------------------------------------
+
+    def start(self):
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for i, q in enumerate(self._queues):
+                t = threading.Thread(target=self._run, args=(q,), name=f"event-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _run(self, q):
+        while True:
+            received, event = q.get()
+            try:
+                with EVENT_SECONDS.time():
+                    self.handle(event)
+                ok = True
+            except Exception as e:
+                ok = False
+                log.error("events.error", error=e)
+            finally:
+                q.task_done()
+            latency = time.monotonic() - received
+            EVENT_LATENCY.observe(latency)
+            with self._lock:
+                self._latencies.append(latency)
+                if ok:
+                    self.processed += 1
+                else:
+                    self.failed += 1
+
+    def stats(self):
+        with self._lock:
+            lat = sorted(self._latencies)
+            processed, failed, dropped = self.processed, self.failed, self.dropped
+
+        def pct(p):
+            return round(lat[min(len(lat) - 1, int(len(lat) * p))] * 1e3, 2) if lat else None
+
+        return {
+            "queue_depth": self.depth(),
+            "processed": processed,
+            "failed": failed,
+            "dropped": dropped,
+            "latency_ms_p50": pct(0.5),
+            "latency_ms_p95": pct(0.95),
+            "latency_ms_max": round(lat[-1] * 1e3, 2) if lat else None,
+        }
+
+
+class WebhookChannel:
+    """プロセス間で Webhook を受け渡すキュー（SQLite）
+
+    Web ワーカーが put した本文を、監視担当のプロセスが受け取った順に取り出す。
+    取り出した分は処理キューに積んでから消す（担当が落ちると積む前の分は次の担当が受け取る）。
+    """
+
+    def __init__(self, path: str, poll_interval: float = 0.05, batch: int = 500):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.batch = batch
+        self._local = threading.local()
+        self._thread = None
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS webhooks ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, body TEXT NOT NULL, signature TEXT NOT NULL)"
+            )
+
+    @property
+    def _conn(self):
+        """スレッドごとの接続"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def put(self, body: str, signature: str):
+        with self._conn:
+            self._conn.execute("INSERT INTO webhooks (body, signature) VALUES (?, ?)", (body, signature))
+
+    def depth(self):
+        return self._conn.execute("SELECT COUNT(*) FROM webhooks").fetchone()[0]
+
+    def consume(self, handle):
+        """別スレッドで取り出し続け、1 件ずつ handle(body, signature) を呼ぶ"""
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, args=(handle,), name="webhook-channel", daemon=True)
+        self._thread.start()
+
+    def _run(self, handle):
+        conn = self._conn
+        while True:
+            rows = conn.execute(
+                "SELECT id, body, signature FROM webhooks ORDER BY id LIMIT ?", (self.batch,)
+            ).fetchall()
+            if not rows:
+                time.sleep(self.poll_interval)
+                continue
+            for _, body, signature in rows:
+                try:
+                    handle(body, signature)
+                except Exception as e:
+                    log.error("webhook_channel.error", error=e)
+            with conn:
+                conn.execute("DELETE FROM webhooks WHERE id <= ?", (rows[-1][0],))
+
+
+class InvalidSignatureError(Exception):
+    """X-Line-Signature が本文と合わない"""
+
+
+class QueueFullError(Exception):
+    """処理キューに空きが無く、Webhook のイベントを積めなかった（503 を返して LINE に再送させる）"""
+
+
+# Webhook の type -> linebot.models.events のクラス名（WebhookParser.parse と同じ対応。
+# UnsendEvent などは linebot.models から再エクスポートされていないので events から読む）
+EVENT_TYPES = {
+    "message": "MessageEvent",
+    "follow": "FollowEvent",
+    "unfollow": "UnfollowEvent",
+    "join": "JoinEvent",
+    "leave": "LeaveEvent",
+    "postback": "PostbackEvent",
+    "beacon": "BeaconEvent",
+    "accountLink": "AccountLinkEvent",
+    "memberJoined": "MemberJoinedEvent",
+    "memberLeft": "MemberLeftEvent",
+    "things": "ThingsEvent",
+    "unsend": "UnsendEvent",
+    "videoPlayComplete": "VideoPlayCompleteEvent",
+}
+
+
+class QueuedWebhookHandler:
+    """handle() は署名検証とキュー投入だけを行う Webhook ハンドラ（linebot.WebhookHandler 互換）
+
+    受け付けの経路では LINE SDK を import しない（起動直後の最初の /callback を軽くする）。
+    署名は hmac で検証し、JSON のイベントのままキューに積む。Event オブジェクトへの変換と
+    ハンドラの呼び出しはワーカーで行う。ハンドラの登録（@handler.add）はクラスでもクラス名でもよい。
+    forward_to(channel) すると、検証した本文を WebhookChannel に書くだけになる
+    （複数プロセスで受けて、処理は consume(channel) したプロセスにまとめる）。
+    """
+
+    def __init__(self, channel_secret, workers: int = 4, max_queue: int = 1000):
+        self._secret = (channel_secret or "").encode("utf-8")
+        self._handlers = {}
+        self._default = None
+        self._models = None
+        self.dispatcher = EventDispatcher(self.dispatch, workers=workers, max_queue=max_queue)
+        self.channel = None
+
+    @staticmethod
+    def _name(cls):
+        return cls if isinstance(cls, str) else cls.__name__
+
+    def add(self, event, message=None):
+        key = self._name(event) if message is None else f"{self._name(event)}_{self._name(message)}"
+
+        def decorator(func):
+            self._handlers[key] = func
+            return func
+        return decorator
+
+    def default(self):
+        def decorator(func):
+            self._default = func
+            return func
+        return decorator
+
+    def forward_to(self, channel: WebhookChannel):
+        self.channel = channel
+
+    def consume(self, channel: WebhookChannel):
+        channel.consume(self.enqueue)
+
+    def validate(self, body, signature):
+        digest = hmac.new(self._secret, body.encode("utf-8"), hashlib.sha256).digest()
+        if not hmac.compare_digest(base64.b64encode(digest), (signature or "").encode("utf-8")):
+            raise InvalidSignatureError(f"Invalid signature. signature={signature}")
+
+    def handle(self, body, signature):
+        # 署名が合わなければ InvalidSignatureError（従来どおり）。キューが一杯なら QueueFullError
+        self.validate(body, signature)
+        if self.channel is None:
+            events = json.loads(body)["events"]
+            if not self.dispatcher.submit_all(events):
+                raise QueueFullError(f"event queue full, rejected {len(events)} events")
+            return
+        self.channel.put(body, signature)
+
+    def enqueue(self, body, signature):
+        """WebhookChannel から受け取った本文のイベントを積む（取り出した行は消すので、空くまで待つ）"""
+        for event in json.loads(body)["events"]:
+            self.dispatcher.submit(event)
+
+    def to_event(self, raw):
+        """JSON のイベント -> linebot.models.events の Event（未知の type は None）"""
+        if self._models is None:
+            self._models = importlib.import_module("linebot.models.events")
+        name = EVENT_TYPES.get(raw.get("type"))
+        if name is None:
+            log.warning("events.unknown_type", type=raw.get("type"))
+            return None
+        return getattr(self._models, name).new_from_json_dict(raw)
+
+    def dispatch(self, raw):
+        """登録済みのハンドラを呼ぶ（振り分け規則は WebhookHandler.handle と同じ）"""
+        event = self.to_event(raw) if isinstance(raw, dict) else raw
+        if event is None:
+            return
+        func = None
+        message = getattr(event, "message", None)
+        if type(event).__name__ == "MessageEvent" and message is not None:
+            func = self._handlers.get(f"{type(event).__name__}_{type(message).__name__}")
+        if func is None:
+            func = self._handlers.get(type(event).__name__, self._default)
+        if func is not None:
+            func(event)
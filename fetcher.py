@@ -0,0 +1,125 @@
+"""Bus-Vision 向け HTTP クライアント（接続プール・タイムアウト・リトライ付き）"""
+
+import asyncio
+import random
+import threading
+import time
+
+from lazy import LazyModule
+
+# requests は最初のリクエストまで読み込まない（起動を軽くする）
+requests = LazyModule("requests")
+requests_adapters = LazyModule("requests.adapters")
+
+
+class FetchError(Exception):
+    """リトライしても取得できなかった"""
+
+
+class HttpFetcher:
+    """スレッドごとに keep-alive の Session を持ち、同時実行数を制限して GET する
+
+    - 接続 / 読み込みタイムアウトはリクエストごとに必ず付ける
+    - 接続エラー・タイムアウト・429・5xx はジッター付き指数バックオフでリトライ
+    - 同期 (get) と非同期 (aget) のどちらからでも呼べる
+    """
+
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+
+    def __init__(
+        self,
+        connect_timeout: float = 3.05,
+        read_timeout: float = 10.0,
+        pool_size: int = 8,
+        max_concurrency: int = 8,
+        retries: int = 2,
+        backoff_base: float = 0.5,
+        backoff_max: float = 5.0,
+        headers=None,
+    ):
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.headers = {
+            "Accept-Encoding": "gzip, deflate",
+            "Connection": "keep-alive",
+            **(headers or {}),
+        }
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._local = threading.local()
+
+    @classmethod
+    def from_env(cls, environ, prefix: str = "BUSVISION_"):
+        """環境変数（BUSVISION_CONNECT_TIMEOUT など）から設定を読む"""
+        def get(name, default, cast=float):
+            return cast(environ.get(prefix + name, default))
+
+        return cls(
+            connect_timeout=get("CONNECT_TIMEOUT", 3.05),
+            read_timeout=get("READ_TIMEOUT", 10.0),
+            pool_size=get("POOL_SIZE", 8, int),
+            max_concurrency=get("MAX_CONCURRENCY", 8, int),
+            retries=get("RETRIES", 2, int),
+        )
+
+    # ------------------------------------------------------------
+    #  Session（スレッドごと）
+    # ------------------------------------------------------------
+
+    @property
+    def session(self):
+        s = getattr(self._local, "session", None)
+        if s is None:
+            s = requests.Session()
+            adapter = requests_adapters.HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+            s.mount("http://", adapter)
+            s.mount("https://", adapter)
+            s.headers.update(self.headers)
+            self._local.session = s
+        return s
+
+    # ------------------------------------------------------------
+    #  GET
+    # ------------------------------------------------------------
+
+    def get(self, url: str, params=None):
+        """GET してレスポンスを返す。失敗し続けたら FetchError"""
+        # 上流が詰まっているときに待ち行列を伸ばさない
+        if not self._slots.acquire(timeout=sum(self.timeout)):
+            raise FetchError(f"同時接続数の上限に達しています: {url}")
+        try:
+            return self._get_with_retry(url, params)
+        finally:
+            self._slots.release()
+
+    async def aget(self, url: str, params=None):
+        """非同期版 get（ブロッキング I/O はスレッドで行う）"""
+        return await asyncio.to_thread(self.get, url, params)
+
+    def _get_with_retry(self, url, params):
+        last_error = None
+        for attempt in range(self.retries + 1):
+            retry_after = None
+            try:
+                r = self.session.get(url, params=params, timeout=self.timeout)
+                if r.status_code not in self.RETRY_STATUS:
+                    r.raise_for_status()
+                    return r
+                last_error = FetchError(f"HTTP {r.status_code}: {r.url}")
+                retry_after = r.headers.get("Retry-After")
+            except (requests.ConnectionError, requests.Timeout) as e:
+                last_error = e
+            except requests.RequestException as e:
+                raise FetchError(str(e)) from e
+
+            if attempt < self.retries:
+                time.sleep(self._backoff(attempt, retry_after))
+        raise FetchError(str(last_error)) from last_error
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.backoff_max)
+        # full jitter
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
@@ -0,0 +1,38 @@
+"""gunicorn の設定（gunicorn app:app で読み込まれる）
+
+どのワーカーも Webhook の受け付け（署名検証とチャネルへの書き込み）を並列に行い、
+イベント処理と監視はロックを取った 1 ワーカーだけが行う（app.py の APP_ROLE=cluster）。
+MONITOR_PROCESSES を 1 以上にすると、ポーリングはその数の監視ワーカー（APP_ROLE=monitor）が
+路線ごとに分担する（shard.py）。監視ワーカーは gunicorn の起動・終了に合わせて起動・停止する。
+"""
+
+import multiprocessing
+import os
+import subprocess
+import sys
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+raw_env = ["APP_ROLE=cluster"]
+# 各ワーカーが fork 後に app を読み込む（ロックやスレッドを親から引き継がないように）
+preload_app = False
+
+monitor_processes = int(os.getenv("MONITOR_PROCESSES", "0"))
+_monitors = []
+
+
+def on_starting(server):
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    env = {**os.environ, "APP_ROLE": "monitor"}
+    for _ in range(monitor_processes):
+        _monitors.append(subprocess.Popen([sys.executable, os.path.join(app_dir, "app.py")], cwd=app_dir, env=env))
+
+
+def on_exit(server):
+    for p in _monitors:
+        p.terminate()
+    for p in _monitors:
+        try:
+            p.wait(10)
+        except subprocess.TimeoutExpired:
+            p.kill()
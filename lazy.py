@@ -0,0 +1,66 @@
+"""重い import を最初に使うときまで遅らせる
+
+起動直後（gunicorn のワーカーが上がってから最初の /callback まで）に使わないモジュール
+（linebot.models / bs4 / requests など）は、属性を初めて読んだときに import する。
+
+    models = LazyModule("linebot.models")
+    models.TextSendMessage(text="...")   # ここで初めて linebot.models を読み込む
+"""
+
+import importlib
+import threading
+
+
+class LazyModule:
+    """属性を最初に読んだときに import するモジュールの代理。読んだ属性は自分に持つ"""
+
+    def __init__(self, name: str):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def load(self):
+        module = self.__dict__["_module"]
+        if module is None:
+            # import 自体は importlib のロックで 1 回だけ
+            module = self.__dict__["_module"] = importlib.import_module(self._name)
+        return module
+
+    @property
+    def loaded(self) -> bool:
+        return self.__dict__["_module"] is not None
+
+    def __getattr__(self, attr):
+        value = getattr(self.load(), attr)
+        self.__dict__[attr] = value   # 2 回目からは普通の属性参照
+        return value
+
+    def __repr__(self):
+        return f"<LazyModule {self._name} {'loaded' if self.loaded else 'pending'}>"
+
+
+class LazyObject:
+    """factory() の結果を最初に属性を読んだときに作る（作るのは 1 回だけ）"""
+
+    def __init__(self, factory):
+        self.__dict__["_factory"] = factory
+        self.__dict__["_obj"] = None
+        self.__dict__["_lock"] = threading.Lock()
+
+    def get(self):
+        obj = self.__dict__["_obj"]
+        if obj is None:
+            with self._lock:
+                obj = self.__dict__["_obj"]
+                if obj is None:
+                    obj = self.__dict__["_obj"] = self._factory()
+        return obj
+
+    @property
+    def created(self) -> bool:
+        return self.__dict__["_obj"] is not None
+
+    def __getattr__(self, attr):
+        return getattr(self.get(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self.get(), attr, value)
@@ -0,0 +1,61 @@
+"""監視担当プロセスの選出（同じマシン上の gunicorn ワーカーの中から 1 つだけ）"""
+
+import fcntl
+import os
+import threading
+import time
+
+from logs import get_logger
+
+log = get_logger("leader")
+
+
+class LeaderLock:
+    """ファイルロック（flock）を取れたプロセスが担当になる
+
+    ロックはプロセスが終わると OS が外すので、担当が落ちたら retry_interval 秒以内に
+    別のプロセスが引き継ぐ。ロックファイルを共有できない複数台構成では使えない。
+    """
+
+    def __init__(self, path: str, retry_interval: float = 5.0):
+        self.path = path
+        self.retry_interval = retry_interval
+        self._fd = None
+        self._thread = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._fd is not None
+
+    def try_acquire(self) -> bool:
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+    def run(self, on_elected):
+        """担当になるまで別スレッドで待ち、なったら on_elected() を呼ぶ"""
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, args=(on_elected,), name="leader-lock", daemon=True)
+        self._thread.start()
+
+    def _run(self, on_elected):
+        while not self.try_acquire():
+            time.sleep(self.retry_interval)
+        log.info("leader.elected", pid=os.getpid())
+        on_elected()
@@ -0,0 +1,80 @@
+"""レベル付きの構造化ログ（1 行 1 イベント、key=value 形式）
+
+    log = get_logger("monitor")
+    log.debug("poll_route.error", route=route, error=e)
+
+LOG_LEVEL（DEBUG / INFO / WARNING / ERROR / OFF、既定 INFO）より低いレベルの呼び出しは
+比較 1 回で戻り、文字列は作らない（ホットパスの debug は本番では無料）。
+"""
+
+import os
+import sys
+import threading
+import time
+
+DEBUG, INFO, WARNING, ERROR, OFF = 10, 20, 30, 40, 100
+LEVELS = {"DEBUG": DEBUG, "INFO": INFO, "WARNING": WARNING, "ERROR": ERROR, "OFF": OFF}
+_NAMES = {DEBUG: "debug", INFO: "info", WARNING: "warning", ERROR: "error"}
+
+_level = LEVELS.get(os.getenv("LOG_LEVEL", "INFO").upper(), INFO)
+_lock = threading.Lock()
+_out = sys.stdout
+
+
+def set_level(level):
+    """"DEBUG" などの名前か数値"""
+    global _level
+    _level = LEVELS[level.upper()] if isinstance(level, str) else level
+
+
+def enabled(level) -> bool:
+    return level >= _level
+
+
+def _quote(v) -> str:
+    s = str(v)
+    if not s or any(c in s for c in ' ="\n'):
+        return '"' + s.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+    return s
+
+
+def _emit(level, name, event, fields):
+    parts = [f"ts={time.time():.3f}", f"level={_NAMES[level]}", f"logger={name}", f"event={event}"]
+    parts.extend(f"{k}={_quote(v)}" for k, v in fields.items())
+    line = " ".join(parts) + "\n"
+    with _lock:
+        _out.write(line)
+        _out.flush()
+
+
+class Logger:
+    __slots__ = ("name",)
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def debug(self, event, **fields):
+        if DEBUG >= _level:
+            _emit(DEBUG, self.name, event, fields)
+
+    def info(self, event, **fields):
+        if INFO >= _level:
+            _emit(INFO, self.name, event, fields)
+
+    def warning(self, event, **fields):
+        if WARNING >= _level:
+            _emit(WARNING, self.name, event, fields)
+
+    def error(self, event, **fields):
+        if ERROR >= _level:
+            _emit(ERROR, self.name, event, fields)
+
+
+_loggers = {}
+
+
+def get_logger(name: str) -> Logger:
+    log = _loggers.get(name)
+    if log is None:
+        log = _loggers[name] = Logger(name)
+    return log
@@ -0,0 +1,201 @@
+"""メトリクス（Prometheus のテキスト形式で出す）
+
+    FETCH_SECONDS = histogram("busvision_fetch_seconds", "approach.html の取得時間")
+    with FETCH_SECONDS.time():
+        ...
+
+ヒストグラムの観測はロック 1 回と二分探索だけ。値を持たないもの（キューの長さなど）は
+gauge(name, help, fn) で登録し、出力するときに fn() を呼ぶ。
+"""
+
+import bisect
+import threading
+import time
+
+# 秒。Bus-Vision の取得（〜数秒）から HTML の解析（〜1ms 未満）までを 1 組で測れる幅
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{str(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class _Timer:
+    __slots__ = ("metric", "started")
+
+    def __init__(self, metric):
+        self.metric = metric
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metric.observe(time.perf_counter() - self.started)
+
+
+class Histogram:
+    """累積バケット + 合計 + 件数（label があれば labels(...) の子ごとに持つ）"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS, labelnames=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._counts = [0] * (len(self.buckets) + 1)
+            self._sum = 0.0
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, Histogram(self.name, self.help, self.buckets))
+        return child
+
+    def observe(self, seconds: float):
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += seconds
+
+    def time(self):
+        return _Timer(self)
+
+    def samples(self):
+        if self.labelnames:
+            for values, child in sorted(self._children.items()):
+                yield from child._samples(_labels(self.labelnames, values)[1:-1])
+        else:
+            yield from self._samples("")
+
+    def _samples(self, extra):
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        sep = "," if extra else ""
+        acc = 0
+        for le, n in zip(self.buckets + (float("inf"),), counts):
+            acc += n
+            bound = "+Inf" if le == float("inf") else repr(le)
+            yield f'{self.name}_bucket{{{extra}{sep}le="{bound}"}} {acc}'
+        suffix = "{" + extra + "}" if extra else ""
+        yield f"{self.name}_sum{suffix} {total}"
+        yield f"{self.name}_count{suffix} {acc}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {} if self.labelnames else {(): 0}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, n: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + n
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for values, v in items:
+            yield f"{self.name}{_labels(self.labelnames, values)} {v}"
+
+
+class CallbackGauge:
+    """出力するときに fn() を呼ぶ。fn は数値か {ラベル値のタプル: 数値} を返す"""
+
+    def __init__(self, name, help, fn, labelnames=(), kind="gauge"):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labelnames = tuple(labelnames)
+        self.kind = kind
+
+    def samples(self):
+        value = self.fn()
+        if isinstance(value, dict):
+            for values, v in sorted(value.items()):
+                yield f"{self.name}{_labels(self.labelnames, values)} {v}"
+        else:
+            yield f"{self.name} {value}"
+
+# ================================================================
+#  レジストリ
+# ================================================================
+
+_metrics = {}
+_lock = threading.Lock()
+
+
+def _register(metric):
+    with _lock:
+        return _metrics.setdefault(metric.name, metric)
+
+
+def histogram(name, help, buckets=DEFAULT_BUCKETS, labelnames=()) -> Histogram:
+    return _register(Histogram(name, help, buckets, labelnames))
+
+
+def counter(name, help, labelnames=()) -> Counter:
+    return _register(Counter(name, help, labelnames))
+
+
+def gauge(name, help, fn, labelnames=(), kind="gauge") -> CallbackGauge:
+    """同じ名前で登録し直すと fn を差し替える（app の再読み込み時など）"""
+    metric = CallbackGauge(name, help, fn, labelnames, kind)
+    with _lock:
+        _metrics[name] = metric
+    return metric
+
+
+def render() -> str:
+    lines = []
+    with _lock:
+        metrics = sorted(_metrics.values(), key=lambda m: m.name)
+    for m in metrics:
+        try:
+            samples = list(m.samples())
+        except Exception as e:
+            samples = []
+            lines.append(f"# {m.name}: {e}")
+        lines.append(f"# HELP {m.name} {m.help}")
+        lines.append(f"# TYPE {m.name} {m.kind}")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+def serve(port: int, host: str = "127.0.0.1"):
+    """/metrics だけを返す HTTP サーバーを別スレッドで起動する（Flask を持たない監視ワーカー用）"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            data = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
@@ -0,0 +1,311 @@
+"""バス位置監視エンジン（タイマーヒープ + 固定数ワーカーで全監視を管理）"""
+
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import metrics
+from clock import SYSTEM_CLOCK
+from logs import get_logger
+from snapshots import diff_snapshots, lead
+from upstream import ADMIT, OPEN
+
+log = get_logger("monitor")
+
+POLL_SECONDS = metrics.histogram("monitor_poll_seconds", "路線 1 回分の取得・解析・配信の時間（予算待ちを含む）")
+
+
+class Watch:
+    """利用者 1 人分の監視"""
+
+    __slots__ = ("user_id", "route", "departure_time", "end_time")
+
+    def __init__(self, user_id, route, departure_time, end_time):
+        self.user_id = user_id
+        self.route = route          # (from_code, to_code)
+        self.departure_time = departure_time
+        self.end_time = end_time
+
+
+class AdaptiveCadence:
+    """バスの近さと乗車時刻までの残り時間からポーリング間隔を決める
+
+    - 先頭のバスが 1 つ前まで来ていれば min_interval、1 停留所遠いごとに per_stop 秒延ばす
+    - 接近情報がないときは、乗車時刻まで 3 分以上あれば max_interval、それより近ければ中間
+    - 全路線の合計が budget_per_min（回/分）を超えるときは全体を同じ比率で間延びさせる
+    """
+
+    def __init__(self, min_interval: float = 10, max_interval: float = 60, per_stop: float = 10,
+                 budget_per_min: float = None):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.per_stop = per_stop
+        self.budget_per_min = budget_per_min
+        self._rates = {}   # route -> 1 秒あたりのリクエスト数
+        self._total = 0.0
+
+    def base_interval(self, snapshot, to_departure: float) -> float:
+        bus = lead(snapshot)
+        away = bus.stops_away if bus else None
+        if away is not None:
+            interval = self.min_interval + max(0, away - 1) * self.per_stop
+        elif snapshot is not None and to_departure > 180:
+            interval = self.max_interval
+        else:
+            interval = (self.min_interval + self.max_interval) / 2
+        return min(self.max_interval, max(self.min_interval, interval))
+
+    def next_interval(self, route, snapshot, to_departure: float) -> float:
+        interval = self.base_interval(snapshot, to_departure)
+        self._total += 1.0 / interval - self._rates.get(route, 0.0)
+        self._rates[route] = 1.0 / interval
+        if self.budget_per_min:
+            interval *= max(1.0, self._total * 60 / self.budget_per_min)
+        return interval
+
+    def forget(self, route):
+        self._total -= self._rates.pop(route, 0.0)
+
+    @property
+    def requests_per_min(self) -> float:
+        return self._total * 60
+
+
+class MonitorEngine:
+    """全利用者の監視を 1 本のスケジューラスレッドで管理する
+
+    - 同じ (stopCdFrom, stopCdTo) の利用者はまとめて 1 回だけ取得・解析する
+    - 次に期限が来る路線 / 監視終了だけをヒープで持ち、その時刻まで眠る
+    - 取得・解析・配信は固定数のワーカープールで行う（利用者ごとのスレッドは作らない）
+    - gate（UpstreamGate）があれば取得の前に通してもらう。後回しにされた路線は間隔を倍にし、
+      ブレーカーが開いている間は取得せず、その路線の利用者に on_unavailable で 1 回だけ知らせる
+    """
+
+    def __init__(self, fetch, parse, deliver, on_finish, on_change=None, interval: int = 15, workers: int = 4,
+                 cadence: AdaptiveCadence = None, gate=None, on_unavailable=None,
+                 clock=SYSTEM_CLOCK, threaded: bool = True):
+        self.fetch = fetch          # (from_code, to_code) -> html
+        self.parse = parse          # html -> ApproachRecord のタプル（取得失敗は None）
+        self.deliver = deliver      # (user_id, snapshot) -> None（利用者ごとの変化判定は呼び出し側）
+        self.on_finish = on_finish  # (user_id) -> None（監視時間の終了時）
+        self.on_change = on_change  # (route, snapshot, events) -> None（路線ごとの差分イベント）
+        self.interval = timedelta(seconds=interval)
+        self.cadence = cadence      # None なら interval 秒ごとの固定間隔
+        self.workers = workers
+        self.gate = gate
+        self.clock = clock
+        self.threaded = threaded    # False なら pop_due / poll_route を呼ぶ側が回す（シミュレーション用）
+        self.on_unavailable = on_unavailable  # (user_id) -> None（Bus-Vision が使えなくなったとき）
+        self._told = set()   # 今回の障害で知らせ済みの user_id
+
+        self.watches = {}    # user_id -> Watch
+        self.routes = {}     # route -> {user_id, ...}
+        self.route_due = {}  # route -> 次回ポーリング時刻（ヒープ上の有効なエントリ）
+        self.inflight = set()  # 取得中の route
+        self.snapshots = {}  # route -> 前回のスナップショット
+        self._heap = []      # (due, seq, kind, key)  kind: "poll" / "expire"
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._pool = None
+        self._thread = None
+
+    # ------------------------------------------------------------
+    #  監視の登録 / 解除
+    # ------------------------------------------------------------
+
+    def watch(self, user_id, route, departure_time, end_time, now=None):
+        now = now or self.clock.now()
+        w = Watch(user_id, route, departure_time, end_time)
+        with self._cond:
+            self._remove(user_id)
+            self.watches[user_id] = w
+            self.routes.setdefault(route, set()).add(user_id)
+            self._push(end_time, "expire", w)
+            if route not in self.route_due and route not in self.inflight:
+                self._schedule_route(route, now)
+            self._cond.notify()
+        self.start()
+        log.debug("monitor.watch", user=user_id, route=route, watches=len(self.watches))
+
+    def unwatch(self, user_id):
+        with self._cond:
+            return self._remove(user_id)
+
+    def is_watching(self, user_id):
+        return user_id in self.watches
+
+    def users_of(self, route):
+        with self._cond:
+            return list(self.routes.get(route, ()))
+
+    def is_polling(self, route):
+        """route を取得・配信している最中か"""
+        with self._cond:
+            return route in self.inflight
+
+    def _remove(self, user_id):
+        w = self.watches.pop(user_id, None)
+        if not w:
+            return False
+        users = self.routes.get(w.route)
+        if users is not None:
+            users.discard(user_id)
+            if not users:
+                # ヒープ上のエントリは取り出し時に読み捨てる
+                del self.routes[w.route]
+                self.route_due.pop(w.route, None)
+                self.snapshots.pop(w.route, None)
+                if self.cadence:
+                    self.cadence.forget(w.route)
+        return True
+
+    # ------------------------------------------------------------
+    #  タイマーヒープ
+    # ------------------------------------------------------------
+
+    def _push(self, due, kind, key):
+        heapq.heappush(self._heap, (due, next(self._seq), kind, key))
+
+    def _schedule_route(self, route, due):
+        self.route_due[route] = due
+        self._push(due, "poll", route)
+
+    def next_due(self):
+        with self._cond:
+            return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now):
+        """期限の来たエントリを取り出し、(終了した利用者, ポーリングする路線) を返す"""
+        finished, polls = [], []
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now:
+                due, _, kind, key = heapq.heappop(self._heap)
+                if kind == "expire":
+                    if self.watches.get(key.user_id) is key:
+                        self._remove(key.user_id)
+                        finished.append(key.user_id)
+                elif self.route_due.get(key) == due:
+                    # 取得中は再登録しない（完了時に次回を積む）
+                    del self.route_due[key]
+                    self.inflight.add(key)
+                    polls.append((key, list(self.routes[key])))
+        return finished, polls
+
+    # ------------------------------------------------------------
+    #  ポーリング
+    # ------------------------------------------------------------
+
+    def poll_route(self, route, users):
+        """1 路線を 1 回だけ取得・解析し、購読中の利用者全員に配る"""
+        started = self.clock.now()
+        snapshot = None
+        verdict = ADMIT
+        polled_at = time.perf_counter()
+        try:
+            if self.gate:
+                verdict = self.gate.admit(self._priority(route, started))
+                if verdict == OPEN:
+                    self._tell_unavailable(route, users)
+                if verdict != ADMIT:
+                    return
+                t0 = time.monotonic()
+                html = self.fetch(*route)
+                self.gate.record(html is not None, time.monotonic() - t0)
+                if html is not None and self._told:
+                    self._told.clear()
+            else:
+                html = self.fetch(*route)
+            snapshot = self.parse(html)
+            if snapshot is None:
+                return
+            events = diff_snapshots(self.snapshots.get(route), snapshot)
+            if route in self.routes:
+                self.snapshots[route] = snapshot
+            if events and self.on_change:
+                self.on_change(route, snapshot, events)
+            if snapshot:
+                for uid in users:
+                    # 取得中にキャンセルされた利用者には送らない
+                    w = self.watches.get(uid)
+                    if w is not None and w.route == route:
+                        self.deliver(uid, snapshot)
+        except Exception as e:
+            log.warning("monitor.poll_error", route=route, error=e)
+        finally:
+            POLL_SECONDS.observe(time.perf_counter() - polled_at)
+            with self._cond:
+                self.inflight.discard(route)
+                if route in self.routes and route not in self.route_due:
+                    if verdict == OPEN:
+                        interval = timedelta(seconds=max(1.0, self.gate.retry_after()))
+                    elif verdict != ADMIT:
+                        interval = 2 * self._next_interval(route, self.snapshots.get(route), started)
+                    else:
+                        interval = self._next_interval(route, snapshot, started)
+                    self._schedule_route(route, started + interval)
+                    self._cond.notify()
+
+    def _priority(self, route, now):
+        """乗車時刻までの秒数（過ぎていれば 0）。一番近い利用者に合わせる"""
+        with self._cond:
+            deps = [self.watches[uid].departure_time for uid in self.routes.get(route, ())]
+        return max(0.0, (min(deps) - now).total_seconds()) if deps else 0.0
+
+    def _tell_unavailable(self, route, users):
+        if not self.on_unavailable:
+            return
+        for uid in users:
+            w = self.watches.get(uid)
+            if w is None or w.route != route or uid in self._told:
+                continue
+            self._told.add(uid)
+            self.on_unavailable(uid)
+
+    def _next_interval(self, route, snapshot, now):
+        if not self.cadence:
+            return self.interval
+        departure = min(self.watches[uid].departure_time for uid in self.routes[route])
+        seconds = self.cadence.next_interval(route, snapshot, (departure - now).total_seconds())
+        return timedelta(seconds=seconds)
+
+    def _finish(self, user_id):
+        try:
+            self.on_finish(user_id)
+        except Exception as e:
+            log.error("monitor.finish_error", user=user_id, error=e)
+
+    def run_pending(self, now=None):
+        """期限の来た終了処理とポーリングを呼び出したスレッドで順に実行する（threaded=False 用）"""
+        finished, polls = self.pop_due(now or self.clock.now())
+        for uid in finished:
+            self._finish(uid)
+        for route, users in polls:
+            self.poll_route(route, users)
+        return len(polls)
+
+    def start(self):
+        with self._cond:
+            if not self.threaded or (self._thread and self._thread.is_alive()):
+                return
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="monitor")
+            self._thread = threading.Thread(target=self._run, name="monitor-engine", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    due = self._heap[0][0] if self._heap else None
+                    now = self.clock.now()
+                    if due is not None and due <= now:
+                        break
+                    self._cond.wait(None if due is None else (due - now).total_seconds())
+
+            finished, polls = self.pop_due(self.clock.now())
+            for uid in finished:
+                self._pool.submit(self._finish, uid)
+            for route, users in polls:
+                self._pool.submit(self.poll_route, route, users)
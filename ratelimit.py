@@ -0,0 +1,51 @@
+"""トークンバケット（外部 API へのリクエスト数の制限）"""
+
+import threading
+import time
+
+
+class TokenBucket:
+    """rate 個/秒で補充され、最大 capacity 個まで貯まるトークンバケット"""
+
+    def __init__(self, rate: float, capacity: float = None, clock=time.monotonic):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self.clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, n: float = 1.0) -> bool:
+        """トークンがあれば取って True、なければ何もせず False"""
+        with self._lock:
+            self._refill(self.clock())
+            if self._tokens >= n:
+                self._tokens -= n
+                return True
+            return False
+
+    def wait_time(self, n: float = 1.0) -> float:
+        """n 個取れるようになるまでの秒数"""
+        with self._lock:
+            self._refill(self.clock())
+            return max(0.0, (n - self._tokens) / self.rate)
+
+    def acquire(self, n: float = 1.0, timeout: float = None) -> bool:
+        """取れるまで待つ。timeout 秒以内に取れなければ False"""
+        deadline = None if timeout is None else self.clock() + timeout
+        while not self.try_acquire(n):
+            wait = self.wait_time(n)
+            if deadline is not None and self.clock() + wait > deadline:
+                return False
+            time.sleep(wait)
+        return True
+
+    @property
+    def tokens(self) -> float:
+        with self._lock:
+            self._refill(self.clock())
+            return self._tokens
@@ -0,0 +1,156 @@
+"""監視開始ジョブのスケジューラ（ヒープ）と、通勤の繰り返し設定"""
+
+import heapq
+import itertools
+import threading
+from datetime import datetime, timedelta
+
+from clock import SYSTEM_CLOCK
+from logs import get_logger
+
+log = get_logger("scheduler")
+
+# ================================================================
+#  繰り返し
+# ================================================================
+
+ONCE, DAILY, WEEKDAY, WEEKEND = "once", "daily", "weekday", "weekend"
+
+REPEAT_LABELS = {
+    ONCE: "今回のみ",
+    DAILY: "毎日",
+    WEEKDAY: "平日（月〜金）",
+    WEEKEND: "土日",
+}
+
+
+def runs_on(repeat: str, day) -> bool:
+    if repeat == WEEKDAY:
+        return day.weekday() < 5
+    if repeat == WEEKEND:
+        return day.weekday() >= 5
+    return True
+
+
+def next_departure(time_of_day, now: datetime, repeat: str = ONCE, grace: timedelta = timedelta(0)) -> datetime:
+    """now 以降で最初の発車時刻（繰り返し条件に合う日）
+
+    発車時刻 + grace が now より前なら翌日以降に繰り越す（日付をまたぐ場合も含む）。
+    """
+    for days in range(8):
+        dep = datetime.combine(now.date() + timedelta(days=days), time_of_day)
+        if dep + grace > now and runs_on(repeat, dep):
+            return dep
+    raise ValueError(f"unknown repeat: {repeat}")
+
+# ================================================================
+#  ジョブスケジューラ
+# ================================================================
+
+class JobScheduler:
+    """実行時刻のヒープで管理するワンショットのジョブスケジューラ
+
+    - 登録 O(log n)、取り消しは O(1)（ヒープ上のエントリは取り出し時に読み捨てる）
+    - スレッドは 1 本で、次のジョブの時刻まで Condition で眠る（待機中は CPU を使わない）
+    - 繰り返しは呼び出し側がジョブの中で次回分を登録して表現する
+    - threaded=False ならスレッドを起動しない（run_pending を呼ぶ側が時刻を進める。シミュレーション用）
+    """
+
+    def __init__(self, clock=SYSTEM_CLOCK, threaded: bool = True):
+        self.clock = clock
+        self.threaded = threaded
+        self._heap = []      # (run_at, job_id)
+        self._jobs = {}      # job_id -> (run_at, callback)
+        self._ids = itertools.count(1)
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def add(self, run_at: datetime, callback) -> int:
+        with self._cond:
+            job_id = next(self._ids)
+            self._jobs[job_id] = (run_at, callback)
+            heapq.heappush(self._heap, (run_at, job_id))
+            if self._heap[0][1] == job_id:
+                self._cond.notify()
+        self.start()
+        return job_id
+
+    def add_many(self, jobs) -> list:
+        """(run_at, callback) をまとめて登録する（起動時の復元用。heapify で O(n)）"""
+        with self._cond:
+            ids = []
+            for run_at, callback in jobs:
+                job_id = next(self._ids)
+                self._jobs[job_id] = (run_at, callback)
+                self._heap.append((run_at, job_id))
+                ids.append(job_id)
+            heapq.heapify(self._heap)
+            self._cond.notify()
+        self.start()
+        return ids
+
+    def cancel(self, job_id) -> bool:
+        with self._cond:
+            if self._jobs.pop(job_id, None) is None:
+                return False
+            # 取り消し済みエントリがヒープの半分を超えたら作り直す
+            if len(self._heap) > 64 and len(self._heap) > 2 * len(self._jobs):
+                self._heap = [(t, j) for t, j in self._heap if j in self._jobs]
+                heapq.heapify(self._heap)
+            return True
+
+    def run_at(self, job_id):
+        job = self._jobs.get(job_id)
+        return job[0] if job else None
+
+    def next_due(self):
+        with self._cond:
+            self._drop_cancelled()
+            return self._heap[0][0] if self._heap else None
+
+    def _drop_cancelled(self):
+        while self._heap and self._heap[0][1] not in self._jobs:
+            heapq.heappop(self._heap)
+
+    def pop_due(self, now: datetime):
+        """now までに期限が来たジョブを取り出して callback のリストを返す"""
+        due = []
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now:
+                _, job_id = heapq.heappop(self._heap)
+                job = self._jobs.pop(job_id, None)
+                if job:
+                    due.append(job[1])
+        return due
+
+    def run_pending(self, now: datetime = None):
+        for callback in self.pop_due(now or self.clock.now()):
+            try:
+                callback()
+            except Exception as e:
+                log.error("scheduler.job_error", error=e)
+
+    # ------------------------------------------------------------
+    #  スレッド
+    # ------------------------------------------------------------
+
+    def start(self):
+        with self._cond:
+            if not self.threaded or (self._thread and self._thread.is_alive()):
+                return
+            self._thread = threading.Thread(target=self._run, name="job-scheduler", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    self._drop_cancelled()
+                    now = self.clock.now()
+                    if self._heap and self._heap[0][0] <= now:
+                        break
+                    self._cond.wait(None if not self._heap else (self._heap[0][0] - now).total_seconds())
+            self.run_pending()
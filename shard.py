@@ -0,0 +1,343 @@
+"""監視する路線の分担（複数の監視ワーカープロセスへコンシステントハッシュで振り分ける）
+
+イベント処理を担当するプロセスは監視対象を ShardRegistry（SQLite）に書くだけで、
+実際のポーリングは ShardMember を動かす監視ワーカーが路線 (stopCdFrom, stopCdTo) ごとに分担する。
+
+- 生きているワーカー（ハートビートが ttl 秒以内）でハッシュリングを作り、路線の担当を決める
+- 路線はリース（期限付きの排他）を取ったワーカーだけがポーリングする。担当が替わるときは
+  旧担当が取得中のポーリングを終えてからリースを返し、新担当はそれを待って引き継ぐ（二重に送らない）
+- 担当が落ちるとリースが切れ、残りのワーカーが ttl 秒以内に引き継ぐ
+- 最後に通知したレコードも SQLite に書くので、引き継いだワーカーは同じ内容を送り直さない
+"""
+
+import bisect
+import hashlib
+import itertools
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from logs import get_logger
+
+log = get_logger("shard")
+
+
+def _hash(key: str) -> int:
+    # crc32 は似たキー（"w0#1", "w0#2" ...）で偏るので md5 の先頭 8 バイトを使う
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+def route_key(route) -> str:
+    return f"{route[0]}-{route[1]}"
+
+
+class HashRing:
+    """仮想ノード付きのコンシステントハッシュ（ワーカーの増減で動く路線は 1/n 程度）"""
+
+    def __init__(self, members=(), vnodes: int = 160):
+        self.vnodes = vnodes
+        self.members = tuple(sorted(members))
+        points = sorted((_hash(f"{m}#{i}"), m) for m in self.members for i in range(vnodes))
+        self._hashes = [h for h, _ in points]
+        self._owners = [m for _, m in points]
+
+    def owner(self, route):
+        if not self._hashes:
+            return None
+        i = bisect.bisect(self._hashes, _hash(route_key(route))) % len(self._hashes)
+        return self._owners[i]
+
+# ================================================================
+#  共有ストア
+# ================================================================
+
+class ShardRegistry:
+    """監視ワーカー間で共有する状態（同じマシン上の SQLite ファイル）
+
+    members:  監視ワーカーとハートビート時刻
+    watches:  監視中の利用者（イベント処理側が書き、監視ワーカーが読む）
+    leases:   路線ごとの担当ワーカーとリース期限
+    notified: 利用者ごとに最後に通知した ApproachRecord
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._conn as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS members (worker TEXT PRIMARY KEY, heartbeat REAL NOT NULL)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS watches ("
+                " user_id TEXT PRIMARY KEY, route TEXT NOT NULL, departure TEXT NOT NULL, end_time TEXT NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS leases ("
+                " route TEXT PRIMARY KEY, worker TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS notified (user_id TEXT PRIMARY KEY, record TEXT NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('watch_version', 0)")
+
+    @property
+    def _conn(self):
+        """スレッドごとの接続"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    # ------------------------------------------------------------
+    #  監視対象（イベント処理側）
+    # ------------------------------------------------------------
+
+    def publish(self, user_id, route, departure_time: datetime, end_time: datetime):
+        with self._conn as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO watches (user_id, route, departure, end_time) VALUES (?, ?, ?, ?)",
+                (user_id, json.dumps(list(route)), departure_time.isoformat(), end_time.isoformat()),
+            )
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'watch_version'")
+
+    def unpublish(self, user_id):
+        with self._conn as conn:
+            conn.execute("DELETE FROM watches WHERE user_id = ?", (user_id,))
+            conn.execute("DELETE FROM notified WHERE user_id = ?", (user_id,))
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'watch_version'")
+
+    def clear_watches(self):
+        """イベント処理の担当が替わったとき、保存済みの状態から作り直す前に呼ぶ"""
+        with self._conn as conn:
+            conn.execute("DELETE FROM watches")
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'watch_version'")
+
+    def watch_version(self) -> int:
+        return self._conn.execute("SELECT value FROM meta WHERE key = 'watch_version'").fetchone()[0]
+
+    def load_watches(self):
+        """route -> {user_id: (departure_time, end_time)}"""
+        out = {}
+        for user_id, route, dep, end in self._conn.execute("SELECT user_id, route, departure, end_time FROM watches"):
+            out.setdefault(tuple(json.loads(route)), {})[user_id] = (
+                datetime.fromisoformat(dep), datetime.fromisoformat(end))
+        return out
+
+    # ------------------------------------------------------------
+    #  ワーカーとリース
+    # ------------------------------------------------------------
+
+    def heartbeat(self, worker, now: float, lease_until: float):
+        """ハートビートを書き、持っているリースを延長する"""
+        with self._conn as conn:
+            conn.execute("INSERT OR REPLACE INTO members (worker, heartbeat) VALUES (?, ?)", (worker, now))
+            conn.execute("UPDATE leases SET expires = ? WHERE worker = ?", (lease_until, worker))
+
+    def live_members(self, since: float):
+        rows = self._conn.execute("SELECT worker FROM members WHERE heartbeat >= ?", (since,))
+        return tuple(sorted(w for (w,) in rows))
+
+    def leave(self, worker):
+        with self._conn as conn:
+            conn.execute("DELETE FROM leases WHERE worker = ?", (worker,))
+            conn.execute("DELETE FROM members WHERE worker = ?", (worker,))
+
+    def acquire(self, route, worker, now: float, lease_until: float) -> bool:
+        """空いている（または期限切れの）リースを取る"""
+        key = route_key(route)
+        with self._conn as conn:
+            conn.execute("DELETE FROM leases WHERE route = ? AND expires < ?", (key, now))
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO leases (route, worker, expires) VALUES (?, ?, ?)", (key, worker, lease_until))
+            return cur.rowcount == 1
+
+    def release(self, route, worker):
+        with self._conn as conn:
+            conn.execute("DELETE FROM leases WHERE route = ? AND worker = ?", (route_key(route), worker))
+
+    def lease_owners(self):
+        """route_key -> worker（ベンチマーク・状態表示用）"""
+        return dict(self._conn.execute("SELECT route, worker FROM leases"))
+
+    # ------------------------------------------------------------
+    #  最後に通知した内容
+    # ------------------------------------------------------------
+
+    def save_notified(self, user_id, record):
+        with self._conn as conn:
+            conn.execute("INSERT OR REPLACE INTO notified (user_id, record) VALUES (?, ?)",
+                         (user_id, json.dumps(list(record), ensure_ascii=False)))
+
+    def load_notified(self, user_ids):
+        """user_id -> レコードの値のリスト（無い利用者は含まない）"""
+        user_ids = list(user_ids)
+        out = {}
+        for i in range(0, len(user_ids), 500):
+            chunk = user_ids[i:i + 500]
+            rows = self._conn.execute(
+                f"SELECT user_id, record FROM notified WHERE user_id IN ({','.join('?' * len(chunk))})", chunk)
+            out.update((uid, json.loads(rec)) for uid, rec in rows)
+        return out
+
+# ================================================================
+#  イベント処理側: MonitorEngine の代わりに監視対象を書く
+# ================================================================
+
+class ShardPublisher:
+    """MonitorEngine と同じ watch / unwatch を持ち、監視対象を ShardRegistry に書く
+
+    監視時間の終了（on_finish）はこのプロセスの JobScheduler で呼ぶ。
+    """
+
+    def __init__(self, registry: ShardRegistry, scheduler, on_finish):
+        self.registry = registry
+        self.scheduler = scheduler
+        self.on_finish = on_finish
+        self.watches = {}    # user_id -> (登録の通し番号, 終了ジョブの ID)
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def watch(self, user_id, route, departure_time, end_time, now=None):
+        self.unwatch(user_id)
+        self.registry.publish(user_id, route, departure_time, end_time)
+        seq = next(self._seq)
+        with self._lock:
+            self.watches[user_id] = (seq, self.scheduler.add(end_time, lambda: self._expire(user_id, seq)))
+
+    def unwatch(self, user_id):
+        with self._lock:
+            entry = self.watches.pop(user_id, None)
+        if entry is None:
+            return False
+        self.scheduler.cancel(entry[1])
+        self.registry.unpublish(user_id)
+        return True
+
+    def is_watching(self, user_id):
+        return user_id in self.watches
+
+    def _expire(self, user_id, seq):
+        with self._lock:
+            entry = self.watches.get(user_id)
+            if entry is None or entry[0] != seq:
+                return
+            del self.watches[user_id]
+        self.registry.unpublish(user_id)
+        self.on_finish(user_id)
+
+# ================================================================
+#  監視ワーカー側
+# ================================================================
+
+class ShardMember:
+    """ハッシュリングで自分の担当になった路線だけを MonitorEngine に登録する
+
+    interval 秒ごとにハートビートを書き、ワーカーの増減や監視対象の変化に合わせて路線を取り直す。
+    on_acquire(user_ids) は利用者を engine に登録する前、on_release(user_ids) は手放した後に呼ぶ。
+    """
+
+    _ids = itertools.count()
+
+    def __init__(self, registry: ShardRegistry, engine, worker_id: str = None, interval: float = 1.0,
+                 ttl: float = 5.0, on_acquire=None, on_release=None):
+        self.registry = registry
+        self.engine = engine
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{next(self._ids)}"
+        self.interval = interval
+        self.ttl = ttl
+        self.on_acquire = on_acquire
+        self.on_release = on_release
+        self.owned = set()        # リースを持っている路線
+        self.ring = HashRing()
+        self._watches = {}        # route -> {user_id: (departure_time, end_time)}
+        self._seen = None         # (members, watch_version)
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {"acquired": 0, "released": 0, "rebalances": 0}
+
+    def start(self):
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, name="shard-member", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """持っている路線をすべて手放して抜ける（残りのワーカーがすぐ引き継ぐ）"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self._release(set(self.owned), wait=True)
+        self.registry.leave(self.worker_id)
+
+    def join(self):
+        self._stop.wait()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.tick()
+            except Exception as e:
+                log.error("shard.tick_error", worker=self.worker_id, error=e)
+            self._stop.wait(self.interval)
+
+    # ------------------------------------------------------------
+    #  振り分け
+    # ------------------------------------------------------------
+
+    def tick(self, now: float = None):
+        now = now or time.time()
+        reg = self.registry
+        reg.heartbeat(self.worker_id, now, now + self.ttl)
+
+        seen = (reg.live_members(now - self.ttl), reg.watch_version())
+        if seen != self._seen:
+            if seen[0] != self.ring.members:
+                self.ring = HashRing(seen[0])
+                self.stats["rebalances"] += 1
+            self._watches = reg.load_watches()
+            self._seen = seen
+
+        wall = datetime.now()
+        desired = {route for route, users in self._watches.items()
+                   if self.ring.owner(route) == self.worker_id
+                   and any(end > wall for _, end in users.values())}
+
+        self._release(self.owned - desired)
+        for route in desired - self.owned:
+            if reg.acquire(route, self.worker_id, now, now + self.ttl):
+                self.owned.add(route)
+                self.stats["acquired"] += 1
+        for route in self.owned & desired:
+            self._sync_route(route, self._watches[route], wall)
+
+    def _sync_route(self, route, wanted, wall):
+        have = set(self.engine.users_of(route))
+        for uid in have - wanted.keys():
+            self.engine.unwatch(uid)
+        new = [uid for uid in wanted.keys() - have if wanted[uid][1] > wall]
+        if not new:
+            return
+        if self.on_acquire:
+            self.on_acquire(new)
+        for uid in new:
+            dep, end = wanted[uid]
+            self.engine.watch(uid, route, dep, end)
+
+    def _release(self, routes, wait=False):
+        """engine から外し、取得中のポーリングが終わった路線からリースを返す"""
+        for route in routes:
+            users = self.engine.users_of(route)
+            for uid in users:
+                self.engine.unwatch(uid)
+            if users and self.on_release:
+                self.on_release(users)
+            while wait and self.engine.is_polling(route):
+                time.sleep(0.01)
+            if self.engine.is_polling(route):
+                continue   # 次の tick で返す（それまでリースは延長される）
+            self.registry.release(route, self.worker_id)
+            self.owned.discard(route)
+            self.stats["released"] += 1
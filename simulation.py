@@ -0,0 +1,165 @@
+"""仮想時計のシミュレーション（1 日分の通勤時間帯を数秒で再生する）
+
+app の時計・JobScheduler・MonitorEngine・DeliveryQueue を、仮想時計で動くスレッドなしのものに
+差し替え、Bus-Vision の代わりに Replay（路線ごとのページの時系列）を返す。
+次に期限の来るジョブ / ポーリングの時刻まで時計を飛ばして、それを同じスレッドで実行する。
+
+    sim = Simulation(app, replay, start=datetime(2024, 4, 1, 5, 0))
+    with sim:
+        app.user_settings[uid] = {...}
+        app.schedule_bus_check(uid, departure)
+        sim.run_until(end)
+    sim.delivery.sent   # [(仮想時刻, user_id, 本文), ...]
+
+- 上流のレート制限（UpstreamGate）は実時間で待つので外す（リクエスト数は Replay.requests で数える）
+- 利用者の状態（user_settings / user_active_jobs など）はそのまま app のものを使う
+"""
+
+import bisect
+import time
+
+from clock import VirtualClock
+from monitor import AdaptiveCadence, MonitorEngine
+from scheduler import JobScheduler
+
+
+class Replay:
+    """路線ごとのページの時系列。fetch は仮想時計の時刻に表示されていたページを返す
+
+    add(route, at, page) の page は HTML か、render を渡したときはその引数（バスの一覧など）。
+    同じ内容のページは 1 回だけ組み立てる。
+    """
+
+    def __init__(self, render=None, empty: str = None):
+        self.render = render
+        self.empty = empty            # 最初の記録より前 / 記録の無い路線で返すページ
+        self.clock = None             # Simulation が設定する
+        self._times = {}              # route -> [datetime, ...]
+        self._pages = {}              # route -> [page, ...]
+        self._html = {}               # page -> HTML
+        self.requests = 0
+
+    def add(self, route, at, page):
+        times = self._times.setdefault(tuple(route), [])
+        pages = self._pages.setdefault(tuple(route), [])
+        i = bisect.bisect_right(times, at)
+        times.insert(i, at)
+        pages.insert(i, page)
+
+    def routes(self):
+        return list(self._times)
+
+    def _index(self, route, now):
+        return bisect.bisect_right(self._times.get(route, ()), now) - 1
+
+    def changed_at(self, route, now):
+        """now に表示されているページに切り替わった時刻（記録が無ければ None）"""
+        i = self._index(tuple(route), now)
+        return self._times[tuple(route)][i] if i >= 0 else None
+
+    def fetch(self, from_code, to_code):
+        self.requests += 1
+        route = (from_code, to_code)
+        i = self._index(route, self.clock.now())
+        if i < 0:
+            return self.empty
+        page = self._pages[route][i]
+        if self.render is None:
+            return page
+        html = self._html.get(page)
+        if html is None:
+            html = self._html[page] = self.render(page)
+        return html
+
+
+class RecordingDelivery:
+    """LINE へ送る代わりに (仮想時刻, user_id, 本文) を記録する（DeliveryQueue と同じ push / depth）"""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.sent = []
+        self.stats = {}
+
+    def push(self, user_id, message):
+        self.sent.append((self.clock.now(), user_id, message.text))
+
+    def depth(self):
+        return 0
+
+
+class Simulation:
+    """app の監視部分を仮想時計で動かす（with の間だけ差し替え、抜けると元に戻す）"""
+
+    def __init__(self, app, replay: Replay, start):
+        self.app = app
+        self.replay = replay
+        self.clock = replay.clock = VirtualClock(start)
+        self.delivery = RecordingDelivery(self.clock)
+        self.scheduler = JobScheduler(self.clock, threaded=False)
+        # ポーリング間隔の決め方は app の設定をそのまま使う（路線ごとの状態は持ち越さない）
+        base = app.monitor_engine
+        cadence = base.cadence and AdaptiveCadence(
+            base.cadence.min_interval, base.cadence.max_interval, base.cadence.per_stop,
+            base.cadence.budget_per_min,
+        )
+        self.engine = MonitorEngine(
+            fetch=replay.fetch,
+            parse=app.bus_session.parse_snapshot,
+            deliver=app.notify_bus_info,
+            on_finish=app.finish_bus_check,
+            interval=base.interval.total_seconds(),
+            cadence=cadence,
+            clock=self.clock,
+            threaded=False,
+        )
+        self.steps = 0
+        self.polls = 0
+        self.scheduler_seconds = 0.0   # 実時間: ジョブ（監視開始の登録など）
+        self.engine_seconds = 0.0      # 実時間: ポーリング（解析と配信を含む）
+        self._saved = None
+
+    def __enter__(self):
+        names = ("clock", "job_scheduler", "monitor_engine", "delivery")
+        self._saved = {n: getattr(self.app, n) for n in names}
+        self.app.clock = self.clock
+        self.app.job_scheduler = self.scheduler
+        self.app.monitor_engine = self.engine
+        self.app.delivery = self.delivery
+        return self
+
+    def __exit__(self, *exc):
+        for name, value in self._saved.items():
+            setattr(self.app, name, value)
+
+    def next_due(self):
+        dues = [d for d in (self.scheduler.next_due(), self.engine.next_due()) if d is not None]
+        return min(dues) if dues else None
+
+    def run_until(self, end):
+        """end まで、期限の来たものを時刻順に実行しながら時計を進める"""
+        while True:
+            due = self.next_due()
+            if due is None or due > end:
+                break
+            if due > self.clock.now():
+                self.clock.set(due)
+            now = self.clock.now()
+            self.steps += 1
+            t0 = time.perf_counter()
+            self.scheduler.run_pending(now)
+            t1 = time.perf_counter()
+            self.polls += self.engine.run_pending(now)
+            self.scheduler_seconds += t1 - t0
+            self.engine_seconds += time.perf_counter() - t1
+        if end > self.clock.now():
+            self.clock.set(end)
+
+    def stats(self):
+        return {
+            "steps": self.steps,
+            "polls": self.polls,
+            "upstream_requests": self.replay.requests,
+            "notifications": len(self.delivery.sent),
+            "scheduler_seconds": round(self.scheduler_seconds, 3),
+            "engine_seconds": round(self.engine_seconds, 3),
+        }
@@ -0,0 +1,87 @@
+"""接近情報のスナップショット（バスごとの小さな不変レコード）と差分検出"""
+
+import re
+from typing import NamedTuple, Optional
+
+_DIGITS_RE = re.compile(r"\d+")
+
+
+class ApproachRecord(NamedTuple):
+    """approachData 1 件分。表示用の文字列は通知するときにだけ作る"""
+
+    rank: int        # 何番目に来るバスか（span#number）
+    time: str        # 通過時刻（"08:12"）
+    stop: str        # 最後に通過した停留所
+    pass_info: str   # 残り停留所数などの表示（"2つ前"）
+
+    @property
+    def stops_away(self) -> Optional[int]:
+        m = _DIGITS_RE.search(self.pass_info)
+        return int(m.group()) if m else None
+
+
+def lead(snapshot) -> Optional[ApproachRecord]:
+    """先頭（number=1）のバス"""
+    for r in snapshot or ():
+        if r.rank == 1:
+            return r
+    return None
+
+
+def format_record(r: ApproachRecord) -> str:
+    return f"🚎 {r.time}\n{r.stop}を通過\n（{r.pass_info}）"
+
+# ================================================================
+#  差分イベント
+# ================================================================
+
+class BusAppeared(NamedTuple):
+    """新しいバスが接近情報に現れた"""
+    bus: ApproachRecord
+
+
+class BusPassedStop(NamedTuple):
+    """同じバスが次の停留所を通過した"""
+    before: ApproachRecord
+    after: ApproachRecord
+
+
+class BusDeparted(NamedTuple):
+    """バスが乗車停留所を過ぎて接近情報から消えた"""
+    bus: ApproachRecord
+
+
+def _farther(before: ApproachRecord, after: ApproachRecord) -> bool:
+    a, b = before.stops_away, after.stops_away
+    return a is not None and b is not None and b > a
+
+
+def diff_snapshots(old, new):
+    """同じ路線の前回と今回のスナップショットを比べてイベントのリストを返す
+
+    バスを識別する ID はページに無いので順位で対応付ける。先頭のバスが消えた
+    （または今回の先頭の方が遠い）ときは 1 台発車したとみなし、順位を 1 つずらして比べる。
+    """
+    old, new = old or (), new or ()
+    if old == new:
+        return []
+
+    events = []
+    old_by_rank = {r.rank: r for r in old}
+    old_lead, new_lead = lead(old), lead(new)
+
+    shift = 0
+    if old_lead and (new_lead is None or _farther(old_lead, new_lead)):
+        events.append(BusDeparted(old_lead))
+        del old_by_rank[old_lead.rank]
+        shift = 1
+
+    for r in new:
+        before = old_by_rank.pop(r.rank + shift, None)
+        if before is None:
+            events.append(BusAppeared(r))
+        elif before[1:] != r[1:]:
+            events.append(BusPassedStop(before, r))
+
+    events.extend(BusDeparted(r) for r in old_by_rank.values())
+    return events
@@ -0,0 +1,281 @@
+"""利用者の状態（設定・対話状態・監視予定など）の永続化
+
+書き込みはキューに溜めて専用スレッドでまとめて反映する（Webhook や監視の処理でディスクを待たない）。
+同じキーへの書き込みは 1 回にまとまる。再起動時は table() で全件を読み戻す。
+
+同じ利用者の状態を複数のスレッド（Webhook のワーカーと監視・スケジューラ）が読み書きするときは
+store.lock(key) で排他する。ロックはキーのハッシュで選ぶストライプで、全体を止めるロックは無い。
+値の読み込み・変更・保存をまとめて行うなら StateTable.modify(key, fn)。
+"""
+
+import json
+import sqlite3
+import threading
+from datetime import datetime
+
+from logs import get_logger
+
+log = get_logger("state_store")
+
+
+def _default(o):
+    if isinstance(o, datetime):
+        return {"$dt": o.isoformat()}
+    raise TypeError(f"保存できない型です: {type(o).__name__}")
+
+
+def _object_hook(d):
+    if len(d) == 1 and "$dt" in d:
+        return datetime.fromisoformat(d["$dt"])
+    return d
+
+
+# json.dumps / loads に引数を渡すと毎回エンコーダを作るので使い回す（起動時に数十万件読むため）
+_encoder = json.JSONEncoder(default=_default, ensure_ascii=False, separators=(",", ":"))
+_decoder = json.JSONDecoder(object_hook=_object_hook)
+
+
+def dumps(value) -> str:
+    """JSON 文字列にする（datetime も可。tuple は list になる）"""
+    return _encoder.encode(value)
+
+
+def loads(text: str):
+    return _decoder.decode(text)
+
+# ================================================================
+#  ロック
+# ================================================================
+
+class StripedLock:
+    """キーごとの排他（stripes 本の RLock のどれかをキーのハッシュで選ぶ）
+
+    キーの数だけロックを作らずに済み、別のキーどうしはほとんど待たない（同じストライプに
+    当たったときだけ待つ）。RLock なので同じスレッドの中では入れ子にできる。
+    """
+
+    def __init__(self, stripes: int = 256):
+        self._locks = [threading.RLock() for _ in range(stripes)]
+
+    def __len__(self):
+        return len(self._locks)
+
+    def __call__(self, key):
+        return self._locks[hash(key) % len(self._locks)]
+
+# ================================================================
+#  テーブル
+# ================================================================
+
+class StateTable(dict):
+    """変更を StateStore に書き戻す dict
+
+    代入・削除は自動で保存される。値（dict）の中身だけを書き換えたときは save(key) を呼ぶ。
+    encode / decode で保存する形と読み戻した形を変換できる。
+    ほかのスレッドも同じキーを書き換えるなら modify(key, fn) か、store.lock(key) の中で読み書きする。
+    """
+
+    def __init__(self, store, name: str, encode=None, decode=None):
+        super().__init__()
+        self.store = store
+        self.name = name
+        self.encode = encode
+        self.decode = decode
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.save(key)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.store.write(self.name, key, None)
+
+    def pop(self, key, *default):
+        found = key in self
+        value = super().pop(key, *default)
+        if found:
+            self.store.write(self.name, key, None)
+        return value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        for key in list(self):
+            del self[key]
+
+    def modify(self, key, fn):
+        """key の値を fn(今の値 or None) の結果に置き換えて返す（None なら削除）
+
+        store.lock(key) の中で行うので、同じキーへのほかの modify や lock の中の読み書きと混ざらない。
+        fn には今の値をそのまま渡す。書き換えずに新しい値を返せば、ロックの外で読んでいる側も
+        途中の状態を見ない。
+        """
+        with self.store.lock(key):
+            value = fn(dict.get(self, key))
+            if value is None:
+                self.pop(key, None)
+            else:
+                self[key] = value
+            return value
+
+    def save(self, key):
+        value = super().__getitem__(key)
+        self.store.write(self.name, key, dumps(self.encode(value) if self.encode else value))
+
+    def _load(self, rows):
+        decode = self.decode
+        if decode:
+            dict.update(self, ((key, decode(loads(text))) for key, text in rows))
+        else:
+            dict.update(self, ((key, loads(text)) for key, text in rows))
+
+# ================================================================
+#  ストア
+# ================================================================
+
+class StateStore:
+    """書き込みを溜めて flush_interval 秒ごと（batch_size 件たまったらすぐ）に 1 トランザクションで書く
+
+    保存先は _load / _apply を実装したサブクラスが決める。
+    """
+
+    def __init__(self, flush_interval: float = 0.5, batch_size: int = 5000, lock_stripes: int = 256):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.lock = StripedLock(lock_stripes)   # lock(key) -> そのキーの RLock（テーブルをまたいで共通）
+        self._pending = {}   # (table, key) -> JSON 文字列（None は削除）
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()   # バッチを取り出した順に書く
+        self._thread = None
+        self._closed = False
+        self.stats = {"writes": 0, "batches": 0}
+
+    def table(self, name: str, encode=None, decode=None) -> StateTable:
+        t = StateTable(self, name, encode, decode)
+        with self._write_lock:
+            t._load(self._load(name))
+        return t
+
+    def write(self, table: str, key, text):
+        with self._cond:
+            self._pending[(table, key)] = text
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+        self.start()
+
+    def pending(self):
+        return len(self._pending)
+
+    def flush(self):
+        """溜まっている書き込みを今すぐ反映する"""
+        with self._write_lock:
+            with self._cond:
+                batch, self._pending = self._pending, {}
+            if batch:
+                self._apply(batch)
+                self.stats["writes"] += len(batch)
+                self.stats["batches"] += 1
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self.flush()
+
+    # ------------------------------------------------------------
+    #  スレッド
+    # ------------------------------------------------------------
+
+    def start(self):
+        with self._cond:
+            if self._closed or (self._thread and self._thread.is_alive()):
+                return
+            self._thread = threading.Thread(target=self._run, name="state-store", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if len(self._pending) < self.batch_size and not self._closed:
+                    self._cond.wait(self.flush_interval)
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except Exception as e:
+                log.error("state_store.write_error", error=e)
+
+    # ------------------------------------------------------------
+    #  保存先
+    # ------------------------------------------------------------
+
+    def _load(self, table: str):
+        """(key, JSON 文字列) を返す"""
+        raise NotImplementedError
+
+    def _apply(self, batch: dict):
+        raise NotImplementedError
+
+
+class MemoryStore(StateStore):
+    """プロセス内だけで持つストア（テスト・ベンチマーク用）"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.rows = {}
+
+    def _load(self, table):
+        return [(k, v) for (t, k), v in self.rows.items() if t == table]
+
+    def _apply(self, batch):
+        for k, v in batch.items():
+            if v is None:
+                self.rows.pop(k, None)
+            else:
+                self.rows[k] = v
+
+
+class SQLiteStore(StateStore):
+    """SQLite（WAL）に保存するストア。書き込みは専用スレッドから、読み込みは起動時だけ"""
+
+    def __init__(self, path: str, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS state ("
+            " tbl TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+            " PRIMARY KEY (tbl, key)) WITHOUT ROWID"
+        )
+        self._conn.commit()
+
+    def _load(self, table):
+        return self._conn.execute("SELECT key, value FROM state WHERE tbl = ?", (table,)).fetchall()
+
+    def _apply(self, batch):
+        upserts = [(t, k, v) for (t, k), v in batch.items() if v is not None]
+        deletes = [(t, k) for (t, k), v in batch.items() if v is None]
+        with self._conn:
+            self._conn.executemany("DELETE FROM state WHERE tbl = ? AND key = ?", deletes)
+            self._conn.executemany("INSERT OR REPLACE INTO state (tbl, key, value) VALUES (?, ?, ?)", upserts)
+
+    def close(self):
+        super().close()
+        with self._write_lock:
+            self._conn.close()
+
+
+def open_store(url: str, **kwargs) -> StateStore:
+    """"memory" ならプロセス内、それ以外は SQLite ファイルのパス"""
+    if url in ("memory", ":memory:"):
+        return MemoryStore(**kwargs)
+    return SQLiteStore(url, **kwargs)
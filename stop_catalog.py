@@ -0,0 +1,245 @@
+"""停留所マスタ（CSV / JSON）の読み込みと、mmap で共有できるバイナリ形式へのコンパイル
+
+初回（またはマスタ更新後）の起動時だけ CSV / JSON を読み、名前順に並べた固定長レコード +
+文字列ブロブのバイナリファイルに書き出す。以降の起動ではそのファイルを mmap するだけなので、
+停留所が数万件あっても dict を作らず、複数のワーカープロセスで同じページを共有できる。
+"""
+
+import bisect
+import csv
+import json
+import math
+import mmap
+import os
+import struct
+import tempfile
+from typing import NamedTuple, Optional
+
+from logs import get_logger
+
+log = get_logger("stop_catalog")
+
+MAGIC = b"STOPCAT1"
+# magic, 件数, 元ファイルのサイズ, 元ファイルの mtime_ns, 文字列ブロブの開始位置
+_HEADER = struct.Struct("<8sIQQI")
+# name(off, len), code(off, len), reading(off, len), lat, lon, popular（0 = 人気の停留所ではない）
+_RECORD = struct.Struct("<IHIHIHffH")
+_INDEX = struct.Struct("<I")
+
+
+class Stop(NamedTuple):
+    name: str
+    code: str
+    reading: str
+    lat: Optional[float]
+    lon: Optional[float]
+    popular: int
+
+
+# ================================================================
+#  マスタの読み込み
+# ================================================================
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def read_master(path: str):
+    """CSV / JSON の停留所マスタを Stop のリストにする（列: name, code, reading, lat, lon, popular）"""
+    if path.endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            rows = json.load(f)
+    else:
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            rows = list(csv.DictReader(f))
+
+    stops = []
+    for row in rows:
+        name, code = (row.get("name") or "").strip(), str(row.get("code") or "").strip()
+        if not (name and code):
+            continue
+        stops.append(Stop(
+            name=name,
+            code=code,
+            reading=(row.get("reading") or "").strip(),
+            lat=_float(row.get("lat")),
+            lon=_float(row.get("lon")),
+            popular=int(row.get("popular") or 0),
+        ))
+    return stops
+
+# ================================================================
+#  コンパイル
+# ================================================================
+
+def compile_catalog(stops, out_path: str, source_size: int = 0, source_mtime_ns: int = 0):
+    """Stop のリストをバイナリ形式で書き出す（一時ファイル経由で置き換えるので並行起動でも安全）"""
+    by_name = {}
+    for s in stops:
+        by_name.setdefault(s.name, s)
+    ordered = sorted(by_name.values(), key=lambda s: s.name.encode("utf-8"))
+
+    blob = bytearray()
+    records = bytearray()
+
+    def put(text):
+        data = text.encode("utf-8")
+        off = len(blob)
+        blob.extend(data)
+        return off, len(data)
+
+    nan = float("nan")
+    for s in ordered:
+        records += _RECORD.pack(
+            *put(s.name), *put(s.code), *put(s.reading),
+            nan if s.lat is None else s.lat,
+            nan if s.lon is None else s.lon,
+            s.popular,
+        )
+
+    # コード順の並び（レコード番号の配列）
+    by_code = sorted(range(len(ordered)), key=lambda i: ordered[i].code.encode("utf-8"))
+    index = b"".join(_INDEX.pack(i) for i in by_code)
+
+    blob_start = _HEADER.size + len(records) + len(index)
+    header = _HEADER.pack(MAGIC, len(ordered), source_size, source_mtime_ns, blob_start)
+
+    directory = os.path.dirname(out_path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".stops-")
+    with os.fdopen(fd, "wb") as f:
+        f.write(header)
+        f.write(records)
+        f.write(index)
+        f.write(blob)
+    os.replace(tmp, out_path)
+
+# ================================================================
+#  コンパイル済みカタログ
+# ================================================================
+
+class StopCatalog:
+    """mmap したコンパイル済みファイル上で二分探索する停留所カタログ"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count, self.source_size, self.source_mtime_ns, self._blob = _HEADER.unpack_from(self._buf, 0)
+        if magic != MAGIC:
+            raise ValueError(f"停留所カタログの形式が違います: {path}")
+        self._index = _HEADER.size + self._count * _RECORD.size
+        self._popular = None
+
+    def __len__(self):
+        return self._count
+
+    # ------------------------------------------------------------
+    #  低レベルアクセス
+    # ------------------------------------------------------------
+
+    def _record(self, i):
+        return _RECORD.unpack_from(self._buf, _HEADER.size + i * _RECORD.size)
+
+    def _bytes(self, off, length):
+        start = self._blob + off
+        return self._buf[start:start + length]
+
+    def _name_bytes(self, i):
+        return self._bytes(*self._record(i)[0:2])
+
+    def _code_bytes(self, i):
+        return self._bytes(*self._record(i)[2:4])
+
+    def _stop(self, i):
+        n_off, n_len, c_off, c_len, r_off, r_len, lat, lon, popular = self._record(i)
+        return Stop(
+            name=self._bytes(n_off, n_len).decode("utf-8"),
+            code=self._bytes(c_off, c_len).decode("utf-8"),
+            reading=self._bytes(r_off, r_len).decode("utf-8"),
+            lat=None if math.isnan(lat) else lat,
+            lon=None if math.isnan(lon) else lon,
+            popular=popular,
+        )
+
+    class _Keys:
+        """bisect 用の遅延シーケンス"""
+
+        def __init__(self, n, key):
+            self.n, self.key = n, key
+
+        def __len__(self):
+            return self.n
+
+        def __getitem__(self, i):
+            return self.key(i)
+
+    def _find_name(self, name):
+        target = name.encode("utf-8")
+        i = bisect.bisect_left(self._Keys(self._count, self._name_bytes), target)
+        return i if i < self._count and self._name_bytes(i) == target else None
+
+    def _by_code(self, j):
+        return _INDEX.unpack_from(self._buf, self._index + j * _INDEX.size)[0]
+
+    # ------------------------------------------------------------
+    #  検索
+    # ------------------------------------------------------------
+
+    def __contains__(self, name):
+        return isinstance(name, str) and self._find_name(name) is not None
+
+    def code_for(self, name):
+        i = self._find_name(name)
+        return None if i is None else self._code_bytes(i).decode("utf-8")
+
+    def get(self, name) -> Optional[Stop]:
+        i = self._find_name(name)
+        return None if i is None else self._stop(i)
+
+    def name_for(self, code):
+        target = str(code).encode("utf-8")
+        keys = self._Keys(self._count, lambda j: self._code_bytes(self._by_code(j)))
+        j = bisect.bisect_left(keys, target)
+        if j < self._count and keys[j] == target:
+            return self._name_bytes(self._by_code(j)).decode("utf-8")
+        return None
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self._name_bytes(i).decode("utf-8")
+
+    def stops(self):
+        for i in range(self._count):
+            yield self._stop(i)
+
+    def popular(self):
+        """人気の停留所（popular 列の順）"""
+        if self._popular is None:
+            ranked = sorted((self._record(i)[8], i) for i in range(self._count))
+            ranked = [(p, i) for p, i in ranked if p]
+            self._popular = [self._name_bytes(i).decode("utf-8") for _, i in ranked]
+        return list(self._popular)
+
+# ================================================================
+#  入口
+# ================================================================
+
+def load_catalog(source: str, cache_dir: str = None) -> StopCatalog:
+    """マスタを読み込む。コンパイル済みファイルが最新ならそれを mmap するだけ"""
+    st = os.stat(source)
+    cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(source)), ".cache")
+    compiled = os.path.join(cache_dir, os.path.basename(source) + ".bin")
+
+    try:
+        catalog = StopCatalog(compiled)
+        if (catalog.source_size, catalog.source_mtime_ns) == (st.st_size, st.st_mtime_ns):
+            return catalog
+    except (OSError, ValueError, struct.error):
+        pass
+
+    log.info("stop_catalog.compiled", source=source, compiled=compiled)
+    compile_catalog(read_master(source), compiled, st.st_size, st.st_mtime_ns)
+    return StopCatalog(compiled)
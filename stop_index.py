@@ -0,0 +1,133 @@
+"""停留所名の検索インデックス（正規化 + 2-gram 転置インデックス）"""
+
+import unicodedata
+from collections import defaultdict
+
+# 旧字体・異体字など、停留所名で表記ゆれしやすい文字
+_VARIANTS = str.maketrans({
+    "髙": "高", "﨑": "崎", "嵜": "崎", "邊": "辺", "邉": "辺", "齋": "斎", "齊": "斉",
+    "澤": "沢", "嶋": "島", "嶌": "島", "濱": "浜", "廣": "広", "櫻": "桜", "驛": "駅",
+    "國": "国", "舘": "館", "龍": "竜", "藪": "薮", "淵": "渕", "冨": "富",
+    "ヶ": "が", "ヵ": "か", "ゖ": "が", "ゕ": "か",
+    "・": "", " ": "", "-": "",
+})
+
+# 入力に付きがちな語尾と、「駅前」と「駅」の言い換え
+_SUFFIXES = ("バス停", "停留所", "のりば")
+_PHRASES = (("駅前", "駅"), ("えきまえ", "えき"))
+
+
+def _to_hiragana(text: str) -> str:
+    return "".join(chr(ord(c) - 0x60) if "ァ" <= c <= "ヶ" else c for c in text)
+
+
+def normalize(text: str) -> str:
+    """全角/半角・カタカナ/ひらがな・異体字・「駅前」/「駅」の違いを吸収する"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = _to_hiragana(text).translate(_VARIANTS)
+    for suffix in _SUFFIXES:
+        if text.endswith(suffix) and len(text) > len(suffix):
+            text = text[: -len(suffix)]
+    for src, dst in _PHRASES:
+        text = text.replace(src, dst)
+    return text
+
+
+def _grams(key: str):
+    """前後に境界記号を付けた 2-gram（1 文字のキーでも 2 個できる）"""
+    padded = f"\x02{key}\x03"
+    return {padded[i:i + 2] for i in range(len(padded) - 1)}
+
+
+class StopIndex:
+    """停留所名（＋読みなどの別名）を 2-gram 転置インデックスで検索する
+
+    候補は入力の 2-gram を 1 つでも含む名前だけに絞り、完全一致 > 正規化して一致 > 前方一致 > 部分一致 >
+    2-gram の Dice 係数 の順に並べる。部分一致があれば類似度だけの候補は返さない。
+    境界記号付きの 2-gram では名前の途中の 1 文字（「宮」→「外宮前」）や、正規化で変わる部分
+    （「前」→「津駅前」）に当たらないので、入力が 2 文字以下か候補が max_results 件に満たないときは
+    正式名・キーを部分一致で走査して足す（変更前の部分一致検索で出た候補を落とさない）。
+    """
+
+    def __init__(self, stops=None, min_score: float = 0.4):
+        self.min_score = min_score
+        self.names = []                  # 停留所 ID -> 正式名
+        self.by_name = {}                # 正式名 -> 停留所 ID
+        self.keys = []                   # キー ID -> (停留所 ID, 正規化済みキー, 2-gram)
+        self.exact = {}                  # 正規化済みキー -> 停留所 ID
+        self.postings = defaultdict(list)  # 2-gram -> [キー ID, ...]
+        for name, aliases in (stops or ()):
+            self.add(name, aliases)
+
+    @classmethod
+    def from_names(cls, names, **kw):
+        return cls(((n, ()) for n in names), **kw)
+
+    def add(self, name: str, aliases=()):
+        sid = len(self.names)
+        self.names.append(name)
+        self.by_name.setdefault(name, sid)
+        for text in (name, *aliases):
+            if not text:
+                continue
+            key = normalize(text)
+            grams = _grams(key)
+            kid = len(self.keys)
+            self.keys.append((sid, key, grams))
+            self.exact.setdefault(key, sid)
+            for g in grams:
+                self.postings[g].append(kid)
+
+    def __len__(self):
+        return len(self.names)
+
+    # ------------------------------------------------------------
+    #  検索
+    # ------------------------------------------------------------
+
+    def search(self, text: str, max_results: int = 5):
+        if not text:
+            return []
+        if text in self.by_name:
+            return [text]
+
+        query = normalize(text)
+        if not query:
+            return []
+        # 正規化して一致（「ツエキ」→「津駅前」）は先頭に。部分一致の候補も残す（「津駅」と「津」など）
+        best = {self.exact[query]: 4.0} if query in self.exact else {}  # 停留所 ID -> スコア（別名のうち一番良いもの）
+        qgrams = _grams(query)
+        hits = defaultdict(int)
+        for g in qgrams:
+            for kid in self.postings.get(g, ()):
+                hits[kid] += 1
+
+        for kid, common in hits.items():
+            sid, key, grams = self.keys[kid]
+            if key.startswith(query):
+                score = 3.0
+            elif query in key or key in query:
+                score = 2.0
+            else:
+                score = 2.0 * common / (len(grams) + len(qgrams))
+                if score < self.min_score:
+                    continue
+            if score > best.get(sid, 0.0):
+                best[sid] = score
+
+        if len(query) <= 2 or sum(1 for v in best.values() if v >= 2.0) < max_results:
+            self._scan(text, query, best)
+
+        ranked = sorted(best.items(), key=lambda kv: (-kv[1], len(self.names[kv[0]]), kv[0]))
+        if ranked and ranked[0][1] >= 2.0:
+            ranked = [kv for kv in ranked if kv[1] >= 2.0]
+        return [self.names[sid] for sid, _ in ranked[:max_results]]
+
+    def _scan(self, text, query, best):
+        """部分一致の線形走査（正式名は入力のまま、キーは正規化して比べる）"""
+        found = [(sid, name.startswith(text)) for sid, name in enumerate(self.names) if text in name or name in text]
+        found += [(sid, key.startswith(query)) for sid, key, _ in self.keys if query in key or key in query]
+        for sid, prefix in found:
+            score = 3.0 if prefix else 2.0
+            if score > best.get(sid, 0.0):
+                best[sid] = score
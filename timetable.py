@@ -0,0 +1,221 @@
+"""時刻表（Bus-Vision の timetable.html）の取得・解析とローカルキャッシュ
+
+停留所の組 (stopCdFrom, stopCdTo) ごとに 1 日 1 回、利用の少ない時間帯にまとめて取得し、
+SQLite（または "memory"）に保存する。監視ではキャッシュだけを見る（取得しない）。
+
+- 時刻表は曜日の種類（平日 / 土曜 / 日曜・祝日）ごとの発車時刻（0 時からの分）
+- 取得・解析に失敗した組は保存しない（「便が無い」と区別できなくなるので）。失敗するたびに
+  間隔を倍にして（retry_base 秒から retry_max 秒まで）取り直す。on_failure(route) は失敗のたびに呼ぶ
+- 祝日の一覧は持たないので、holidays に渡された日付以外の祝日は曜日どおりに扱う
+"""
+
+import json
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from logs import get_logger
+
+log = get_logger("timetable")
+
+WEEKDAY, SATURDAY, HOLIDAY = "weekday", "saturday", "holiday"
+
+_BLOCK_RE = re.compile(r'<div class="timetableBlock" id="(weekday|saturday|holiday)">(.*?)</table>', re.S)
+_ROW_RE = re.compile(r'<th class="hour">(\d{1,2})</th>\s*<td>(.*?)</td>', re.S)
+_MINUTE_RE = re.compile(r'<span class="minute">(\d{1,2})')
+
+
+def parse_timetable(html: str):
+    """{曜日の種類: (発車時刻（分）, ...)}。時刻表の部分が見つからない・便が 1 つも読めなければ None
+
+    一部の曜日だけ便が無いのは正常（土日運休など）。全部空ならページの作りが変わったとみなす。
+    """
+    if not html:
+        return None
+    table = {}
+    for kind, body in _BLOCK_RE.findall(html):
+        table[kind] = tuple(sorted(
+            int(hour) * 60 + int(minute)
+            for hour, cells in _ROW_RE.findall(body)
+            for minute in _MINUTE_RE.findall(cells)
+        ))
+    return table if any(table.values()) else None
+
+
+def day_type(day, holidays=()) -> str:
+    if day in holidays or day.weekday() == 6:
+        return HOLIDAY
+    return SATURDAY if day.weekday() == 5 else WEEKDAY
+
+
+class TimetableCache:
+    """停留所の組 -> 時刻表。fetch(from_code, to_code) -> HTML（失敗は None）"""
+
+    def __init__(self, path: str, fetch, holidays=(), match: timedelta = timedelta(minutes=10),
+                 retry_base: float = 60.0, retry_max: float = 3600.0, on_failure=None, clock=time.monotonic):
+        self.fetch_page = fetch
+        self.holidays = set(holidays)
+        self.match = match            # 乗車時刻の前後この範囲の便に合わせる
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.on_failure = on_failure
+        self.clock = clock
+        self._tables = {}             # route -> (取得日 "YYYY-MM-DD", 時刻表)
+        self._failed = {}             # route -> (続けて失敗した回数, 次に取りに行ってよい clock())
+        self._pending = set()         # prefetch で取得中の route
+        self._lock = threading.Lock()
+        self._db = None
+        if path not in ("memory", ":memory:"):
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS timetables ("
+                " from_code TEXT, to_code TEXT, fetched_on TEXT, body TEXT,"
+                " PRIMARY KEY (from_code, to_code))"
+            )
+            for a, b, fetched_on, body in self._db.execute("SELECT * FROM timetables"):
+                if body != "null":   # 以前は失敗も保存していた
+                    self._tables[(a, b)] = (fetched_on, json.loads(body))
+            log.info("timetable.loaded", routes=len(self._tables))
+
+    def __len__(self):
+        return len(self._tables)
+
+    def __contains__(self, route):
+        return tuple(route) in self._tables
+
+    # ------------------------------------------------------------
+    #  取得 / 保存
+    # ------------------------------------------------------------
+
+    def put(self, route, table, today):
+        route, fetched_on = tuple(route), today.isoformat()
+        with self._lock:
+            self._tables[route] = (fetched_on, table)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO timetables VALUES (?, ?, ?, ?)",
+                                 (*route, fetched_on, json.dumps(table)))
+                self._db.commit()
+
+    def fetch(self, route, today):
+        """1 組だけ取得して保存する。取得・解析できなければ保存せずに None（例外はそのまま投げる）"""
+        route = tuple(route)
+        try:
+            table = parse_timetable(self.fetch_page(*route))
+        except Exception:
+            self._fail(route)
+            raise
+        if table is None:
+            log.warning("timetable.unavailable", route=route)
+            self._fail(route)
+            return None
+        with self._lock:
+            self._failed.pop(route, None)
+        self.put(route, table, today)
+        return table
+
+    def _fail(self, route):
+        with self._lock:
+            count = self._failed.get(route, (0,))[0] + 1
+            wait = min(self.retry_base * 2 ** (count - 1), self.retry_max)
+            self._failed[route] = (count, self.clock() + wait)
+        log.info("timetable.retry_later", route=route, failures=count, wait=wait)
+        if self.on_failure:
+            self.on_failure(route)
+
+    def due(self, route) -> bool:
+        """取りに行ってよいか（失敗したあと待ち時間が過ぎていなければ False）"""
+        entry = self._failed.get(tuple(route))
+        return entry is None or entry[1] <= self.clock()
+
+    def failed(self):
+        """失敗したまま（まだ取れていない）組"""
+        with self._lock:
+            return list(self._failed)
+
+    def forget(self, route):
+        """失敗した組をもう取り直さない（監視予定が無くなったなど）"""
+        with self._lock:
+            self._failed.pop(tuple(route), None)
+
+    def retry_after(self):
+        """失敗した組のうち一番早く取りに行ってよくなるまでの秒数（失敗が無ければ None）"""
+        with self._lock:
+            if not self._failed:
+                return None
+            return max(0.0, min(at for _, at in self._failed.values()) - self.clock())
+
+    def ensure(self, route, today):
+        """まだ持っていなければ取得する（設定時用。古くても持っていればそれを使う）"""
+        entry = self._tables.get(tuple(route))
+        return entry[1] if entry else self.fetch(route, today)
+
+    def prefetch(self, route, today):
+        """まだ持っていなければ別スレッドで取得する（返信を待たせない。取得中・失敗して待っている間は何もしない）"""
+        route = tuple(route)
+        with self._lock:
+            if route in self._tables or route in self._pending or not self.due(route):
+                return
+            self._pending.add(route)
+
+        def run():
+            try:
+                self.fetch(route, today)
+            except Exception as e:
+                log.warning("timetable.prefetch_error", route=route, error=e)
+            finally:
+                with self._lock:
+                    self._pending.discard(route)
+
+        threading.Thread(target=run, name="timetable-prefetch", daemon=True).start()
+
+    def refresh(self, routes, today, pause: float = 0.0):
+        """今日まだ取得していない組をまとめて取得する（1 件ごとに pause 秒空ける。失敗して待っている組は除く）
+
+        取りに行った件数を返す
+        """
+        stale = [r for r in dict.fromkeys(map(tuple, routes))
+                 if self._tables.get(r, (None,))[0] != today.isoformat() and self.due(r)]
+        for i, route in enumerate(stale):
+            if i and pause:
+                time.sleep(pause)
+            try:
+                self.fetch(route, today)
+            except Exception as e:
+                log.warning("timetable.refresh_error", route=route, error=e)
+        log.info("timetable.refreshed", fetched=len(stale), routes=len(self._tables))
+        return len(stale)
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+
+    # ------------------------------------------------------------
+    #  参照
+    # ------------------------------------------------------------
+
+    def departures(self, route, day):
+        """day の発車時刻（datetime）のリスト。時刻表を持っていなければ None"""
+        entry = self._tables.get(tuple(route))
+        if not entry:
+            return None
+        midnight = datetime.combine(day, datetime.min.time())
+        return [midnight + timedelta(minutes=m) for m in entry[1].get(day_type(day, self.holidays), ())]
+
+    def nearest(self, route, when, after=None):
+        """when の前後 match 以内で一番近い便（after を渡せば after より後の便だけ）
+
+        (便の発車時刻 or None, 時刻表を持っているか)。持っていなければ (None, False)
+        """
+        deps = self.departures(route, when.date())
+        if deps is None:
+            return None, False
+        near = [d for d in deps if abs(d - when) <= self.match and (after is None or d > after)]
+        return (min(near, key=lambda d: abs(d - when)) if near else None), True
+
+    def around(self, route, when):
+        """when の直前と直後の便（警告で候補として見せる）"""
+        deps = self.departures(route, when.date()) or []
+        return [d for d in deps if d < when][-1:] + [d for d in deps if d >= when][:1]
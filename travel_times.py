@@ -0,0 +1,282 @@
+"""バスの通過記録（追記のみのログ）と、それを集計した到着までの所要時間の表
+
+監視中に前回と変わったバスだけを ObservationLog に積み、専用スレッドがまとめてファイルに追記する
+（ポーリングの処理ではディスクを待たない）。1 日に 1 回 aggregate() で過去 window 日分を読み、
+路線・停留所・曜日の種類・時台ごとの「その停留所を通過してから乗車停留所に着くまで」の秒数を
+EtaTable にしておく。通知のときは EtaTable.lookup() で dict を 1 回引くだけ。
+
+ログは 1 日・1 回の起動ごとに 2 ファイル（どちらも追記のみ）:
+
+- YYYYMMDD-<pid>-<run>.obs: 21 バイトの固定長レコード（_RECORD）
+- YYYYMMDD-<pid>-<run>.str: 路線・停留所名（1 行 1 件。レコードは 1 始まりの行番号で参照する）
+
+<run> は開くたびに変わる（同じ日に同じ PID で起動し直しても、前の起動の番号と混ざらない）。
+
+1 レコードは「バスが stop を通過した（prev から来た）」。stop が 0 は乗車停留所に着いた（接近情報から消えた）、
+prev が 0 は接近情報に現れた（前の停留所が分からない）。
+"""
+
+import json
+import os
+import statistics
+import struct
+import threading
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+from logs import get_logger
+from snapshots import BusAppeared, BusDeparted, BusPassedStop
+from timetable import day_type
+
+log = get_logger("travel_times")
+
+# 記録した時刻（epoch 秒）, 路線, 通過した停留所, 前の停留所, 通過時刻（0 時からの分）, 前の通過時刻, 順位
+_RECORD = struct.Struct("<IIIIHHB")
+ARRIVED = 0
+NO_TIME = 0xFFFF
+MAX_SEGMENT = 3 * 3600   # これより長い区間は取り違えとみなして捨てる
+
+
+def minute_of_day(hhmm: str) -> int:
+    """"08:07" -> 487（読めなければ NO_TIME）"""
+    h, _, m = hhmm.partition(":")
+    return int(h) * 60 + int(m) if h.isdigit() and m.isdigit() else NO_TIME
+
+
+def route_key(route) -> str:
+    return route if isinstance(route, str) else "-".join(route)
+
+# ================================================================
+#  ログ
+# ================================================================
+
+class _DayFile:
+    """1 日分のログ（.obs と .str）。文字列の番号はこのファイルの中だけで使う"""
+
+    def __init__(self, directory, day):
+        base = os.path.join(directory, f"{day:%Y%m%d}-{os.getpid()}-{uuid.uuid4().hex[:12]}")
+        self.day = day
+        self.obs = open(base + ".obs", "ab")
+        self.str = open(base + ".str", "a", encoding="utf-8")
+        self.ids = {}
+
+    def close(self):
+        self.obs.close()
+        self.str.close()
+
+
+class ObservationLog:
+    """record() は溜めるだけ。flush_interval 秒ごとに専用スレッドが追記する"""
+
+    def __init__(self, directory: str, flush_interval: float = 1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._pending = []   # (記録した時刻, 路線, 順位, 停留所, 通過時刻, 前の停留所, 前の通過時刻)
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._file = None
+        self._thread = None
+        self._closed = False
+        self.stats = {"records": 0, "bytes": 0}
+        os.makedirs(directory, exist_ok=True)
+
+    def record(self, route, events, now: datetime):
+        """diff_snapshots のイベントから通過記録を作って溜める"""
+        rows = []
+        key = route_key(route)
+        for ev in events:
+            if isinstance(ev, BusPassedStop):
+                b, a = ev.before, ev.after
+                rows.append((now, key, a.rank, a.stop, a.time, b.stop, b.time))
+            elif isinstance(ev, BusAppeared):
+                rows.append((now, key, ev.bus.rank, ev.bus.stop, ev.bus.time, None, None))
+            elif isinstance(ev, BusDeparted):
+                rows.append((now, key, ev.bus.rank, None, None, ev.bus.stop, ev.bus.time))
+        if not rows:
+            return
+        with self._cond:
+            self._pending.extend(rows)
+        self.start()
+
+    def pending(self):
+        return len(self._pending)
+
+    def flush(self):
+        with self._write_lock:
+            with self._cond:
+                rows, self._pending = self._pending, []
+            if rows:
+                self._write(rows)
+
+    def _write(self, rows):
+        out = bytearray()
+        for now, route, rank, stop, passed, prev, prev_passed in rows:
+            f = self._file
+            if f is None or f.day != now.date():
+                if f is not None:
+                    self._sync(f, out)
+                    f.close()
+                f = self._file = _DayFile(self.directory, now.date())
+            out += _RECORD.pack(
+                int(now.timestamp()), self._id(f, route), self._id(f, stop), self._id(f, prev),
+                now.hour * 60 + now.minute if stop is None else minute_of_day(passed),
+                NO_TIME if prev is None else minute_of_day(prev_passed),
+                min(rank, 255),
+            )
+        self._sync(self._file, out)
+        self.stats["records"] += len(rows)
+
+    def _id(self, f, name):
+        if name is None:
+            return 0
+        i = f.ids.get(name)
+        if i is None:
+            i = f.ids[name] = len(f.ids) + 1
+            f.str.write(name.replace("\n", " ") + "\n")
+        return i
+
+    def _sync(self, f, out):
+        # 文字列を先に書く（レコードが先に残って番号だけの行ができないように）
+        f.str.flush()
+        f.obs.write(out)
+        f.obs.flush()
+        self.stats["bytes"] += len(out)
+        out.clear()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def start(self):
+        with self._cond:
+            if self._closed or (self._thread and self._thread.is_alive()):
+                return
+            self._thread = threading.Thread(target=self._run, name="observation-log", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._closed:
+                    self._cond.wait(self.flush_interval)
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except Exception as e:
+                log.error("travel_times.write_error", error=e)
+
+
+def read_day(directory, day):
+    """day のログ（全プロセス分）を (路線, 前の停留所, 停留所, 所要秒, 前の通過の時台) で返す"""
+    prefix = f"{day:%Y%m%d}-"
+    midnight = datetime.combine(day, datetime.min.time()).timestamp()
+    for name in sorted(os.listdir(directory)):
+        if not (name.startswith(prefix) and name.endswith(".obs")):
+            continue
+        base = os.path.join(directory, name[:-4])
+        with open(base + ".str", encoding="utf-8") as f:
+            names = [None] + f.read().split("\n")
+        with open(base + ".obs", "rb") as f:
+            data = f.read()
+        data = data[:len(data) - len(data) % _RECORD.size]   # 書きかけの末尾は読まない
+        for ts, route, stop, prev, passed, prev_passed, _ in _RECORD.iter_unpack(data):
+            if prev == 0 or prev_passed == NO_TIME:
+                continue
+            if stop == ARRIVED:
+                seconds = (ts - midnight) - prev_passed * 60
+            elif passed == NO_TIME:
+                continue
+            else:
+                seconds = (passed - prev_passed) * 60
+            if seconds < 0:
+                seconds += 86400
+            if seconds <= MAX_SEGMENT:
+                yield names[route], names[prev], names[stop] if stop else ARRIVED, seconds, prev_passed // 60 % 24
+
+# ================================================================
+#  集計
+# ================================================================
+
+class EtaTable:
+    """(路線, 通過した停留所, 曜日の種類, 時台) -> 乗車停留所に着くまでの秒数"""
+
+    def __init__(self, eta=None, holidays=(), built_at=None):
+        self.eta = eta or {}
+        self.holidays = set(holidays)
+        self.built_at = built_at
+
+    def __len__(self):
+        return len(self.eta)
+
+    def lookup(self, route, stop, when: datetime):
+        return self.eta.get((route_key(route), stop, day_type(when.date(), self.holidays), when.hour))
+
+    def save(self, path):
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"built_at": self.built_at, "rows": [[*k, v] for k, v in self.eta.items()]},
+                      f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, holidays=()):
+        """保存した表を読む（無ければ空の表）"""
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return cls(holidays=holidays)
+        return cls({tuple(row[:4]): row[4] for row in data["rows"]}, holidays, data.get("built_at"))
+
+
+def aggregate(directory, today, days: int = 28, holidays=()) -> EtaTable:
+    """today の前日までの days 日分のログから EtaTable を作る
+
+    区間 (前の停留所 -> 停留所) の所要秒の中央値を曜日の種類・時台ごとに求め（無ければ
+    曜日の種類ごと、それも無ければ全体の中央値）、各停留所から「次によく通る停留所」を
+    乗車停留所に着くまでたどって足し合わせる。
+    """
+    samples = defaultdict(list)   # (路線, 前, 次, 曜日の種類, 時台) -> [秒]
+    for n in range(1, days + 1):
+        day = today - timedelta(days=n)
+        kind = day_type(day, holidays)
+        for route, prev, stop, seconds, hour in read_day(directory, day):
+            samples[(route, prev, stop, kind, hour)].append(seconds)
+
+    by_hour, by_kind, overall = {}, defaultdict(list), defaultdict(list)
+    following = defaultdict(Counter)   # (路線, 停留所) -> 次の停留所の回数
+    for (route, prev, stop, kind, hour), values in samples.items():
+        by_hour[(route, prev, stop, kind, hour)] = statistics.median(values)
+        by_kind[(route, prev, stop, kind)].extend(values)
+        overall[(route, prev, stop)].extend(values)
+        following[(route, prev)][stop] += len(values)
+    by_kind = {k: statistics.median(v) for k, v in by_kind.items()}
+    overall = {k: statistics.median(v) for k, v in overall.items()}
+    nxt = {k: c.most_common(1)[0][0] for k, c in following.items()}
+
+    eta = {}
+    kinds = {k[3] for k in by_kind}
+    for route, stop in nxt:
+        for kind in kinds:
+            for hour in range(24):
+                total, cur, seen = 0.0, stop, set()
+                while cur != ARRIVED and cur not in seen:
+                    seen.add(cur)
+                    after = nxt.get((route, cur))
+                    if after is None:
+                        break
+                    h = (hour + int(total // 3600)) % 24
+                    total += by_hour.get((route, cur, after, kind, h),
+                                         by_kind.get((route, cur, after, kind), overall[(route, cur, after)]))
+                    cur = after
+                if cur == ARRIVED:
+                    eta[(route, stop, kind, hour)] = round(total)
+    log.info("travel_times.aggregated", days=days, segments=len(overall), eta=len(eta))
+    return EtaTable(eta, holidays, datetime.now().isoformat(timespec="seconds"))
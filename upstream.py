@@ -0,0 +1,158 @@
+"""Bus-Vision へのリクエストの全体制御（優先度付きのレート制限とサーキットブレーカー）"""
+
+import heapq
+import itertools
+import threading
+import time
+
+from logs import get_logger
+from ratelimit import TokenBucket
+
+log = get_logger("upstream")
+
+ADMIT, SHED, OPEN = "admit", "shed", "open"
+
+CLOSED, HALF_OPEN = "closed", "half_open"
+
+
+class CircuitBreaker:
+    """連続 failures 回の失敗（slow 秒を超えた応答も失敗とみなす）で開き、reset_timeout 秒は通さない
+
+    reset_timeout 秒たつと 1 件だけ試しに通し（half_open）、成功すれば閉じる・失敗すればまた開く。
+    on_change(state) は状態が変わるたびに呼ぶ。
+    """
+
+    def __init__(self, failures: int = 5, slow: float = 8.0, reset_timeout: float = 30.0,
+                 on_change=None, clock=time.monotonic):
+        self.failures = failures
+        self.slow = slow
+        self.reset_timeout = reset_timeout
+        self.on_change = on_change
+        self.clock = clock
+        self.state = CLOSED
+        self.trips = 0
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and self.clock() - self._opened_at >= self.reset_timeout:
+                self._set(HALF_OPEN)
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def cancel_probe(self):
+        """allow() で通した試しのリクエストを送らなかった"""
+        with self._lock:
+            self._probing = False
+
+    def record(self, ok: bool, elapsed: float = 0.0):
+        with self._lock:
+            self._probing = False
+            if ok and elapsed <= self.slow:
+                self._consecutive = 0
+                if self.state != CLOSED:
+                    self._set(CLOSED)
+                return
+            self._consecutive += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self._consecutive >= self.failures):
+                self._opened_at = self.clock()
+                self.trips += 1
+                self._set(OPEN)
+
+    def retry_after(self) -> float:
+        """次に試せるまでの秒数（閉じていれば 0）"""
+        with self._lock:
+            if self.state != OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout - (self.clock() - self._opened_at))
+
+    def _set(self, state):
+        self.state = state
+        if state == CLOSED:
+            log.info("breaker.state", state=state)
+        else:
+            log.warning("breaker.state", state=state)
+        if self.on_change:
+            # ロックを持ったまま呼ぶので、on_change からこのブレーカーを触らないこと
+            self.on_change(state)
+
+
+class UpstreamGate:
+    """全ポーリングが共有する rate 回/秒の予算を、乗車時刻が近い順に配る
+
+    admit(priority) は ADMIT / SHED / OPEN を返す。priority は乗車時刻までの秒数（小さいほど優先）。
+    - トークンがあればすぐ ADMIT。足りなければ優先度の高い順に最大 max_wait 秒待たせる
+    - 予算が足りないとき、乗車時刻まで shed_after 秒より先の監視は待たずに SHED（次回に回す）
+    - ブレーカーが開いている間は OPEN（送らない）
+    """
+
+    def __init__(self, rate: float, burst: float = None, breaker: CircuitBreaker = None,
+                 max_wait: float = 2.0, shed_after: float = 300.0, clock=time.monotonic):
+        self.bucket = TokenBucket(rate, burst, clock=clock)
+        self.breaker = breaker or CircuitBreaker(clock=clock)
+        self.max_wait = max_wait
+        self.shed_after = shed_after
+        self.clock = clock
+        self._waiting = []    # (priority, seq)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stats = {"admitted": 0, "throttled": 0, "shed": 0, "rejected_open": 0}
+
+    def admit(self, priority: float) -> str:
+        if not self.breaker.allow():
+            self._count("rejected_open")
+            return OPEN
+        with self._cond:
+            if not self._waiting and self.bucket.try_acquire():
+                self._stats["admitted"] += 1
+                return ADMIT
+            if priority > self.shed_after:
+                self._stats["shed"] += 1
+                self.breaker.cancel_probe()
+                return SHED
+            self._stats["throttled"] += 1
+            entry = (priority, next(self._seq))
+            heapq.heappush(self._waiting, entry)
+            deadline = self.clock() + self.max_wait
+            try:
+                while True:
+                    if self._waiting[0] == entry and self.bucket.try_acquire():
+                        self._stats["admitted"] += 1
+                        return ADMIT
+                    remaining = deadline - self.clock()
+                    if remaining <= 0:
+                        self._stats["shed"] += 1
+                        self.breaker.cancel_probe()
+                        return SHED
+                    self._cond.wait(min(remaining, max(0.001, self.bucket.wait_time())))
+            finally:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+
+    def record(self, ok: bool, elapsed: float):
+        self.breaker.record(ok, elapsed)
+
+    def retry_after(self) -> float:
+        return self.breaker.retry_after()
+
+    def _count(self, name):
+        with self._cond:
+            self._stats[name] += 1
+
+    def stats(self):
+        with self._cond:
+            return {
+                **self._stats,
+                "waiting": len(self._waiting),
+                "tokens": round(self.bucket.tokens, 2),
+                "breaker": self.breaker.state,
+                "breaker_trips": self.breaker.trips,
+            }